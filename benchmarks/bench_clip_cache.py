@@ -0,0 +1,118 @@
+"""
+Times loading training clips from a dataset split: decoding the videos on every item, like the `pytorchvideo.data.Ucf101`
+datasets of the fine-tuning notebooks, against slicing them out of a pre-decoded `build_clip_cache` cache.
+
+Without --dataset, a split of synthetic videos is written to a temporary folder. The Ucf101 path is skipped when
+pytorchvideo isn't installed, and a plain OpenCV decode-and-subsample loader is timed in any case.
+
+Usage: python -m benchmarks.bench_clip_cache --dataset dataset/train --num-workers 4
+"""
+import argparse
+import pathlib
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import pandas as pd
+import torch
+
+from model_utils import build_clip_cache, ClipCacheDataset, decode_video_frames, _list_labelled_videos
+
+NUM_FRAMES = 16
+SAMPLE_RATE = 4
+FPS = 30
+
+
+def write_synthetic_split(split_directory: pathlib.Path, videos_per_class: int, resolution=(320, 256),
+                          seconds: int = 5):
+    rng = np.random.default_rng(0)
+    for label in ('DUNK', 'JUMP_SHOT', 'LAYUP'):
+        split_directory.joinpath(label).mkdir(parents=True, exist_ok=True)
+        for i in range(videos_per_class):
+            writer = cv2.VideoWriter(str(split_directory / label / f"{label}_{i}.avi"),
+                                     cv2.VideoWriter_fourcc(*"XVID"), FPS, resolution)
+            background = rng.integers(0, 255, (resolution[1], resolution[0], 3), dtype=np.uint8)
+            for frame_number in range(seconds * FPS):
+                writer.write(np.roll(background, 4 * frame_number, axis=1))
+            writer.release()
+
+
+class _DecodeEveryTimeDataset(torch.utils.data.Dataset):
+    """ What the Ucf101 path does per item: decode the video, then subsample a clip of it """
+
+    def __init__(self, split_directory: pathlib.Path, resolution):
+        self.videos, self.label2id = _list_labelled_videos(split_directory)
+        self.resolution = resolution
+
+    def __len__(self):
+        return len(self.videos)
+
+    def __getitem__(self, index):
+        video_path, label = self.videos[index]
+        frames = decode_video_frames(str(video_path), SAMPLE_RATE, NUM_FRAMES, self.resolution)
+        return {'video': torch.from_numpy(frames).permute(3, 0, 1, 2), 'label': self.label2id[label]}
+
+
+def _ucf101_dataset(split_directory: pathlib.Path):
+    import pytorchvideo.data
+    from pytorchvideo.transforms import ApplyTransformToKey, UniformTemporalSubsample
+
+    return pytorchvideo.data.Ucf101(
+        data_path=str(split_directory),
+        clip_sampler=pytorchvideo.data.make_clip_sampler("random", NUM_FRAMES * SAMPLE_RATE / FPS),
+        decode_audio=False,
+        transform=ApplyTransformToKey("video", UniformTemporalSubsample(NUM_FRAMES)),
+    )
+
+
+def time_clips_per_second(dataset, number_of_clips: int, num_workers: int, batch_size: int = 8) -> float:
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, num_workers=num_workers)
+    loaded_clips = 0
+    start_time = time.perf_counter()
+    while loaded_clips < number_of_clips:
+        for batch in loader:
+            loaded_clips += len(batch['label'])
+            if loaded_clips >= number_of_clips:
+                break
+    return loaded_clips / (time.perf_counter() - start_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', type=pathlib.Path, help="A split folder, like dataset/train")
+    parser.add_argument('--videos-per-class', type=int, default=16, help="For the synthetic split")
+    parser.add_argument('--clips', type=int, default=256)
+    parser.add_argument('--num-workers', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        temp_directory = pathlib.Path(temp_directory)
+        split_directory = args.dataset
+        if split_directory is None:
+            split_directory = temp_directory / "train"
+            write_synthetic_split(split_directory, args.videos_per_class)
+        resolution = (320, 256)
+
+        start_time = time.perf_counter()
+        build_clip_cache(split_directory, temp_directory / "cache", frame_stride=SAMPLE_RATE,
+                         frames_per_video=38, resolution=resolution)
+        print(f"Cache built in {time.perf_counter() - start_time:.1f}s")
+
+        results = {
+            'decode every item (OpenCV)': time_clips_per_second(_DecodeEveryTimeDataset(split_directory, resolution),
+                                                                args.clips, args.num_workers),
+            'clip cache': time_clips_per_second(ClipCacheDataset(temp_directory / "cache", num_frames=NUM_FRAMES),
+                                                args.clips, args.num_workers),
+        }
+        try:
+            results['pytorchvideo Ucf101'] = time_clips_per_second(_ucf101_dataset(split_directory), args.clips,
+                                                                   args.num_workers)
+        except ImportError:
+            print("pytorchvideo isn't installed, skipping the Ucf101 path")
+
+    print(pd.DataFrame({'clips/sec': results}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Times training a classification head from an `extract_clip_features` cache against running the backbone: the one-time
+extraction, an epoch of the backbone's forward pass over the same clips (what every epoch of a fine-tuning experiment
+pays, before the backward pass), and training linear and MLP heads for every class grouping.
+
+By default it runs a small random VideoMAE over a synthetic split, so the accuracies are meaningless, but the speed
+isn't. Pass --model and --dataset for a real checkpoint and split.
+
+Usage: python -m benchmarks.bench_feature_heads --model omermazig/videomae-finetuned-nba-5-class-4-batch-8000-vid-multiclass --dataset dataset/train
+"""
+import argparse
+import pathlib
+import tempfile
+import time
+
+import pandas as pd
+import torch
+
+from benchmarks.bench_clip_cache import write_synthetic_split
+from benchmarks.synthetic import make_small_random_video_classifier
+from model_utils import (ClipFeatureStore, collate_multi_clip, extract_clip_features, load_video_classifier,
+                         MultiClipEvaluationDataset, train_feature_head)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', help="A checkpoint name or folder. Defaults to a small random VideoMAE.")
+    parser.add_argument('--dataset', type=pathlib.Path, help="A split folder. Defaults to a synthetic one.")
+    parser.add_argument('--videos-per-class', type=int, default=8, help="For the synthetic split")
+    parser.add_argument('--clips-per-video', type=int, default=2)
+    parser.add_argument('--epochs', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    model, preprocessor = load_video_classifier(args.model) if args.model else make_small_random_video_classifier()
+    with tempfile.TemporaryDirectory() as temp_directory:
+        temp_directory = pathlib.Path(temp_directory)
+        split_directory = args.dataset
+        if split_directory is None:
+            split_directory = temp_directory / "train"
+            write_synthetic_split(split_directory, args.videos_per_class, seconds=3)
+
+        dataset = MultiClipEvaluationDataset(split_directory, preprocessor, clips_per_video=args.clips_per_video)
+        batches = list(torch.utils.data.DataLoader(dataset, batch_size=4, collate_fn=collate_multi_clip))
+        start_time = time.perf_counter()
+        with torch.inference_mode():
+            for batch in batches:
+                model(pixel_values=batch['pixel_values'])
+        backbone_epoch_seconds = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        extract_clip_features(model, preprocessor, split_directory, temp_directory / "features",
+                              clips_per_video=args.clips_per_video, views=('center', 'flipped'))
+        extraction_seconds = time.perf_counter() - start_time
+        store = ClipFeatureStore(temp_directory / "features")
+        features_shape = store.features.shape
+
+        labels = sorted(store.label2id)
+        groupings = {'a class per label': None, 'first label vs the rest': {labels[0]: labels[:1],
+                                                                             'OTHER': labels[1:]}}
+        rows = []
+        for grouping, label_groups in groupings.items():
+            for head, hidden_size in (('linear', None), ('MLP', 256)):
+                _, results = train_feature_head(store, label_groups=label_groups, hidden_size=hidden_size,
+                                                epochs=args.epochs)
+                rows.append({'classes': grouping, 'head': head, 'seconds': results['seconds'],
+                             'seconds/epoch': results['seconds'] / args.epochs, 'accuracy': results['accuracy']})
+
+    print(f"{features_shape[0]} videos, {features_shape[1]} clip views each, "
+          f"{features_shape[2]}-dimensional embeddings")
+    print(f"Backbone forward pass: {backbone_epoch_seconds:.2f}s/epoch (without the decoding), "
+          f"feature extraction: {extraction_seconds:.2f}s once")
+    print(pd.DataFrame(rows).round(4).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Times `model_utils.detect_shots_in_video` over long videos on CPU: its real-time factor (processing seconds per video
+second, so below 1 is faster than real time), windows per second, and peak memory. Every video is run in a fresh
+process, so the peak memory of a long video can be compared to a short one's, which should be about the same.
+
+By default it runs a small random VideoMAE (so the detections are meaningless, but the speed isn't) over synthetic
+videos of each --minutes. Pass --model and --video for a real checkpoint and game.
+
+Usage: python -m benchmarks.bench_full_game_detection --model omermazig/videomae-finetuned-nba-5-class-4-batch-8000-vid-multiclass --video game.mp4 --threads 4
+"""
+import argparse
+import multiprocessing
+import pathlib
+import resource
+import tempfile
+
+import pandas as pd
+import torch
+
+from benchmarks.synthetic import make_small_random_video_classifier, write_synthetic_video
+from model_utils import detect_shots_in_video, load_video_classifier
+
+
+def _detect(checkpoint: str, video_path: str, stride_seconds: float, batch_size: int, threads: int) -> dict:
+    """ Runs in its own process """
+    torch.set_num_threads(threads)
+    model, preprocessor = load_video_classifier(checkpoint) if checkpoint else make_small_random_video_classifier()
+    baseline_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    detections, stats = detect_shots_in_video(model, preprocessor, video_path, stride_seconds=stride_seconds,
+                                              batch_size=batch_size)
+    return {'video_minutes': stats['video_seconds'] / 60, 'real_time_factor': stats['real_time_factor'],
+            'windows/sec': stats['windows'] / stats['seconds'], 'detections': len(detections),
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - baseline_rss_mb}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', help="A checkpoint name or folder. Defaults to a small random VideoMAE.")
+    parser.add_argument('--video', type=pathlib.Path, action='append', help="Can be given more than once")
+    parser.add_argument('--minutes', type=float, nargs='+', default=[1, 4], help="Synthetic videos lengths")
+    parser.add_argument('--stride-seconds', type=float, default=1.0)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        video_paths = args.video
+        if not video_paths:
+            video_paths = []
+            for minutes in args.minutes:
+                video_paths.append(pathlib.Path(temp_directory, f"game_{minutes:g}_minutes.mp4"))
+                write_synthetic_video(video_paths[-1], seconds=minutes * 60, resolution=(640, 360))
+        rows = []
+        with multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+            for video_path in video_paths:
+                result = pool.apply(_detect, (args.model, str(video_path), args.stride_seconds, args.batch_size,
+                                              args.threads))
+                rows.append({'video': video_path.name, **result})
+    print(pd.DataFrame(rows).round(3).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
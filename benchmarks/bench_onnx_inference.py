@@ -0,0 +1,121 @@
+"""
+Compares CPU inference engines for a video classifier: the eager PyTorch model, its ONNX Runtime export, and the int8
+quantized export (see `model_utils.export_video_classifier`).
+
+Reports the latency per batch, clips per second, memory and artifact size of each engine, then a parity check of the
+exports against the eager model (accuracy, f1, agreement and logits difference) on --dataset, or on a split of
+synthetic videos. Each engine is timed in a fresh process, so its memory (the resident memory it adds over the imports)
+is measured on its own.
+
+By default it uses a randomly initialized small VideoMAE (so its accuracy is meaningless, but the parity isn't).
+Pass --model for a real checkpoint.
+
+Usage: python -m benchmarks.bench_onnx_inference --model omermazig/videomae-finetuned-nba-5-class-4-batch-8000-vid-multiclass --dataset dataset/test --threads 4
+"""
+import argparse
+import multiprocessing
+import os
+import pathlib
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+
+from benchmarks.bench_clip_cache import write_synthetic_split
+from benchmarks.synthetic import make_small_random_video_classifier
+from model_utils import (compare_video_classifiers, export_video_classifier, load_onnx_video_classifier,
+                         load_video_classifier, MultiClipEvaluationDataset, tune_intra_op_num_threads)
+
+
+def _rss_mb() -> float:
+    """ The resident memory of this process (Linux only) """
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def _load_engine(engine: str, checkpoint: str, export_directory: str, threads: int):
+    if engine == 'eager':
+        torch.set_num_threads(threads)
+        model, _ = load_video_classifier(checkpoint) if checkpoint else (torch.load(
+            pathlib.Path(export_directory, 'eager.pt'), weights_only=False), None)
+        return model
+    model, _ = load_onnx_video_classifier(export_directory, quantized=engine == 'onnx int8',
+                                          intra_op_num_threads=threads)
+    return model
+
+
+def _time_engine(engine: str, checkpoint: str, export_directory: str, input_shape: tuple, threads: int,
+                 repeats: int) -> dict:
+    """ Runs in its own process """
+    baseline_rss_mb = _rss_mb()
+    model = _load_engine(engine, checkpoint, export_directory, threads)
+    pixel_values = torch.from_numpy(np.random.default_rng(0).standard_normal(input_shape, dtype=np.float32))
+    with torch.inference_mode():
+        # Warm up
+        model(pixel_values=pixel_values)
+        start_time = time.perf_counter()
+        for _ in range(repeats):
+            model(pixel_values=pixel_values)
+        seconds_per_batch = (time.perf_counter() - start_time) / repeats
+    return {'ms/batch': seconds_per_batch * 1000, 'clips/sec': input_shape[0] / seconds_per_batch,
+            'rss_mb': _rss_mb() - baseline_rss_mb}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', help="A checkpoint name or folder. Defaults to a small random VideoMAE.")
+    parser.add_argument('--dataset', type=pathlib.Path, help="A split folder for the parity check")
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=1, help="Intra-op threads of every engine")
+    parser.add_argument('--tune-threads', action='store_true', help="Also time the int8 model per thread count")
+    args = parser.parse_args()
+    torch.set_grad_enabled(False)
+
+    model, preprocessor = load_video_classifier(args.model) if args.model else make_small_random_video_classifier()
+    input_shape = (args.batch_size, preprocessor.num_frames, 3) + tuple(preprocessor.crop_size)
+    with tempfile.TemporaryDirectory() as temp_directory:
+        export_directory = pathlib.Path(temp_directory, 'engine')
+        start_time = time.perf_counter()
+        export_video_classifier(model, preprocessor, export_directory)
+        print(f"Exported in {time.perf_counter() - start_time:.1f} seconds")
+        if not args.model:
+            torch.save(model, export_directory.joinpath('eager.pt'))
+
+        eager_size = sum(tensor.numel() * tensor.element_size() for tensor in model.state_dict().values())
+        artifact_sizes = {'eager': eager_size, 'onnx': export_directory.joinpath('model.onnx').stat().st_size,
+                          'onnx int8': export_directory.joinpath('model.int8.onnx').stat().st_size}
+        rows = []
+        with multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+            for engine in artifact_sizes:
+                result = pool.apply(_time_engine, (engine, args.model, str(export_directory), input_shape,
+                                                   args.threads, args.repeats))
+                rows.append({'engine': engine, **result, 'artifact_mb': artifact_sizes[engine] / 2 ** 20})
+        print(pd.DataFrame(rows).round(1).to_string(index=False))
+
+        if args.tune_threads:
+            seconds_per_batch = tune_intra_op_num_threads(export_directory.joinpath('model.int8.onnx'),
+                                                          np.zeros(input_shape, dtype=np.float32))
+            print("int8 ms/batch per intra-op threads:",
+                  {threads: round(seconds * 1000, 1) for threads, seconds in seconds_per_batch.items()})
+
+        dataset_path = args.dataset
+        if dataset_path is None:
+            dataset_path = pathlib.Path(temp_directory, 'split')
+            write_synthetic_split(dataset_path, videos_per_class=4, seconds=3)
+        dataset = MultiClipEvaluationDataset(dataset_path, preprocessor, label2id=model.config.label2id
+                                             if args.dataset else None)
+        classifiers = {'eager': model}
+        for engine in ('onnx', 'onnx int8'):
+            classifiers[engine] = _load_engine(engine, args.model, str(export_directory), args.threads)
+        torch.set_num_threads(args.threads)
+        comparison = compare_video_classifiers(classifiers, dataset, batch_size=args.batch_size)
+        print(comparison.drop(columns='classification_report').round(4).to_string())
+        for engine, report in comparison['classification_report'].items():
+            print(f"\n{engine}:\n{report}")
+
+
+if __name__ == '__main__':
+    main()
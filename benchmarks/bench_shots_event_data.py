@@ -0,0 +1,84 @@
+"""
+Times the shot events filtering of many games: the original row by row function called per game, against the
+vectorised function called once on all the games.
+
+Usage: python -m benchmarks.bench_shots_event_data --games 2000
+"""
+import argparse
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from benchmarks.synthetic import make_synthetic_pbp_data
+from utils import get_shots_event_data_from_games_df, putback_classes
+
+
+def get_shots_event_data_from_game_df_rowwise(df):
+    """ The original row by row implementation of `get_shots_event_data_from_game_df`, for reference """
+    REBOUND_EVENT_TYPE = 4
+
+    time_format = "%M:%S"
+    # Add time from last event based on the shot clock
+    df['TIME_FROM_PREVIOUS_EVENT'] = \
+        df['PCTIMESTRING'].shift(1, fill_value="12:00").apply(lambda x: datetime.strptime(x, time_format)) - \
+        df['PCTIMESTRING'].apply(lambda x: datetime.strptime(x, time_format))
+    # Remove shots which happens less than 4 secs directly after/before a rebound. These videos likely contains 2 shots.
+    indices_to_remove = df[
+        # Event is a rebound
+        (df['EVENTMSGTYPE'] == REBOUND_EVENT_TYPE) &
+        # Event less than 4 seconds after is a shot
+        ((df['EVENTMSGTYPE'].shift(1) == 2) & (df['TIME_FROM_PREVIOUS_EVENT'] < pd.Timedelta(seconds=4))) &
+        # Event less than 4 seconds before is a shot
+        ((df['EVENTMSGTYPE'].shift(-1) <= 2) & (df['TIME_FROM_PREVIOUS_EVENT'].shift(-1) < pd.Timedelta(seconds=4)))
+        ].index
+    adjacent_indices = [index - 1 for index in indices_to_remove] + [index + 1 for index in indices_to_remove]
+    # Remove rows from df based on indices
+    df = df.drop(indices_to_remove).drop(adjacent_indices)
+    # Remove every play other than a shot
+    df = df[df['EVENTMSGTYPE'] <= 2]
+    # Remove plays without video
+    df = df[df["VIDEO_AVAILABLE_FLAG"] == 1]
+    # Remove blocked shots. We don't want them because They'll be harder to classify
+    df = df[~(df['HOMEDESCRIPTION'].str.contains('BLOCK') | df['VISITORDESCRIPTION'].str.contains('BLOCK'))]
+    # Remove tip and putback shots. They will be hard to classify
+    df = df[~df['EVENTMSGACTIONTYPE'].isin(putback_classes.keys())]
+    # Create `DESCRIPTION` from either teams column (doesn't matter to us)
+    # Makes sure before that we didn't mess up, and have a play wite 2 descriptions
+    if df[['VISITORDESCRIPTION', 'HOMEDESCRIPTION']].notna().all(axis=1).any():
+        raise ValueError("df has a row where both `VISITORDESCRIPTION` and `HOMEDESCRIPTION` and not None")
+    df['DESCRIPTION'] = df['HOMEDESCRIPTION'].fillna(df['VISITORDESCRIPTION'])
+    # Make sure that every line has a not-None description
+    if not df['DESCRIPTION'].notna().all():
+        raise ValueError("df has a row where `DESCRIPTION` is None")
+    # Filter out irrelevant data
+    shots_event_data = df[
+        ['EVENTNUM', 'EVENTMSGACTIONTYPE', 'PERIOD', 'PCTIMESTRING', 'DESCRIPTION', 'EVENTMSGTYPE',
+         'VIDEO_AVAILABLE_FLAG']]
+    return shots_event_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--games', type=int, default=2000)
+    args = parser.parse_args()
+
+    df = make_synthetic_pbp_data(number_of_games=args.games)
+    print(f"{args.games} games, {len(df.index)} events")
+
+    start_time = time.perf_counter()
+    per_game = [get_shots_event_data_from_game_df_rowwise(game_df.reset_index(drop=True))
+                for _, game_df in df.groupby('GAME_ID', sort=False)]
+    rowwise_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    vectorised = get_shots_event_data_from_games_df(df)
+    vectorised_seconds = time.perf_counter() - start_time
+
+    assert sum(len(game_df.index) for game_df in per_game) == len(vectorised.index)
+    print(pd.DataFrame({'seconds': [rowwise_seconds, vectorised_seconds]}, index=['rowwise', 'vectorised']))
+    print(f"x{rowwise_seconds / vectorised_seconds:.1f} faster")
+
+
+if __name__ == '__main__':
+    main()
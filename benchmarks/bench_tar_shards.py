@@ -0,0 +1,86 @@
+"""
+Times reading a dataset split from its folder layout (a file per video, as copied from Drive) against reading it from
+the tar shards of `pack_dataset_shards`: the raw read throughput of every video, and the training clips per second of
+a DataLoader over each (decoding a clip of every video, like the notebooks' Ucf101 datasets).
+
+Without --dataset, a dataset of synthetic videos is written to a temporary folder. On a local disk most of the files
+are in the page cache after packing, so pass --drop-caches (as root, Linux only) to read them cold, which is closer
+to a mounted Drive, where every small file is a round trip.
+
+Usage: python -m benchmarks.bench_tar_shards --dataset dataset --split train --num-workers 4 --drop-caches
+"""
+import argparse
+import os
+import pathlib
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.bench_clip_cache import (_DecodeEveryTimeDataset, NUM_FRAMES, SAMPLE_RATE, time_clips_per_second,
+                                         write_synthetic_split)
+from model_utils import _list_labelled_videos, pack_dataset_shards, ShardedClipDataset
+
+
+def _drop_page_cache():
+    os.sync()
+    with open('/proc/sys/vm/drop_caches', 'w') as f:
+        f.write('3\n')
+
+
+def _read_megabytes_per_second(paths, block_size: int = 2 ** 20) -> float:
+    read_bytes = 0
+    start_time = time.perf_counter()
+    for path in paths:
+        with open(path, 'rb', buffering=0) as f:
+            while block := f.read(block_size):
+                read_bytes += len(block)
+    return read_bytes / 2 ** 20 / (time.perf_counter() - start_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', type=pathlib.Path, help="A dataset folder, with a folder per split")
+    parser.add_argument('--split', default='train')
+    parser.add_argument('--videos-per-class', type=int, default=64, help="For the synthetic dataset")
+    parser.add_argument('--max-shard-mb', type=int, default=256)
+    parser.add_argument('--clips', type=int, default=256)
+    parser.add_argument('--num-workers', type=int, default=0)
+    parser.add_argument('--drop-caches', action='store_true', help="Drop the page cache before every read")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        temp_directory = pathlib.Path(temp_directory)
+        dataset_directory = args.dataset
+        if dataset_directory is None:
+            dataset_directory = temp_directory / "dataset"
+            write_synthetic_split(dataset_directory / args.split, args.videos_per_class, seconds=3)
+        split_directory = dataset_directory / args.split
+
+        start_time = time.perf_counter()
+        pack_dataset_shards(dataset_directory, temp_directory / "shards", max_shard_bytes=args.max_shard_mb * 2 ** 20)
+        print(f"Packed in {time.perf_counter() - start_time:.1f}s")
+        shards_directory = temp_directory / "shards" / args.split
+
+        readers = {
+            'folder per video': (
+                [path for path, _ in _list_labelled_videos(split_directory)[0]],
+                lambda: _DecodeEveryTimeDataset(split_directory, resolution=None)),
+            'tar shards': (
+                sorted(shards_directory.glob("shard-*.tar")),
+                lambda: ShardedClipDataset(shards_directory, num_frames=NUM_FRAMES, sample_rate=SAMPLE_RATE)),
+        }
+        rows = {}
+        for name, (paths, make_dataset) in readers.items():
+            if args.drop_caches:
+                _drop_page_cache()
+            rows[name] = {'files': len(paths), 'read MB/sec': _read_megabytes_per_second(paths)}
+            if args.drop_caches:
+                _drop_page_cache()
+            rows[name]['clips/sec'] = time_clips_per_second(make_dataset(), args.clips, args.num_workers)
+
+    print(pd.DataFrame(rows).T.round(1))
+
+
+if __name__ == '__main__':
+    main()
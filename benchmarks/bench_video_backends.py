@@ -0,0 +1,62 @@
+"""
+Times the video backends of `change_video_resolution_and_fps` and `cut_video` (see `utils.VideoBackend`) on synthetic
+broadcast-sized clips:
+- downscale: the whole clip to the dataset resolution
+- downscale + fps: the same, also halving the fps
+- cut: 5 seconds from the middle of the clip, downscaled (what `cut_video` writes once it found the shot)
+- cut, no resize: 5 seconds at the original resolution and fps (a stream copy for the pyav backend)
+
+Usage: python -m benchmarks.bench_video_backends --seconds 20 --resolution 1280x720
+"""
+import argparse
+import pathlib
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic import write_synthetic_video
+from utils import get_video_backend, video_backends
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--resolution', default='1280x720')
+    parser.add_argument('--backends', nargs='+', default=list(video_backends))
+    args = parser.parse_args()
+    resolution = tuple(int(x) for x in args.resolution.split('x'))
+    number_of_frames = int(args.seconds * args.fps)
+
+    cases = {
+        'downscale': dict(new_resolution=(320, 256), new_fps=args.fps),
+        'downscale + fps': dict(new_resolution=(320, 256), new_fps=args.fps // 2),
+        'cut': dict(new_resolution=(320, 256), new_fps=args.fps, start_frame=number_of_frames // 2,
+                    number_of_frames=5 * args.fps),
+        'cut, no resize': dict(start_frame=number_of_frames // 2, number_of_frames=5 * args.fps),
+    }
+    rows = []
+    with tempfile.TemporaryDirectory() as temp_directory:
+        video_path = pathlib.Path(temp_directory, 'video.mp4')
+        write_synthetic_video(video_path, args.seconds, args.fps, resolution)
+        for backend_name in args.backends:
+            try:
+                backend = get_video_backend(backend_name)
+            except ImportError as e:
+                print(f"Skipping {backend_name}: {e}")
+                continue
+            for case_name, kwargs in cases.items():
+                start_time = time.perf_counter()
+                frames_written = backend.transcode(str(video_path), str(pathlib.Path(temp_directory, 'out.avi')),
+                                                   **kwargs)
+                seconds = time.perf_counter() - start_time
+                source_frames = kwargs.get('number_of_frames', number_of_frames)
+                rows.append({'backend': backend_name, 'case': case_name, 'frames written': frames_written,
+                             'seconds': seconds, 'source frames/sec': source_frames / seconds})
+
+    print(pd.DataFrame(rows).pivot(index='case', columns='backend', values='source frames/sec').round(1))
+
+
+if __name__ == '__main__':
+    main()
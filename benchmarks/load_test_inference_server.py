@@ -0,0 +1,101 @@
+"""
+Load-tests the inference server (see `inference_server.py`) on CPU: sends requests from concurrent clients, and reports
+the client side p50/p99 latency and throughput, with the server's mean batch size.
+
+By default it starts the server in-process, once per --max-batch-sizes value, with a randomly initialized small VideoMAE
+(so no checkpoint download is needed, and it runs in reasonable time on CPU). Pass --model for a real checkpoint, or
+--url to load-test a server that is already running.
+
+Usage: python -m benchmarks.load_test_inference_server --requests 64 --concurrency 1 8 --max-batch-sizes 1 8
+"""
+import argparse
+import concurrent.futures
+import json
+import pathlib
+import tempfile
+import threading
+import time
+import urllib.request
+
+import numpy as np
+import pandas as pd
+import torch
+
+from benchmarks.synthetic import make_small_random_video_classifier, write_synthetic_video
+from inference_server import ShotClassifierService, make_inference_server
+from model_utils import load_video_classifier
+
+
+def _send_request(url: str, video_path: pathlib.Path, upload: bool) -> float:
+    if upload:
+        request = urllib.request.Request(f"{url}/predict", data=video_path.read_bytes(),
+                                         headers={'Content-Type': 'video/x-msvideo'})
+    else:
+        request = urllib.request.Request(f"{url}/predict", data=json.dumps({'path': str(video_path)}).encode(),
+                                         headers={'Content-Type': 'application/json'})
+    start_time = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=600) as response:
+        response.read()
+    return (time.perf_counter() - start_time) * 1000
+
+
+def run_load(url: str, video_path: pathlib.Path, number_of_requests: int, concurrency: int, upload: bool) -> dict:
+    # Warm up (the first requests pay for the workers start, and for the first batch of the model)
+    for _ in range(2):
+        _send_request(url, video_path, upload)
+    start_time = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(lambda _: _send_request(url, video_path, upload), range(number_of_requests)))
+    seconds = time.perf_counter() - start_time
+    return {'p50_ms': np.percentile(latencies, 50), 'p99_ms': np.percentile(latencies, 99),
+            'requests/sec': number_of_requests / seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="Load-test a running server, instead of starting one")
+    parser.add_argument('--model', help="A checkpoint for the in-process server. Defaults to a small random VideoMAE.")
+    parser.add_argument('--video', type=pathlib.Path, help="Defaults to a synthetic 5 seconds clip")
+    parser.add_argument('--requests', type=int, default=32)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--max-batch-sizes', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--max-wait-ms', type=float, default=20)
+    parser.add_argument('--upload', action='store_true', help="Upload the video, instead of sending its path")
+    args = parser.parse_args()
+    torch.set_grad_enabled(False)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as temp_directory:
+        video_path = args.video
+        if video_path is None:
+            video_path = pathlib.Path(temp_directory, 'video.avi')
+            write_synthetic_video(video_path, seconds=5, resolution=(320, 256), fourcc='XVID')
+
+        if args.url:
+            for concurrency in args.concurrency:
+                rows.append({'concurrency': concurrency,
+                             **run_load(args.url, video_path, args.requests, concurrency, args.upload)})
+        else:
+            model, preprocessor = load_video_classifier(args.model) if args.model \
+                else make_small_random_video_classifier()
+            for max_batch_size in args.max_batch_sizes:
+                for concurrency in args.concurrency:
+                    service = ShotClassifierService(model, preprocessor, model.config.id2label, max_batch_size,
+                                                    args.max_wait_ms)
+                    server = make_inference_server(service, port=0)
+                    threading.Thread(target=server.serve_forever, daemon=True).start()
+                    try:
+                        result = run_load(f"http://127.0.0.1:{server.server_address[1]}", video_path,
+                                          args.requests, concurrency, args.upload)
+                        rows.append({'max_batch_size': max_batch_size, 'concurrency': concurrency, **result,
+                                     'mean_batch_size': service.stats()['mean_batch_size']})
+                    finally:
+                        server.shutdown()
+                        server.server_close()
+                        service.close()
+
+    print(pd.DataFrame(rows).round(1).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Runs the benchmark suite (`benchmarks/suite`, with pytest-benchmark) on synthetic inputs, and saves the results as JSON
+in benchmarks/results, named after the commit (`<run number>_<commit>_<date>.json`). Compare runs with
+`pytest-benchmark compare --storage benchmarks/results`, or pass --compare to compare to the previous run as part of
+this one.
+
+The benchmark files are named bench_*.py so the regular test run doesn't pick them up. Arguments this script doesn't
+know go to pytest.
+
+Usage: python -m benchmarks.run_suite
+   or: python -m benchmarks.run_suite --compare --fail-on-slowdown 10 -k cut_video
+"""
+import argparse
+import pathlib
+import sys
+
+import pytest
+
+BENCHMARKS_DIRECTORY = pathlib.Path(__file__).parent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--storage', type=pathlib.Path, default=BENCHMARKS_DIRECTORY / 'results')
+    parser.add_argument('--compare', nargs='?', const='', metavar='RUN',
+                        help="Compare to a saved run (its number or id). Defaults to the last one.")
+    parser.add_argument('--fail-on-slowdown', type=float, metavar='PERCENT',
+                        help="With --compare, fail if a benchmark's median got slower by more than this")
+    parser.add_argument('--no-save', action='store_true', help="Don't save the results of this run")
+    args, pytest_args = parser.parse_known_args()
+
+    pytest_args = [str(BENCHMARKS_DIRECTORY / 'suite'), '-o', 'python_files=bench_*.py',
+                   f"--benchmark-storage=file://{args.storage.absolute()}",
+                   '--benchmark-columns=min,median,max,rounds', '--benchmark-sort=fullname', *pytest_args]
+    if not args.no_save:
+        pytest_args.append('--benchmark-autosave')
+    if args.compare is not None:
+        pytest_args.append(f"--benchmark-compare={args.compare}" if args.compare else '--benchmark-compare')
+        if args.fail_on_slowdown is not None:
+            pytest_args.append(f"--benchmark-compare-fail=median:{args.fail_on_slowdown:g}%")
+    sys.exit(pytest.main(pytest_args))
+
+
+if __name__ == '__main__':
+    main()
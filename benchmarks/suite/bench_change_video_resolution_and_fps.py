@@ -0,0 +1,18 @@
+"""
+`change_video_resolution_and_fps` of a whole 720p clip to the dataset resolution, per video backend
+"""
+import pytest
+
+from benchmarks.suite.conftest import FPS
+from utils import change_video_resolution_and_fps, video_backends
+
+
+@pytest.mark.parametrize("new_fps", [FPS, FPS // 2])
+@pytest.mark.parametrize("video_backend", list(video_backends))
+def test_change_video_resolution_and_fps(benchmark, broadcast_clip, tmp_path, video_backend, new_fps):
+    if video_backend == "pyav":
+        pytest.importorskip("av")
+    video_path, _ = broadcast_clip
+    assert benchmark.pedantic(change_video_resolution_and_fps,
+                              args=(video_path, str(tmp_path / "video.avi"), (320, 256), new_fps),
+                              kwargs=dict(video_backend=video_backend), rounds=3, warmup_rounds=1)
@@ -0,0 +1,51 @@
+"""
+The cost of a `ClockOCRCache` lookup on the crops of a 720p broadcast-like frame (the clock box, and the whole bottom
+quarter `TesseractClockReader` reads): reading a crop it has (the same pixels, or the same clock box with compression
+noise, found by its perceptual hash), and one it doesn't (fingerprinting, hashing and storing it, without the OCR
+itself).
+"""
+import copy
+
+import cv2
+import numpy as np
+import pytest
+
+from utils import ClockOCRCache
+
+
+@pytest.fixture(scope="module")
+def crops(broadcast_clip):
+    video_path, (x, y, width, height) = broadcast_clip
+    cap = cv2.VideoCapture(video_path)
+    ret, frame = cap.read()
+    cap.release()
+    assert ret
+    return {'clock box': frame[y:y + height, x:x + width], 'bottom quarter': frame[frame.shape[0] * 3 // 4:]}
+
+
+@pytest.mark.parametrize("crop_name", ["clock box", "bottom quarter"])
+@pytest.mark.parametrize("lookup", ["exact hit", "miss"])
+def test_clock_ocr_cache_read(benchmark, crops, crop_name, lookup):
+    crop = crops[crop_name]
+    if lookup == "miss":
+        benchmark(lambda: ClockOCRCache().read(crop, lambda: "2:30"))
+        return
+    cache = ClockOCRCache()
+    cache.read(crop, lambda: "2:30")
+    benchmark(cache.read, crop, lambda: "2:30")
+    assert cache.misses == 1
+
+
+def test_clock_ocr_cache_near_hit(benchmark, crops):
+    crop = crops['clock box']
+    noisy_crop = cv2.add(crop, np.random.default_rng(0).integers(0, 4, crop.shape, dtype=np.uint8))
+    cache = ClockOCRCache()
+    cache.read(crop, lambda: "2:30")
+    entries, buckets = cache._entries.copy(), copy.deepcopy(cache._buckets)
+
+    def forget_the_noisy_crop():
+        # Or the next round would be an exact hit
+        cache._entries, cache._buckets = entries.copy(), copy.deepcopy(buckets)
+
+    benchmark.pedantic(cache.read, (noisy_crop, lambda: "2:30"), setup=forget_the_noisy_crop, rounds=200)
+    assert cache.near_hits == 200 and cache.misses == 1
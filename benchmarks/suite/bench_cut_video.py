@@ -0,0 +1,61 @@
+"""
+`cut_video` on a 720p clip, end to end, and its two phases on their own: scanning the game clock for the shot moment,
+and writing the cut once it's found.
+"""
+import cv2
+import pytest
+
+from benchmarks.suite.conftest import FPS, SHOT_TIME
+from utils import _ClockProbe, _shot_frame_search_functions, cut_video, CutVideoStats, get_video_backend, \
+    TemplateClockReader, video_backends
+
+
+def _clock_reader(clock_box):
+    return TemplateClockReader.from_font(roi=clock_box, use_tesseract_fallback=False)
+
+
+@pytest.mark.parametrize("search_mode", ["linear", "gallop", "stream"])
+def test_cut_video(benchmark, broadcast_clip, tmp_path, search_mode):
+    video_path, clock_box = broadcast_clip
+    stats = CutVideoStats()
+    cut = benchmark.pedantic(cut_video, args=(video_path, SHOT_TIME, 4, 2, str(tmp_path / "cut.avi")),
+                             kwargs=dict(new_resolution=(320, 256), new_fps=15, search_mode=search_mode,
+                                         stats=stats, clock_reader=_clock_reader(clock_box)),
+                             rounds=3, warmup_rounds=1)
+    assert cut
+    benchmark.extra_info.update(ocr_calls=stats.ocr_calls, frames_decoded=stats.frames_decoded)
+
+
+@pytest.mark.parametrize("search_mode", list(_shot_frame_search_functions))
+def test_clock_scan(benchmark, broadcast_clip, search_mode):
+    """ Finding the shot frame: decoding the frames the search looks at, and reading their clock """
+    video_path, clock_box = broadcast_clip
+    clock_reader = _clock_reader(clock_box)
+    captures = []
+
+    def open_probe():
+        cap = cv2.VideoCapture(video_path)
+        captures.append(cap)
+        return (_ClockProbe(cap, CutVideoStats(), clock_reader), SHOT_TIME, FPS), {}
+
+    try:
+        shot_frame = benchmark.pedantic(_shot_frame_search_functions[search_mode], setup=open_probe, rounds=5)
+    finally:
+        for cap in captures:
+            cap.release()
+    assert shot_frame is not None
+
+
+@pytest.mark.parametrize("video_backend", list(video_backends))
+def test_cut_write(benchmark, broadcast_clip, tmp_path, video_backend):
+    """ Writing 6 seconds from the shot moment on, downscaled and at half the fps """
+    try:
+        backend = get_video_backend(video_backend)
+    except ImportError as e:
+        pytest.skip(str(e))
+    video_path, _ = broadcast_clip
+    written_frames = benchmark.pedantic(backend.transcode,
+                                        args=(video_path, str(tmp_path / "cut.avi"), (320, 256), FPS // 2),
+                                        kwargs=dict(start_frame=9 * FPS, number_of_frames=6 * FPS),
+                                        rounds=3, warmup_rounds=1)
+    assert written_frames == 3 * FPS
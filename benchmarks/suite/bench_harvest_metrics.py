@@ -0,0 +1,18 @@
+"""
+The cost of the instrumentation (`utils.HarvestMetrics`) per stage, disabled and enabled
+"""
+import pytest
+
+from utils import HarvestMetrics
+
+
+@pytest.mark.parametrize("enabled", [False, True])
+def test_harvest_metrics_stage(benchmark, enabled):
+    metrics = HarvestMetrics(enabled=enabled)
+
+    def timed_stage():
+        with metrics.stage("stage") as stage:
+            stage.add("bytes_downloaded", 1)
+            metrics.count("ocr_calls")
+
+    benchmark(timed_stage)
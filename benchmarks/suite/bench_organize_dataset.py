@@ -0,0 +1,32 @@
+"""
+Splitting a harvested videos bank into a dataset: making the split manifest, and laying the dataset out from it
+"""
+import itertools
+
+import pytest
+
+from benchmarks.synthetic import make_synthetic_videos_bank
+from utils import make_split_manifest, organize_dataset_from_videos_folder
+
+VIDEO_TYPES = ["DUNK", "JUMP_SHOT", "LAYUP", "HOOK_SHOT", "FREE_THROW"]
+
+
+@pytest.fixture(scope="module")
+def videos_bank(tmp_path_factory):
+    root = tmp_path_factory.mktemp("bank")
+    make_synthetic_videos_bank(root, {video_type: 400 for video_type in VIDEO_TYPES})
+    return root
+
+
+def test_make_split_manifest(benchmark, videos_bank):
+    manifest = benchmark(make_split_manifest, videos_bank, VIDEO_TYPES)
+    assert len(manifest.index) == 2000
+
+
+@pytest.mark.parametrize("link_mode", ["hardlink", "copy"])
+def test_organize_dataset(benchmark, videos_bank, tmp_path, link_mode):
+    """ Into a new folder every round, so every round lays out all the videos """
+    new_root_dirs = (tmp_path / f"dataset_{i}" for i in itertools.count())
+    manifest = benchmark.pedantic(lambda: organize_dataset_from_videos_folder(
+        videos_bank, next(new_root_dirs), VIDEO_TYPES, link_mode=link_mode), rounds=3)
+    assert len(manifest.index) == 2000
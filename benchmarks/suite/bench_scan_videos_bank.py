@@ -0,0 +1,53 @@
+"""
+Checking the videos of a harvested bank before making a dataset of it: the first scan probes every video, and a
+re-scan only walks the bank and reads the probes cache
+"""
+import itertools
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from utils import scan_videos_bank
+
+VIDEO_TYPES = ["DUNK", "JUMP_SHOT", "LAYUP", "HOOK_SHOT", "FREE_THROW"]
+
+
+def _make_bank(root, videos_per_type: int):
+    """ A bank of hard links to a single 4 seconds 320x256 clip, so it's quick to make """
+    clip_path = root / "clip.avi"
+    out = cv2.VideoWriter(str(clip_path), cv2.VideoWriter_fourcc(*'XVID'), 30, (320, 256))
+    for i in range(120):
+        out.write(np.full((256, 320, 3), i * 2, dtype=np.uint8))
+    out.release()
+    bank = root / "bank"
+    for video_type in VIDEO_TYPES:
+        for i in range(videos_per_type):
+            video_folder = bank / video_type / f"{i:05d}_1"
+            video_folder.mkdir(parents=True)
+            os.link(clip_path, video_folder / "cut_video.avi")
+    return bank
+
+
+@pytest.fixture(scope="module")
+def small_bank(tmp_path_factory):
+    return _make_bank(tmp_path_factory.mktemp("small"), 20)
+
+
+@pytest.fixture(scope="module")
+def large_bank(tmp_path_factory):
+    return _make_bank(tmp_path_factory.mktemp("large"), 2000)
+
+
+def test_first_scan(benchmark, small_bank, tmp_path):
+    """ With a new cache every round, so every round probes all the videos """
+    cache_paths = (tmp_path / f"scan_{i}.sqlite" for i in itertools.count())
+    report = benchmark.pedantic(lambda: scan_videos_bank(small_bank, cache_path=next(cache_paths)), rounds=3)
+    assert (report["issues"] == "").all()
+
+
+def test_rescan(benchmark, large_bank):
+    scan_videos_bank(large_bank)
+    report = benchmark.pedantic(scan_videos_bank, (large_bank,), rounds=3)
+    assert len(report.index) == 10000
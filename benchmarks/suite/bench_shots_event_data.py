@@ -0,0 +1,22 @@
+"""
+Filtering the shot events out of play-by-play data: one game, and many games at once
+"""
+import pytest
+
+from benchmarks.synthetic import make_synthetic_pbp_data
+from utils import get_shots_event_data_from_game_df, get_shots_event_data_from_games_df
+
+
+@pytest.fixture(scope="module")
+def games_df():
+    return make_synthetic_pbp_data(number_of_games=500)
+
+
+def test_shots_event_data_of_a_game(benchmark):
+    game_df = make_synthetic_pbp_data(number_of_games=1)
+    assert len(benchmark(get_shots_event_data_from_game_df, game_df).index) > 0
+
+
+def test_shots_event_data_of_many_games(benchmark, games_df):
+    benchmark.extra_info['events'] = len(games_df.index)
+    assert benchmark(get_shots_event_data_from_games_df, games_df)['GAME_ID'].nunique() == 500
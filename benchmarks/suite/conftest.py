@@ -0,0 +1,22 @@
+"""
+Shared inputs of the benchmark suite. They're written once per session, since rendering the videos takes longer than
+most of the benchmarks.
+"""
+import pytest
+
+from benchmarks.synthetic import write_synthetic_broadcast_clip
+
+FPS = 30
+# The clock starts at 2:30 and is stopped for the first 3 seconds, so the shot at 2:20 is 13 seconds in
+START_CLOCK = 150
+CLOCK_STOPPED_SECONDS = 3
+SHOT_TIME = "2:20"
+
+
+@pytest.fixture(scope="session")
+def broadcast_clip(tmp_path_factory):
+    """ :return: The path of a 20 seconds 720p broadcast-like clip, and the box of its game clock """
+    path = tmp_path_factory.mktemp("clips") / "broadcast.avi"
+    clock_box = write_synthetic_broadcast_clip(path, seconds=20, fps=FPS, resolution=(1280, 720),
+                                               start_clock=START_CLOCK, clock_stopped_seconds=CLOCK_STOPPED_SECONDS)
+    return str(path), clock_box
@@ -0,0 +1,149 @@
+"""
+Synthetic inputs for the benchmarks (and tests), so they run offline, without the NBA API or real footage.
+"""
+import pathlib
+from typing import Dict, Tuple
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from utils import prior_shot_type_to_shot_dsc
+
+_shot_action_types = np.array(list(prior_shot_type_to_shot_dsc.keys()))
+
+
+def make_synthetic_pbp_data(number_of_games: int = 1, events_per_period: int = 110, seed: int = 0) -> pd.DataFrame:
+    """
+    Play-by-play data shaped like `PlayByPlayV2`, with the columns `get_shots_event_data_from_game_df` uses.
+    Every period starts with a period-start event (12) and ends with a period-end event (13), like the real data.
+    Shots, rebounds, blocks and turnovers are mixed so every filter of the shot events gets exercised.
+
+    :return: The games concatenated, each with its own `GAME_ID`, with a `RangeIndex`
+    """
+    rng = np.random.default_rng(seed)
+    games = []
+    for game_number in range(number_of_games):
+        rows = []
+        event_num = 0
+        for period in range(1, 5):
+            clock = 12 * 60
+            rows.append((event_num, 12, 0, period, clock, None, None, 0))
+            event_num += 1
+            for _ in range(events_per_period):
+                # Small gaps often, so there are rebounds squeezed between shots
+                clock = max(0, clock - int(rng.choice([1, 2, 3, 5, 8, 13])))
+                event_type = int(rng.choice([1, 2, 4, 5, 6], p=[0.25, 0.3, 0.3, 0.08, 0.07]))
+                action_type = int(rng.choice(_shot_action_types)) if event_type <= 2 else 0
+                home = rng.random() < 0.5
+                description = f"Player {'Jump Shot' if event_type <= 2 else 'Rebound'} ({event_num})"
+                other_description = None
+                if event_type == 2 and rng.random() < 0.1:
+                    other_description = "Defender BLOCK (1 BLK)"
+                home_description, visitor_description = (description, other_description) if home \
+                    else (other_description, description)
+                video_available_flag = int(rng.random() < 0.9)
+                rows.append((event_num, event_type, action_type, period, clock, home_description,
+                             visitor_description, video_available_flag))
+                event_num += 1
+            rows.append((event_num, 13, 0, period, 0, None, None, 0))
+            event_num += 1
+        game = pd.DataFrame(rows, columns=['EVENTNUM', 'EVENTMSGTYPE', 'EVENTMSGACTIONTYPE', 'PERIOD', 'CLOCK',
+                                           'HOMEDESCRIPTION', 'VISITORDESCRIPTION', 'VIDEO_AVAILABLE_FLAG'])
+        game.insert(0, 'GAME_ID', f"00219{game_number:05d}")
+        game.insert(5, 'PCTIMESTRING', [f"{clock // 60}:{clock % 60:02d}" for clock in game.pop('CLOCK')])
+        games.append(game)
+    return pd.concat(games, ignore_index=True)
+
+
+def _panning_frames(resolution, number_of_frames: int, seed: int):
+    """ A textured background panning sideways, with a flat scoreboard bar at the bottom """
+    width, height = resolution
+    rng = np.random.default_rng(seed)
+    # Smooth texture, cheaper to encode than pure noise and closer to real footage
+    texture = cv2.resize(rng.integers(0, 255, (height // 8, width // 8, 3), dtype=np.uint8), (2 * width, height),
+                         interpolation=cv2.INTER_CUBIC)
+    for frame_number in range(number_of_frames):
+        offset = (6 * frame_number) % width
+        frame = np.ascontiguousarray(texture[:, offset:offset + width])
+        frame[height - height // 8:] = 40
+        yield frame
+
+
+def write_synthetic_video(path, seconds: float = 10, fps: int = 30, resolution=(1280, 720), fourcc: str = 'mp4v',
+                          seed: int = 0):
+    """
+    Writes a video of a textured background panning sideways (so the encoder has motion to deal with, like a camera
+    following the play), with a flat bar at the bottom.
+    """
+    out = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*fourcc), fps, resolution, isColor=True)
+    for frame in _panning_frames(resolution, int(seconds * fps), seed):
+        out.write(frame)
+    out.release()
+
+
+def synthetic_clock_text(seconds_left: float) -> str:
+    """ The game clock the way the broadcast shows it: "10:23" with a minute or more left, "56.3" under a minute """
+    if seconds_left >= 60:
+        seconds_left = int(seconds_left)
+        return f"{seconds_left // 60}:{seconds_left % 60:02d}"
+    return f"{int(seconds_left * 10) / 10:.1f}"
+
+
+def write_synthetic_broadcast_clip(path, seconds: float = 20, fps: int = 30, resolution=(1280, 720),
+                                   start_clock: float = 150, clock_stopped_seconds: float = 0,
+                                   fourcc: str = 'XVID', seed: int = 0) -> Tuple[int, int, int, int]:
+    """
+    Writes a video like `write_synthetic_video`, with a game clock burned into a box on the scoreboard bar. The clock
+    starts at `start_clock` seconds, stays there for `clock_stopped_seconds` (a dead ball), and then counts down with
+    the video. It is rendered with OpenCV's default font, so `TemplateClockReader.from_font(roi=<the box>)` reads it
+    without tesseract.
+
+    :return: The (x, y, width, height) box of the clock
+    """
+    width, height = resolution
+    box_width, box_height = 100, 40
+    clock_box = (width // 2 - box_width // 2, height - height // 16 - box_height // 2, box_width, box_height)
+    x, y = clock_box[:2]
+    out = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*fourcc), fps, resolution, isColor=True)
+    for frame_number, frame in enumerate(_panning_frames(resolution, int(seconds * fps), seed)):
+        seconds_left = start_clock - max(0.0, frame_number / fps - clock_stopped_seconds)
+        cv2.rectangle(frame, (x, y), (x + box_width, y + box_height), (20, 20, 20), -1)
+        cv2.putText(frame, synthetic_clock_text(max(seconds_left, 0)), (x + 5, y + 33), cv2.FONT_HERSHEY_SIMPLEX,
+                    1.0, (255, 255, 255), 2)
+        out.write(frame)
+    out.release()
+    return clock_box
+
+
+def make_synthetic_videos_bank(root, videos_per_type: Dict[str, int], video_size: int = 64 * 1024, seed: int = 0):
+    """
+    A harvested videos bank (`<root>/<video type>/<video folder>/cut_video.avi`, see `VideosBankHarvester`), with
+    random bytes instead of videos, for timing the dataset organization
+    """
+    rng = np.random.default_rng(seed)
+    root = pathlib.Path(root)
+    for video_type, number_of_videos in videos_per_type.items():
+        for i in range(number_of_videos):
+            video_folder = root / video_type / f"{video_type}_{i:05d}"
+            video_folder.mkdir(parents=True, exist_ok=True)
+            video_folder.joinpath('cut_video.avi').write_bytes(rng.bytes(video_size))
+
+
+def make_small_random_video_classifier(num_labels: int = 5):
+    """
+    A randomly initialized VideoMAE, a lot smaller than the real checkpoints (112 pixels, 8 frames, 4 layers), so model
+    benchmarks run offline and in reasonable time on CPU.
+
+    :return: The model, and its `model_utils.ClipPreprocessor`
+    """
+    from transformers import VideoMAEConfig, VideoMAEForVideoClassification
+
+    from model_utils import ClipPreprocessor
+
+    config = VideoMAEConfig(image_size=112, num_frames=8, hidden_size=192, num_hidden_layers=4, num_attention_heads=3,
+                            intermediate_size=768, num_labels=num_labels, use_mean_pooling=True)
+    model = VideoMAEForVideoClassification(config).eval()
+    preprocessor = ClipPreprocessor(num_frames=config.num_frames, short_side_size=128,
+                                    crop_size=(config.image_size, config.image_size))
+    return model, preprocessor
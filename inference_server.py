@@ -0,0 +1,274 @@
+"""
+A local HTTP server for the shot classifier, for CPU inference.
+
+The model is loaded once. Requests are preprocessed (decoded, sampled, resized and normalized) in a worker pool, and
+grouped into micro-batches for the model: a batch runs once it has `max_batch_size` clips, or once its first clip
+waited `max_wait_ms`.
+
+Endpoints:
+- POST /predict: a video file as the body, or {"path": "<video path on the server>"} as JSON. Returns the predicted
+  label and the score of each class.
+- GET /stats: latency percentiles, throughput and batch sizes.
+- GET /health
+
+Usage: python -m inference_server --model omermazig/videomae-finetuned-nba-5-class-4-batch-8000-vid-multiclass
+   or: python -m inference_server --onnx <a model_utils.export_video_classifier export>
+"""
+import argparse
+import collections
+import concurrent.futures
+import http.server
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, Optional, Union
+
+import numpy as np
+import torch
+
+from model_utils import ClipPreprocessor, load_video_classifier, load_onnx_video_classifier
+
+logger = logging.getLogger(__name__)
+
+
+class DynamicBatcher:
+    """
+    Collects single inputs from many threads into batches for `predict_batch`, on a single worker thread.
+    A batch is run when it has `max_batch_size` inputs, or `max_wait_ms` after its first input arrived.
+    """
+
+    def __init__(self, predict_batch: Callable[[np.ndarray], np.ndarray], max_batch_size: int = 8,
+                 max_wait_ms: float = 10):
+        """
+        :param predict_batch: Gets the inputs stacked along a new first axis, returns an output per input
+        """
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.batch_sizes = collections.Counter()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='dynamic-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, item: np.ndarray) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        self._queue.put((item, future))
+        return future
+
+    def _collect_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Closing. Run what we have, then stop.
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+            items, futures = zip(*batch)
+            self.batch_sizes[len(items)] += 1
+            try:
+                outputs = self.predict_batch(np.stack(items))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, output in zip(futures, outputs):
+                future.set_result(output)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+class ShotClassifierService:
+    """ The model, its preprocessing pool and its batcher, with latency and throughput statistics """
+
+    def __init__(self, model: torch.nn.Module, preprocessor: ClipPreprocessor, id2label: Dict[int, str],
+                 max_batch_size: int = 8, max_wait_ms: float = 10, preprocess_workers: Optional[int] = None,
+                 use_processes: bool = True, latency_window: int = 10000):
+        """
+        :param model: Gets `pixel_values` of shape (batch, frames, channels, height, width), and returns an output with
+        `logits` (like `VideoMAEForVideoClassification`)
+        :param id2label: The class names
+        :param preprocess_workers: Size of the preprocessing pool. Defaults to the number of cores.
+        :param use_processes: Preprocess in a process pool (or in a thread pool, if False)
+        :param latency_window: How many of the last requests the latency percentiles are computed over
+        """
+        self.model = model.eval()
+        self.preprocessor = preprocessor
+        self.id2label = {int(k): v for k, v in id2label.items()}
+        executor_class = concurrent.futures.ProcessPoolExecutor if use_processes \
+            else concurrent.futures.ThreadPoolExecutor
+        self._preprocess_pool = executor_class(max_workers=preprocess_workers or os.cpu_count() or 1)
+        self.batcher = DynamicBatcher(self._predict_batch, max_batch_size, max_wait_ms)
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=latency_window)
+        self._completed_requests = 0
+        self._failed_requests = 0
+        self._start_time = time.monotonic()
+
+    def _predict_batch(self, pixel_values: np.ndarray) -> np.ndarray:
+        with torch.inference_mode():
+            logits = self.model(pixel_values=torch.from_numpy(pixel_values)).logits
+            return torch.softmax(logits.float(), dim=-1).numpy()
+
+    def predict(self, video: Union[str, bytes]) -> Dict:
+        """
+        :param video: Path to the video, or the video file contents
+        :return: The predicted 'label', the 'scores' of all the classes, and the 'latency_ms' of the request
+        """
+        start_time = time.perf_counter()
+        try:
+            pixel_values = self._preprocess_pool.submit(self.preprocessor, video).result()
+            scores = self.batcher.submit(pixel_values).result()
+        except Exception:
+            with self._lock:
+                self._failed_requests += 1
+            raise
+        latency_ms = (time.perf_counter() - start_time) * 1000
+        with self._lock:
+            self._latencies.append(latency_ms)
+            self._completed_requests += 1
+        return {
+            'label': self.id2label[int(np.argmax(scores))],
+            'scores': {self.id2label[i]: float(score) for i, score in enumerate(scores)},
+            'latency_ms': latency_ms,
+        }
+
+    def stats(self) -> Dict:
+        with self._lock:
+            latencies = np.array(self._latencies)
+            completed_requests = self._completed_requests
+            failed_requests = self._failed_requests
+        batch_sizes = dict(sorted(self.batcher.batch_sizes.items()))
+        number_of_batches = sum(batch_sizes.values())
+        return {
+            'completed_requests': completed_requests,
+            'failed_requests': failed_requests,
+            'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+            'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+            'throughput_per_second': completed_requests / (time.monotonic() - self._start_time),
+            'mean_batch_size': sum(k * v for k, v in batch_sizes.items()) / number_of_batches
+            if number_of_batches else None,
+            'batch_sizes': batch_sizes,
+        }
+
+    def close(self):
+        self.batcher.close()
+        self._preprocess_pool.shutdown()
+
+
+class _InferenceRequestHandler(http.server.BaseHTTPRequestHandler):
+    service: ShotClassifierService = None
+
+    def _send_json(self, status: int, content: Dict):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        elif self.path == '/stats':
+            self._send_json(200, self.service.stats())
+        else:
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not body:
+            self._send_json(400, {'error': "Send a video file, or a JSON with its path"})
+            return
+        video = body
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            try:
+                video = json.loads(body)['path']
+            except (ValueError, KeyError, TypeError):
+                self._send_json(400, {'error': 'Expected {"path": "<video path>"}'})
+                return
+            if not os.path.isfile(video):
+                self._send_json(400, {'error': f"No video at {video}"})
+                return
+        try:
+            self._send_json(200, self.service.predict(video))
+        except Exception as e:
+            logger.exception("Prediction failed")
+            self._send_json(500, {'error': repr(e)})
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def make_inference_server(service: ShotClassifierService, host: str = '127.0.0.1',
+                          port: int = 8000) -> http.server.ThreadingHTTPServer:
+    """ :return: The HTTP server of the service (call `serve_forever` on it). Port 0 picks a free port. """
+    handler = type('InferenceRequestHandler', (_InferenceRequestHandler,), {'service': service})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    model_group = parser.add_mutually_exclusive_group(required=True)
+    model_group.add_argument('--model', help="A checkpoint name or folder")
+    model_group.add_argument('--onnx', help="An ONNX Runtime export folder (see `export_video_classifier`)")
+    parser.add_argument('--no-int8', action='store_true', help="With --onnx, use the fp32 model")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch-size', type=int, default=8)
+    parser.add_argument('--max-wait-ms', type=float, default=10)
+    parser.add_argument('--preprocess-workers', type=int)
+    parser.add_argument('--torch-threads', type=int,
+                        help="Threads for the model (intra-op threads with --onnx). Defaults to all the cores.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.onnx:
+        model, preprocessor = load_onnx_video_classifier(args.onnx, quantized=not args.no_int8,
+                                                         intra_op_num_threads=args.torch_threads or 0)
+    else:
+        if args.torch_threads:
+            torch.set_num_threads(args.torch_threads)
+        model, preprocessor = load_video_classifier(args.model)
+    service = ShotClassifierService(model, preprocessor, model.config.id2label, args.max_batch_size,
+                                    args.max_wait_ms, args.preprocess_workers)
+    server = make_inference_server(service, args.host, args.port)
+    logger.info(f"Serving {args.model or args.onnx} on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1256 @@
+import collections
+import concurrent.futures
+import dataclasses
+import io
+import json
+import os
+import pathlib
+import tarfile
+import time
+import types
+import warnings
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+import pandas as pd
+import torch
+from sklearn.metrics import accuracy_score, classification_report, f1_score
+from tqdm import tqdm
+
+from utils import _yield_without_desktop_ini, _open_video_capture, dataset_splits, probe_video
+
+
+def _list_labelled_videos(dataset_split_path: pathlib.Path, video_extension: str = "avi") -> Tuple[List, Dict]:
+    """
+    Lists the videos of a dataset split (`<split>/<class>/<video>`), labelled like `pytorchvideo.data.Ucf101` does
+
+    :return: (video path, label name) pairs, and label name to label id
+    """
+    class_labels = sorted(path.name for path in _yield_without_desktop_ini(dataset_split_path.iterdir())
+                          if path.is_dir())
+    label2id = {label: i for i, label in enumerate(class_labels)}
+    videos = [(video_path, label) for label in class_labels
+              for video_path in sorted(dataset_split_path.joinpath(label).glob(f"*.{video_extension}"))]
+    return videos, label2id
+
+
+def decode_video_frames(video_path, frame_stride: int, frames_per_video: int,
+                        resolution: Optional[Tuple[int, int]] = None, start_frame: int = 0) -> np.ndarray:
+    """
+    Decodes every `frame_stride` frame of the video, from `start_frame`, as RGB.
+
+    :param video_path: Path to the video, or a binary file object
+    :param resolution: (width, height) to resize the frames to. Defaults to the video resolution.
+    :return: A (frames_per_video, height, width, 3) uint8 array. Longer videos are cut, and shorter videos are padded
+    with their last frame, so every video gets the same shape.
+    """
+    frames = None
+    cap = _open_video_capture(video_path)
+    try:
+        if start_frame:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        stored_frames = 0
+        current_frame = 0
+        while stored_frames < frames_per_video and cap.grab():
+            if current_frame % frame_stride == 0:
+                _, frame = cap.retrieve()
+                if frames is None:
+                    width, height = resolution if resolution else (frame.shape[1], frame.shape[0])
+                    frames = np.zeros((frames_per_video, height, width, 3), dtype=np.uint8)
+                if frame.shape[:2] != frames.shape[1:3]:
+                    frame = cv2.resize(frame, frames.shape[2:0:-1], interpolation=cv2.INTER_AREA)
+                cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frames[stored_frames])
+                stored_frames += 1
+            current_frame += 1
+    finally:
+        cap.release()
+    if stored_frames == 0:
+        raise ValueError(f"Couldn't decode any frame of {video_path}")
+    frames[stored_frames:] = frames[stored_frames - 1]
+    return frames
+
+
+def _decode_video_into_shard(video_path: str, shard_path: str, offset: int, frame_stride: int,
+                             frames_per_video: int, resolution: Tuple[int, int]):
+    shard = np.load(shard_path, mmap_mode='r+')
+    shard[offset] = decode_video_frames(video_path, frame_stride, frames_per_video, resolution)
+    shard.flush()
+    del shard
+
+
+def build_clip_cache(dataset_split_path, cache_directory, frame_stride: int = 4, frames_per_video: int = 38,
+                     resolution: Tuple[int, int] = (320, 256), videos_per_shard: int = 256,
+                     num_workers: Optional[int] = None, video_extension: str = "avi") -> pathlib.Path:
+    """
+    Decodes every video of a dataset split once, into fixed-shape uint8 frame arrays in memory-mappable `.npy` shards,
+    with an `index.json` mapping each video to its shard, offset and label.
+
+    The frames are stored every `frame_stride` frames (the `sample_rate` of the training), so a training clip is just
+    `num_frames` consecutive stored frames. The defaults keep the whole 5 seconds of a 30 fps `cut_video` output.
+
+    :param dataset_split_path: A split folder of the dataset, like `dataset/train`
+    :param cache_directory: Where to write the shards and the index
+    :param frame_stride: Store one of every `frame_stride` frames
+    :param frames_per_video: Number of frames to store per video
+    :param resolution: (width, height) of the stored frames
+    :param videos_per_shard: Number of videos in each shard file
+    :param num_workers: Decoding processes. Defaults to the number of cores.
+    :return: The path of the index file
+    """
+    dataset_split_path = pathlib.Path(dataset_split_path)
+    cache_directory = pathlib.Path(cache_directory)
+    cache_directory.mkdir(parents=True, exist_ok=True)
+    videos, label2id = _list_labelled_videos(dataset_split_path, video_extension)
+    width, height = resolution
+    frame_shape = (frames_per_video, height, width, 3)
+
+    shards, entries = [], []
+    for shard_number, shard_start in enumerate(range(0, len(videos), videos_per_shard)):
+        shard_videos = videos[shard_start:shard_start + videos_per_shard]
+        shard_name = f"shard-{shard_number:05d}.npy"
+        np.lib.format.open_memmap(cache_directory.joinpath(shard_name), mode='w+', dtype=np.uint8,
+                                  shape=(len(shard_videos),) + frame_shape).flush()
+        shards.append({'file': shard_name, 'count': len(shard_videos)})
+        for offset, (video_path, label) in enumerate(shard_videos):
+            entries.append({'path': video_path.relative_to(dataset_split_path).as_posix(), 'label': label,
+                            'label_id': label2id[label], 'shard': shard_number, 'offset': offset})
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(_decode_video_into_shard, dataset_split_path.joinpath(entry['path']).as_posix(),
+                                   cache_directory.joinpath(shards[entry['shard']]['file']).as_posix(),
+                                   entry['offset'], frame_stride, frames_per_video, resolution)
+                   for entry in entries]
+        for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
+            future.result()
+
+    index_path = cache_directory.joinpath('index.json')
+    with open(index_path, 'w') as f:
+        json.dump({'frame_shape': frame_shape, 'frame_stride': frame_stride, 'label2id': label2id,
+                   'shards': shards, 'entries': entries}, f)
+    return index_path
+
+
+class ClipCacheDataset(torch.utils.data.Dataset):
+    """
+    A drop-in for the `pytorchvideo.data.Ucf101` datasets of the notebooks, reading from a `build_clip_cache` cache.
+    Items look the same: {"video": (C, T, H, W) tensor, "label": label id, ...}, so the same transforms (crop, flip,
+    scale...) keep running on the fly.
+
+    The clips are zero-copy views of the memory-mapped shards (uint8, so `Lambda(lambda x: x / 255.0)` stays the first
+    transform after subsampling). The shards are opened lazily in each process, so every DataLoader worker maps them
+    by itself, and the sampler hands out the indices between the workers as usual.
+    """
+
+    def __init__(self, cache_directory, num_frames: int = 16, clip_sampling: str = "random",
+                 clips_per_video: int = 1, transform: Optional[Callable] = None):
+        """
+        :param cache_directory: Folder of a `build_clip_cache` cache
+        :param num_frames: Number of stored frames in a clip
+        :param clip_sampling: 'random' for a random clip start (training), 'uniform' for evenly spread clips
+        :param clips_per_video: More than 1 returns a list of clips under "video", like the "random_multi" sampler
+        :param transform: Applied to every item dict
+        """
+        if clip_sampling not in ('random', 'uniform'):
+            raise ValueError(f"Unknown clip sampling `{clip_sampling}`")
+        self.cache_directory = pathlib.Path(cache_directory)
+        with open(self.cache_directory.joinpath('index.json')) as f:
+            index = json.load(f)
+        self.frame_shape = tuple(index['frame_shape'])
+        if num_frames > self.frame_shape[0]:
+            raise ValueError(f"Clips of {num_frames} frames are longer than the {self.frame_shape[0]} cached frames")
+        self.label2id = index['label2id']
+        self.id2label = {i: label for label, i in self.label2id.items()}
+        self._shard_files = [shard['file'] for shard in index['shards']]
+        self.entries = index['entries']
+        self.num_frames = num_frames
+        self.clip_sampling = clip_sampling
+        self.clips_per_video = clips_per_video
+        self.transform = transform
+        self._shards = {}
+
+    def __getstate__(self):
+        # Memory maps must not be pickled into the DataLoader workers (that would copy them)
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+    @property
+    def num_videos(self) -> int:
+        return len(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _shard(self, shard_number: int) -> np.ndarray:
+        if shard_number not in self._shards:
+            # Copy-on-write, so torch gets writable arrays while the shard files stay untouched
+            self._shards[shard_number] = np.load(
+                self.cache_directory.joinpath(self._shard_files[shard_number]), mmap_mode='c'
+            )
+        return self._shards[shard_number]
+
+    def _clip_starts(self) -> List[int]:
+        last_start = self.frame_shape[0] - self.num_frames
+        if self.clip_sampling == 'random':
+            return torch.randint(0, last_start + 1, (self.clips_per_video,)).tolist()
+        return np.linspace(0, last_start, self.clips_per_video).round().astype(int).tolist() \
+            if self.clips_per_video > 1 else [last_start // 2]
+
+    def __getitem__(self, index: int) -> Dict:
+        entry = self.entries[index]
+        frames = self._shard(entry['shard'])[entry['offset']]
+        # (T, H, W, C) -> (C, T, H, W), without copying
+        clips = [torch.from_numpy(frames[start:start + self.num_frames]).permute(3, 0, 1, 2)
+                 for start in self._clip_starts()]
+        sample = {
+            'video': clips[0] if self.clips_per_video == 1 else clips,
+            'label': entry['label_id'],
+            'video_name': os.path.basename(entry['path']),
+            'video_index': index,
+        }
+        if self.transform is not None:
+            sample = self.transform(sample)
+        return sample
+
+
+def _tar_member(name: str, data: bytes, mtime: float) -> tarfile.TarInfo:
+    member = tarfile.TarInfo(name)
+    member.size = len(data)
+    member.mtime = mtime
+    member.mode = 0o644
+    return member
+
+
+def _tar_member_bytes(member: tarfile.TarInfo) -> int:
+    """ The bytes a member takes in a GNU tar: its header blocks (more for a long name), and its data, padded """
+    header = member.tobuf(tarfile.GNU_FORMAT, tarfile.ENCODING, 'surrogateescape')
+    return len(header) + -(-member.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+
+def _closed_tar_bytes(offset: int) -> int:
+    """ The size of a tar closed after `offset` bytes of members: the 2 end blocks, padded to a whole record """
+    return -(-(offset + 2 * tarfile.BLOCKSIZE) // tarfile.RECORDSIZE) * tarfile.RECORDSIZE
+
+
+def pack_dataset_shards(dataset_path, output_directory, videos_bank_path=None, max_shard_bytes: int = 256 * 2 ** 20,
+                        random_state: int = 0, video_extension: str = "avi") -> Dict[str, pathlib.Path]:
+    """
+    Packs each split of a dataset (`<split>/<class>/<name>.avi`) into tar shards of up to `max_shard_bytes`, so it
+    can be read sequentially (see `ShardedClipDataset`) from slow or network storage, like Drive, instead of as
+    thousands of small files.
+
+    Every video is two consecutive members: `<name>.avi` as is, and `<name>.json` with its 'label', 'label_id',
+    'frames', 'fps', 'width', 'height', and 'info' (its `info.json` in the videos bank). A split's videos are shuffled
+    before packing, so every shard mixes the classes. Each split gets an `index.json` with its shards and labels.
+
+    :param dataset_path: The dataset folder, with `train`, `val` and `test` split folders
+    :param output_directory: Gets a folder of shards per split
+    :param videos_bank_path: The videos bank the dataset was made from (`<class>/<name>/info.json`). Without it, the
+    'info' of every video is None.
+    :param max_shard_bytes: A shard is closed before its file grows past this, tar headers and padding included (a
+    bigger video gets a shard of its own)
+    :return: The index path of each split
+    """
+    dataset_path = pathlib.Path(dataset_path)
+    rng = np.random.default_rng(random_state)
+    index_paths = {}
+    for split in dataset_splits:
+        split_path = dataset_path.joinpath(split)
+        if not split_path.is_dir():
+            continue
+        videos, label2id = _list_labelled_videos(split_path, video_extension)
+        if not videos:
+            continue
+        videos = [videos[i] for i in rng.permutation(len(videos))]
+        shards_directory = pathlib.Path(output_directory, split_path.name)
+        shards_directory.mkdir(parents=True, exist_ok=True)
+
+        shards, tar, shard_path = [], None, None
+        for video_path, label in tqdm(videos, desc=split_path.name):
+            info = None
+            if videos_bank_path is not None:
+                info_path = pathlib.Path(videos_bank_path, label, video_path.stem, 'info.json')
+                if info_path.exists():
+                    with open(info_path) as f:
+                        info = json.load(f)
+            probe = probe_video(video_path)
+            metadata = {'label': label, 'label_id': label2id[label], 'frames': probe['frames'], 'fps': probe['fps'],
+                        'width': probe['width'], 'height': probe['height'], 'info': info}
+            mtime = video_path.stat().st_mtime
+            members = [(f"{video_path.stem}.json", json.dumps(metadata).encode()),
+                       (video_path.name, video_path.read_bytes())]
+            members = [(_tar_member(name, data, mtime), data) for name, data in members]
+            # Everything the tar file grows by counts, not just the videos
+            members_bytes = sum(_tar_member_bytes(member) for member, _ in members)
+            if tar is not None and _closed_tar_bytes(tar.offset + members_bytes) > max_shard_bytes:
+                tar.close()
+                os.replace(shard_path.with_suffix('.tmp'), shard_path)
+                tar = None
+            if tar is None:
+                shard_path = shards_directory.joinpath(f"shard-{len(shards):05d}.tar")
+                # Written under another name, so a shard is either complete or not there
+                tar = tarfile.open(shard_path.with_suffix('.tmp'), 'w', format=tarfile.GNU_FORMAT)
+                shards.append({'file': shard_path.name, 'count': 0, 'bytes': 0})
+            for member, data in members:
+                tar.addfile(member, io.BytesIO(data))
+            shards[-1]['count'] += 1
+            shards[-1]['bytes'] = _closed_tar_bytes(tar.offset)
+        tar.close()
+        os.replace(shard_path.with_suffix('.tmp'), shard_path)
+
+        index_paths[split_path.name] = shards_directory.joinpath('index.json')
+        with open(index_paths[split_path.name], 'w') as f:
+            json.dump({'label2id': label2id, 'video_extension': video_extension, 'num_videos': len(videos),
+                       'shards': shards}, f)
+    return index_paths
+
+
+def _balance_shards(shards: List[int], counts: List[int], bins: int) -> List[List[int]]:
+    """
+    Splits shards between `bins` readers, in order, each to the reader with the fewest videos so far (the first of
+    them, on a tie), so every reader gets a shard if there are enough.
+
+    :param shards: Shard indices
+    :param counts: The number of videos of every shard
+    :return: The shard indices of every reader
+    """
+    readers, videos = [[] for _ in range(bins)], [0] * bins
+    for shard in shards:
+        reader = videos.index(min(videos))
+        readers[reader].append(shard)
+        videos[reader] += counts[shard]
+    return readers
+
+
+class ShardedClipDataset(torch.utils.data.IterableDataset):
+    """
+    Streams the clips of a split packed by `pack_dataset_shards`, reading every shard from start to end. Items look
+    like the ones of `ClipCacheDataset` (and so of the `pytorchvideo.data.Ucf101` datasets of the notebooks):
+    {"video": (C, T, H, W) uint8 tensor, "label": label id, "video_name": ...}, so the same transforms keep running.
+
+    The shards are split between the distributed ranks, and then between the DataLoader workers of each rank, so every
+    video is read once per epoch. Every rank yields the same number of samples, `len(dataset)` (the videos split
+    evenly), or DDP would hang waiting for the ranks that ran out: the shards are balanced between the ranks by their
+    videos, and a rank that still has fewer videos repeats some, while a rank with more skips its last ones. With
+    `shuffle`, the shard order is shuffled every epoch (the same on all ranks, call
+    `set_epoch`), and the videos are shuffled within a buffer of `shuffle_buffer` (still encoded) videos.
+    """
+
+    def __init__(self, shards_directory, num_frames: int = 16, sample_rate: int = 4, clip_sampling: str = "random",
+                 clips_per_video: int = 1, shuffle: bool = True, shuffle_buffer: int = 64,
+                 resolution: Optional[Tuple[int, int]] = None, transform: Optional[Callable] = None, seed: int = 0,
+                 rank: Optional[int] = None, world_size: Optional[int] = None):
+        """
+        :param shards_directory: A split folder of `pack_dataset_shards`
+        :param num_frames: Number of frames in a clip
+        :param sample_rate: Frames between the frames of a clip
+        :param clip_sampling: 'random' for a random clip start (training), 'uniform' for evenly spread clips
+        :param clips_per_video: More than 1 returns a list of clips under "video", like the "random_multi" sampler
+        :param resolution: (width, height) to resize the frames to. Defaults to the videos' resolution.
+        :param rank: This process' rank, and the number of ranks. Default to `torch.distributed`'s, if it's
+        initialized. Pass world_size=1 if one process reads the data for all of them (like `accelerate` does by default
+        for iterable datasets).
+        """
+        if clip_sampling not in ('random', 'uniform'):
+            raise ValueError(f"Unknown clip sampling `{clip_sampling}`")
+        self.shards_directory = pathlib.Path(shards_directory)
+        with open(self.shards_directory.joinpath('index.json')) as f:
+            index = json.load(f)
+        self.label2id = index['label2id']
+        self.id2label = {i: label for label, i in self.label2id.items()}
+        self.video_extension = index['video_extension']
+        self.shards = [shard['file'] for shard in index['shards']]
+        self.shard_counts = [shard['count'] for shard in index['shards']]
+        self.num_videos = index['num_videos']
+        self.num_frames = num_frames
+        self.sample_rate = sample_rate
+        self.clip_sampling = clip_sampling
+        self.clips_per_video = clips_per_video
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer
+        self.resolution = resolution
+        self.transform = transform
+        self.seed = seed
+        distributed = torch.distributed.is_available() and torch.distributed.is_initialized()
+        self.rank = rank if rank is not None else torch.distributed.get_rank() if distributed else 0
+        self.world_size = world_size if world_size is not None else \
+            torch.distributed.get_world_size() if distributed else 1
+        if len(self.shards) < self.world_size:
+            raise ValueError(f"{len(self.shards)} shards can't be split between {self.world_size} ranks")
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __len__(self) -> int:
+        """ The samples of this rank in an epoch, the same on every rank """
+        return -(-self.num_videos // self.world_size)
+
+    def _worker_shards(self, worker_id: int, num_workers: int) -> Tuple[List[str], int]:
+        """ :return: The shards of the worker in this epoch, and the number of videos it should yield from them """
+        order = list(range(len(self.shards)))
+        if self.shuffle:
+            np.random.default_rng([self.seed, self.epoch]).shuffle(order)
+        rank_shards = _balance_shards(order, self.shard_counts, self.world_size)[self.rank]
+        if len(rank_shards) < num_workers:
+            warnings.warn(f"Only {len(rank_shards)} shards for {num_workers} DataLoader workers, so some get none")
+        readers = min(num_workers, len(rank_shards))
+        if worker_id >= readers:
+            return [], 0
+        worker_shards = _balance_shards(rank_shards, self.shard_counts, readers)[worker_id]
+        num_samples = len(self) // readers + (worker_id < len(self) % readers)
+        return [self.shards[i] for i in worker_shards], num_samples
+
+    def _read_shards(self, shard_files: List[str], num_samples: int):
+        """ Yields `num_samples` (encoded video, metadata) of the shards in order, starting over if they run out """
+        yielded = 0
+        while shard_files and yielded < num_samples:
+            for shard_file in shard_files:
+                for video, metadata in self._read_shard(shard_file):
+                    if yielded == num_samples:
+                        return
+                    yield video, metadata
+                    yielded += 1
+
+    def _read_shard(self, shard_file: str):
+        """ Yields the (encoded video, metadata) of the shard's videos, in order """
+        metadata = None
+        with tarfile.open(self.shards_directory.joinpath(shard_file), mode='r|') as tar:
+            for member in tar:
+                data = tar.extractfile(member).read()
+                if member.name.endswith('.json'):
+                    metadata = {**json.loads(data), 'video_name': f"{member.name[:-len('.json')]}."
+                                                                  f"{self.video_extension}"}
+                else:
+                    yield data, metadata
+
+    def _clip_starts(self, number_of_stored_frames: int, rng: np.random.Generator) -> List[int]:
+        last_start = max(number_of_stored_frames - self.num_frames, 0)
+        if self.clip_sampling == 'random':
+            return rng.integers(0, last_start + 1, self.clips_per_video).tolist()
+        return np.linspace(0, last_start, self.clips_per_video).round().astype(int).tolist() \
+            if self.clips_per_video > 1 else [last_start // 2]
+
+    def _sample(self, video: bytes, metadata: Dict, rng: np.random.Generator) -> Dict:
+        number_of_stored_frames = -(-metadata['frames'] // self.sample_rate)
+        clip_starts = self._clip_starts(number_of_stored_frames, rng)
+        # Only decodes from the first clip to the end of the last one
+        first_start = min(clip_starts)
+        frames = decode_video_frames(io.BytesIO(video), self.sample_rate,
+                                     max(clip_starts) - first_start + self.num_frames, self.resolution,
+                                     start_frame=first_start * self.sample_rate)
+        # (T, H, W, C) -> (C, T, H, W)
+        clips = [torch.from_numpy(frames[start - first_start:start - first_start + self.num_frames]).permute(3, 0, 1, 2)
+                 for start in clip_starts]
+        sample = {
+            'video': clips[0] if self.clips_per_video == 1 else clips,
+            'label': metadata['label_id'],
+            'video_name': metadata['video_name'],
+        }
+        if self.transform is not None:
+            sample = self.transform(sample)
+        return sample
+
+    def __iter__(self):
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info else (0, 1)
+        rng = np.random.default_rng([self.seed, self.epoch, self.rank, worker_id])
+        buffer = []
+        for video, metadata in self._read_shards(*self._worker_shards(worker_id, num_workers)):
+            if not self.shuffle:
+                yield self._sample(video, metadata, rng)
+                continue
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append((video, metadata))
+                continue
+            i = rng.integers(len(buffer))
+            buffer[i], (video, metadata) = (video, metadata), buffer[i]
+            yield self._sample(video, metadata, rng)
+        rng.shuffle(buffer)
+        for video, metadata in buffer:
+            yield self._sample(video, metadata, rng)
+
+
+@dataclasses.dataclass
+class ClipPreprocessor:
+    """
+    Turns a video into the `pixel_values` of a single clip, like the inference transforms of the notebooks, but
+    deterministic: the middle clip of the video (`num_frames` frames, `sample_rate` frames apart), its short side scaled
+    to `short_side_size`, center cropped, and normalized.
+
+    It only needs numpy and OpenCV, so it's cheap to pickle into worker processes.
+    """
+    num_frames: int = 16
+    sample_rate: int = 4
+    short_side_size: int = 256
+    crop_size: Tuple[int, int] = (224, 224)
+    mean: Tuple[float, float, float] = (0.485, 0.456, 0.406)
+    std: Tuple[float, float, float] = (0.229, 0.224, 0.225)
+
+    @classmethod
+    def from_image_processor(cls, image_processor, num_frames: int, **kwargs) -> 'ClipPreprocessor':
+        """ :param image_processor: The `transformers` image processor of the checkpoint """
+        if "shortest_edge" in image_processor.size:
+            crop_size = (image_processor.size["shortest_edge"],) * 2
+        else:
+            crop_size = (image_processor.size["height"], image_processor.size["width"])
+        return cls(num_frames=num_frames, crop_size=crop_size, mean=tuple(image_processor.image_mean),
+                   std=tuple(image_processor.image_std), **kwargs)
+
+    def __call__(self, video: Union[str, bytes]) -> np.ndarray:
+        """
+        :param video: Path to the video, or the video file contents
+        :return: (num_frames, 3, height, width) float32 pixel values
+        """
+        video_path = io.BytesIO(video) if isinstance(video, bytes) else video
+        cap = _open_video_capture(video_path)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+        if isinstance(video_path, io.BytesIO):
+            video_path.seek(0)
+        start_frame = max(0, (frame_count - self.num_frames * self.sample_rate) // 2)
+        frames = decode_video_frames(video_path, self.sample_rate, self.num_frames, start_frame=start_frame)
+        return self.transform_frames(frames)
+
+    def transform_frames(self, frames: np.ndarray) -> np.ndarray:
+        """
+        :param frames: (T, height, width, 3) uint8 RGB frames
+        :return: (T, 3, crop height, crop width) float32 pixel values
+        """
+        height, width = frames.shape[1:3]
+        scale = self.short_side_size / min(height, width)
+        new_size = (max(round(width * scale), self.crop_size[1]), max(round(height * scale), self.crop_size[0]))
+        top = (new_size[1] - self.crop_size[0]) // 2
+        left = (new_size[0] - self.crop_size[1]) // 2
+        clip = np.empty((len(frames), self.crop_size[0], self.crop_size[1], 3), dtype=np.float32)
+        for i, frame in enumerate(frames):
+            if new_size != (width, height):
+                frame = cv2.resize(frame, new_size, interpolation=cv2.INTER_AREA)
+            clip[i] = frame[top:top + self.crop_size[0], left:left + self.crop_size[1]]
+        clip = (clip / 255.0 - np.asarray(self.mean, dtype=np.float32)) / np.asarray(self.std, dtype=np.float32)
+        return np.ascontiguousarray(clip.transpose(0, 3, 1, 2))
+
+
+class XCLIPVideoClassifier(torch.nn.Module):
+    """
+    An `XCLIPModel` as a classifier of a fixed set of classes: the logits of a video are its `logits_per_video`
+    against the class names (tokenized like the `collate_fn` of XCLIP_finetune.ipynb). It has the interface of
+    `VideoMAEForVideoClassification` (`model(pixel_values=...).logits`, `config.id2label`), so it can be evaluated,
+    served and exported the same way.
+    """
+
+    def __init__(self, model: torch.nn.Module, tokenizer, id2label: Optional[Dict[int, str]] = None,
+                 max_length: int = 32):
+        """
+        :param id2label: The classes. Defaults to the ones of the model config.
+        """
+        super().__init__()
+        self.model = model
+        id2label = {int(k): v for k, v in (id2label or model.config.id2label).items()}
+        class_names = [id2label[i] for i in range(len(id2label))]
+        tokens = tokenizer(class_names, padding="max_length", max_length=max_length, truncation=True,
+                           return_tensors="pt")
+        self.register_buffer('input_ids', tokens.input_ids)
+        self.register_buffer('attention_mask', tokens.attention_mask)
+        self.config = types.SimpleNamespace(id2label=id2label, label2id={v: k for k, v in id2label.items()},
+                                            num_frames=model.config.vision_config.num_frames)
+
+    def forward(self, pixel_values: torch.Tensor):
+        outputs = self.model(input_ids=self.input_ids, attention_mask=self.attention_mask, pixel_values=pixel_values)
+        return types.SimpleNamespace(logits=outputs.logits_per_video)
+
+
+def load_video_classifier(model_ckpt: str) -> Tuple[torch.nn.Module, ClipPreprocessor]:
+    """
+    Loads a fine-tuned checkpoint (like "omermazig/videomae-finetuned-nba-5-class-4-batch-8000-vid-multiclass", or an
+    XCLIP one) for CPU inference.
+
+    :return: The model, in eval mode, and the preprocessor of its inputs
+    """
+    from transformers import AutoConfig, AutoImageProcessor, AutoModelForVideoClassification
+
+    if AutoConfig.from_pretrained(model_ckpt).model_type == "xclip":
+        from transformers import XCLIPModel, XCLIPProcessor
+
+        processor = XCLIPProcessor.from_pretrained(model_ckpt)
+        model = XCLIPVideoClassifier(XCLIPModel.from_pretrained(model_ckpt), processor.tokenizer).eval()
+        image_processor = processor.image_processor
+    else:
+        image_processor = AutoImageProcessor.from_pretrained(model_ckpt)
+        model = AutoModelForVideoClassification.from_pretrained(model_ckpt).eval()
+    return model, ClipPreprocessor.from_image_processor(image_processor, num_frames=model.config.num_frames)
+
+
+class _LogitsOnly(torch.nn.Module):
+    """ What gets exported to ONNX: pixel values in, logits out """
+
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self.model(pixel_values=pixel_values).logits
+
+
+def export_video_classifier(model: torch.nn.Module, preprocessor: ClipPreprocessor, output_directory,
+                            quantize: bool = True) -> pathlib.Path:
+    """
+    Exports a video classifier (see `load_video_classifier`) for ONNX Runtime, into `output_directory`:
+    - model.onnx: the model with ONNX Runtime's graph optimizations (constant folding, fused attention, layer norm and
+      GELU...) applied offline. Only the hardware independent ones, so the file can move between machines.
+    - model.int8.onnx (if `quantize`): the model with its MatMul and Gemm weights dynamically quantized to int8 (the
+      activations are quantized on the fly, so no calibration data is needed)
+    - engine.json: the labels and the preprocessing, for `load_onnx_video_classifier`
+
+    :return: The output directory
+    """
+    import onnxruntime
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    output_directory = pathlib.Path(output_directory)
+    output_directory.mkdir(parents=True, exist_ok=True)
+    exported_path = output_directory.joinpath('model.exported.onnx')
+    sample_pixel_values = torch.zeros((2, preprocessor.num_frames, 3) + tuple(preprocessor.crop_size))
+    # The TorchScript exporter, because ONNX Runtime's quantization fails on the shapes the dynamo exporter annotates
+    torch.onnx.export(_LogitsOnly(model).eval(), (sample_pixel_values,), str(exported_path),
+                      input_names=['pixel_values'], output_names=['logits'], opset_version=17,
+                      dynamic_axes={'pixel_values': {0: 'batch'}, 'logits': {0: 'batch'}}, dynamo=False)
+
+    session_options = onnxruntime.SessionOptions()
+    session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    session_options.optimized_model_filepath = str(output_directory.joinpath('model.onnx'))
+    onnxruntime.InferenceSession(str(exported_path), session_options, providers=['CPUExecutionProvider'])
+    if quantize:
+        quantize_dynamic(exported_path, output_directory.joinpath('model.int8.onnx'),
+                         op_types_to_quantize=['MatMul', 'Gemm'], weight_type=QuantType.QInt8)
+    for path in output_directory.glob('model.exported.onnx*'):
+        path.unlink()
+
+    with open(output_directory.joinpath('engine.json'), 'w') as f:
+        json.dump({'id2label': {int(k): v for k, v in model.config.id2label.items()},
+                   'preprocessor': dataclasses.asdict(preprocessor)}, f, indent=1)
+    return output_directory
+
+
+class OnnxVideoClassifier:
+    """
+    Runs an exported classifier with ONNX Runtime on CPU. It has the interface of the torch model it was exported from
+    (`model(pixel_values=...).logits`, `config.id2label`), so `evaluate_multi_clip` and the inference server take it
+    as is.
+    """
+
+    def __init__(self, onnx_path, id2label: Dict[int, str], intra_op_num_threads: int = 0,
+                 inter_op_num_threads: int = 0):
+        """
+        :param intra_op_num_threads: Threads for a single operator (0 lets ONNX Runtime use all the cores). See
+        `tune_intra_op_num_threads`.
+        :param inter_op_num_threads: Threads for running independent operators in parallel (0 for ONNX Runtime's
+        choice)
+        """
+        import onnxruntime
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session_options.intra_op_num_threads = intra_op_num_threads
+        session_options.inter_op_num_threads = inter_op_num_threads
+        self.onnx_path = pathlib.Path(onnx_path)
+        self.session = onnxruntime.InferenceSession(str(onnx_path), session_options,
+                                                    providers=['CPUExecutionProvider'])
+        id2label = {int(k): v for k, v in id2label.items()}
+        self.config = types.SimpleNamespace(id2label=id2label, label2id={v: k for k, v in id2label.items()})
+
+    def eval(self) -> 'OnnxVideoClassifier':
+        return self
+
+    def __call__(self, pixel_values) -> types.SimpleNamespace:
+        if isinstance(pixel_values, torch.Tensor):
+            pixel_values = pixel_values.numpy()
+        logits, = self.session.run(['logits'], {'pixel_values': np.ascontiguousarray(pixel_values, dtype=np.float32)})
+        return types.SimpleNamespace(logits=torch.from_numpy(logits))
+
+
+def load_onnx_video_classifier(engine_directory, quantized: bool = True, intra_op_num_threads: int = 0,
+                               inter_op_num_threads: int = 0) -> Tuple[OnnxVideoClassifier, ClipPreprocessor]:
+    """
+    Loads an `export_video_classifier` export. Same as `load_video_classifier`, for the ONNX engine.
+
+    :param quantized: Use the int8 model (if it was exported)
+    """
+    engine_directory = pathlib.Path(engine_directory)
+    with open(engine_directory.joinpath('engine.json')) as f:
+        engine = json.load(f)
+    onnx_path = engine_directory.joinpath('model.int8.onnx')
+    if not quantized or not onnx_path.exists():
+        onnx_path = engine_directory.joinpath('model.onnx')
+    preprocessor = engine['preprocessor']
+    preprocessor = ClipPreprocessor(**{k: tuple(v) if isinstance(v, list) else v for k, v in preprocessor.items()})
+    model = OnnxVideoClassifier(onnx_path, engine['id2label'], intra_op_num_threads, inter_op_num_threads)
+    return model, preprocessor
+
+
+def tune_intra_op_num_threads(onnx_path, pixel_values: np.ndarray, thread_counts: Optional[List[int]] = None,
+                              repeats: int = 5) -> Dict[int, float]:
+    """
+    Times the model with different numbers of intra-op threads. More threads isn't always faster (for small batches,
+    or on machines shared by several servers).
+
+    :param pixel_values: A typical batch
+    :param thread_counts: Defaults to the powers of 2 up to the number of cores
+    :return: The mean seconds per batch, for each thread count
+    """
+    cpu_count = os.cpu_count() or 1
+    thread_counts = thread_counts or sorted({min(2 ** i, cpu_count) for i in range(cpu_count.bit_length() + 1)})
+    seconds_per_batch = {}
+    for thread_count in thread_counts:
+        model = OnnxVideoClassifier(onnx_path, {}, intra_op_num_threads=thread_count)
+        # Warm up (the first run allocates the buffers)
+        model(pixel_values)
+        start_time = time.perf_counter()
+        for _ in range(repeats):
+            model(pixel_values)
+        seconds_per_batch[thread_count] = (time.perf_counter() - start_time) / repeats
+    return seconds_per_batch
+
+
+class MultiClipEvaluationDataset(torch.utils.data.Dataset):
+    """
+    The evaluation set of the notebooks (several clips of each video), decoding each video once: a video's frames are
+    decoded and transformed once, and its clips are `clips_per_video` uniformly spread (so deterministic) windows of them.
+
+    Items are {"frames": (stored frames, 3, H, W) tensor, "clip_starts": [...], "num_frames": clip length,
+    "label": id, "video_name": ...}. Use
+    `collate_multi_clip` to batch them, and `evaluate_multi_clip` to run a model over them.
+    """
+
+    def __init__(self, dataset_split_path, preprocessor: ClipPreprocessor, clips_per_video: int = 5,
+                 label2id: Optional[Dict[str, int]] = None, video_extension: str = "avi"):
+        """
+        :param dataset_split_path: A split folder of the dataset, like `dataset/test`
+        :param label2id: The label ids of the model (`model.config.label2id`). Defaults to the sorted class folders,
+        like `pytorchvideo.data.Ucf101`.
+        """
+        self.videos, folders_label2id = _list_labelled_videos(pathlib.Path(dataset_split_path), video_extension)
+        self.label2id = label2id or folders_label2id
+        self.preprocessor = preprocessor
+        self.clips_per_video = clips_per_video
+
+    def __len__(self) -> int:
+        return len(self.videos)
+
+    def clip_starts(self, number_of_stored_frames: int) -> List[int]:
+        last_start = max(number_of_stored_frames - self.preprocessor.num_frames, 0)
+        return np.linspace(0, last_start, self.clips_per_video).round().astype(int).tolist()
+
+    def __getitem__(self, index: int) -> Dict:
+        video_path, label = self.videos[index]
+        sample_rate = self.preprocessor.sample_rate
+        cap = cv2.VideoCapture(str(video_path))
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+        number_of_stored_frames = max(-(-frame_count // sample_rate), self.preprocessor.num_frames)
+        frames = decode_video_frames(str(video_path), sample_rate, number_of_stored_frames)
+        return {
+            'frames': torch.from_numpy(self.preprocessor.transform_frames(frames)),
+            'clip_starts': self.clip_starts(number_of_stored_frames),
+            'num_frames': self.preprocessor.num_frames,
+            'label': self.label2id[label],
+            'video_name': video_path.name,
+        }
+
+
+def collate_multi_clip(examples: List[Dict]) -> Dict:
+    """
+    Stacks the clips of the videos into `pixel_values` of shape (videos * clips, T, C, H, W), the clips of each video
+    one after the other. The labels stay one per video.
+    """
+    num_frames = examples[0]['num_frames']
+    pixel_values = torch.stack([example['frames'][start:start + num_frames]
+                                for example in examples for start in example['clip_starts']])
+    return {
+        'pixel_values': pixel_values,
+        'labels': torch.tensor([example['label'] for example in examples]),
+        'clips_per_video': len(examples[0]['clip_starts']),
+        'video_names': [example['video_name'] for example in examples],
+    }
+
+
+def evaluate_multi_clip(model: torch.nn.Module, dataset: MultiClipEvaluationDataset, batch_size: int = 4,
+                        num_workers: int = 0) -> Dict:
+    """
+    Runs the model over all the clips of the dataset, and sums the logits of each video's clips, like `compute_metrics`
+    of the notebooks.
+
+    :param batch_size: Videos per batch (so `batch_size * clips_per_video` clips go through the model at once)
+    :return: The per video 'logits', 'predictions', 'labels' and 'video_names', and the 'accuracy' and (micro) 'f1'
+    """
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, num_workers=num_workers,
+                                         collate_fn=collate_multi_clip)
+    model = model.eval()
+    video_logits, labels, video_names = [], [], []
+    with torch.inference_mode():
+        for batch in tqdm(loader):
+            logits = model(pixel_values=batch['pixel_values']).logits
+            video_logits.append(logits.view(len(batch['labels']), batch['clips_per_video'], -1).sum(dim=1).numpy())
+            labels.append(batch['labels'].numpy())
+            video_names += batch['video_names']
+    video_logits = np.concatenate(video_logits)
+    labels = np.concatenate(labels)
+    predictions = video_logits.argmax(axis=1)
+    return {
+        'logits': video_logits,
+        'predictions': predictions,
+        'labels': labels,
+        'video_names': video_names,
+        'accuracy': accuracy_score(labels, predictions),
+        'f1': f1_score(labels, predictions, average='micro'),
+    }
+
+
+def compare_video_classifiers(classifiers: Dict[str, Callable], dataset: MultiClipEvaluationDataset,
+                              reference: Optional[str] = None, batch_size: int = 4) -> pd.DataFrame:
+    """
+    A parity check between versions of a classifier (like the eager model and its ONNX exports), on a dataset split.
+
+    :param classifiers: Name to model (anything `evaluate_multi_clip` takes)
+    :param reference: The name of the model the others are compared to. Defaults to the first one.
+    :return: A row per model: its accuracy and f1, how many of its predictions agree with the reference, the largest
+    difference of its per video logits from the reference's, its speed, and its classification report
+    """
+    reference = reference or next(iter(classifiers))
+    class_labels = [label for label, _ in sorted(dataset.label2id.items(), key=lambda item: item[1])]
+    results = {}
+    for name, classifier in classifiers.items():
+        start_time = time.perf_counter()
+        results[name] = evaluate_multi_clip(classifier, dataset, batch_size=batch_size)
+        results[name]['seconds'] = time.perf_counter() - start_time
+
+    reference_results = results[reference]
+    rows = []
+    for name, result in results.items():
+        rows.append({
+            'classifier': name,
+            'accuracy': result['accuracy'],
+            'f1': result['f1'],
+            'agreement': float(np.mean(result['predictions'] == reference_results['predictions'])),
+            'max_logit_difference': float(np.abs(result['logits'] - reference_results['logits']).max()),
+            'videos_per_second': len(dataset) / result['seconds'],
+            'classification_report': classification_report(result['labels'], result['predictions'],
+                                                           labels=list(range(len(class_labels))),
+                                                           target_names=class_labels, zero_division=0),
+        })
+    return pd.DataFrame(rows).set_index('classifier')
+
+
+def _yield_sliding_windows(video_path, preprocessor: ClipPreprocessor, window_stride: int):
+    """
+    Decodes the video once, and yields its windows of `preprocessor.num_frames` frames (`preprocessor.sample_rate`
+    frames apart), one every `window_stride` frames. The stride is a multiple of the sample rate, so overlapping
+    windows share their frames, and each frame is transformed once. Only one window of frames is held at a time.
+
+    A video shorter than a window gets a single window, padded with its last frame like `decode_video_frames` does.
+
+    :return: Yields (first frame number, (num_frames, 3, height, width) float32 pixel values)
+    """
+    num_frames, sample_rate = preprocessor.num_frames, preprocessor.sample_rate
+    frames = collections.deque(maxlen=num_frames)
+    stored_frames = 0
+    cap = _open_video_capture(video_path)
+    try:
+        frame_number = 0
+        while cap.grab():
+            if frame_number % sample_rate == 0:
+                _, frame = cap.retrieve()
+                frames.append(preprocessor.transform_frames(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)[None])[0])
+                stored_frames += 1
+                if stored_frames >= num_frames and (stored_frames - num_frames) % (window_stride // sample_rate) == 0:
+                    yield (stored_frames - num_frames) * sample_rate, np.stack(frames)
+            frame_number += 1
+    finally:
+        cap.release()
+    if 0 < stored_frames < num_frames:
+        yield 0, np.stack(list(frames) + [frames[-1]] * (num_frames - stored_frames))
+
+
+def temporal_non_maximum_suppression(detections: pd.DataFrame, iou_threshold: float) -> pd.DataFrame:
+    """
+    Greedily keeps the best scored detections, dropping the ones whose time range overlaps a kept one by more than
+    `iou_threshold` (intersection over union). It ignores the labels: the windows around a shot often disagree on its
+    type, and it's still a single shot.
+
+    :param detections: With 'start_seconds', 'end_seconds' and 'score' columns
+    :return: The kept detections, by start time
+    """
+    detections = detections.sort_values('score', ascending=False, kind='stable')
+    starts, ends = detections['start_seconds'].to_numpy(), detections['end_seconds'].to_numpy()
+    suppressed = np.zeros(len(detections), dtype=bool)
+    kept = []
+    for i in range(len(detections)):
+        if suppressed[i]:
+            continue
+        kept.append(i)
+        intersection = np.clip(np.minimum(ends[i], ends) - np.maximum(starts[i], starts), 0, None)
+        union = (ends[i] - starts[i]) + (ends - starts) - intersection
+        suppressed |= intersection > iou_threshold * union
+    return detections.iloc[kept].sort_values('start_seconds').reset_index(drop=True)
+
+
+def detect_shots_in_video(model: Callable, preprocessor: ClipPreprocessor, video_path, stride_seconds: float = 1.0,
+                          batch_size: int = 8, min_score: float = 0.5, iou_threshold: float = 0.3,
+                          background_labels=()) -> Tuple[pd.DataFrame, Dict]:
+    """
+    Finds and labels the shots of a long video (a full broadcast or a condensed game), instead of a pre-cut clip: the
+    classifier scores overlapping windows of the video, decoded once (see `_yield_sliding_windows`) and batched, and
+    the windows whose best label scores at least `min_score` are merged with `temporal_non_maximum_suppression`.
+
+    The memory it takes doesn't depend on the video length: one window of frames and one batch of windows.
+
+    :param model: Anything `evaluate_multi_clip` takes, with a `config.id2label`
+    :param stride_seconds: Seconds between window starts, rounded to a multiple of the preprocessor's sample rate
+    :param background_labels: Labels that aren't shots (for a classifier trained with a background class), which
+    never make a detection
+    :return: The detections ('start_seconds', 'end_seconds', 'label' and 'score', by start time), and the run's
+    stats: 'video_seconds', 'seconds', 'windows', and 'real_time_factor' (processing seconds per video second, so
+    below 1 is faster than real time)
+    """
+    cap = _open_video_capture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    video_seconds = cap.get(cv2.CAP_PROP_FRAME_COUNT) / fps
+    cap.release()
+    sample_rate = preprocessor.sample_rate
+    window_stride = max(1, round(stride_seconds * fps / sample_rate)) * sample_rate
+    window_frames = preprocessor.num_frames * sample_rate
+    id2label = {int(i): label for i, label in model.config.id2label.items()}
+    shot_ids = [i for i in sorted(id2label) if id2label[i] not in background_labels]
+
+    model = model.eval()
+    rows = []
+    number_of_windows = 0
+    start_time = time.perf_counter()
+
+    def score_batch(window_starts, windows):
+        with torch.inference_mode():
+            logits = model(pixel_values=torch.from_numpy(np.stack(windows))).logits
+        probabilities = torch.softmax(logits.float(), dim=1)[:, shot_ids].numpy()
+        for window_start, window_probabilities in zip(window_starts, probabilities):
+            best = int(window_probabilities.argmax())
+            if window_probabilities[best] >= min_score:
+                rows.append((window_start / fps, (window_start + window_frames) / fps, id2label[shot_ids[best]],
+                             float(window_probabilities[best])))
+
+    window_starts, windows = [], []
+    for window_start, window in _yield_sliding_windows(video_path, preprocessor, window_stride):
+        window_starts.append(window_start)
+        windows.append(window)
+        if len(windows) == batch_size:
+            score_batch(window_starts, windows)
+            number_of_windows += len(windows)
+            window_starts, windows = [], []
+    if windows:
+        score_batch(window_starts, windows)
+        number_of_windows += len(windows)
+
+    seconds = time.perf_counter() - start_time
+    detections = temporal_non_maximum_suppression(
+        pd.DataFrame(rows, columns=['start_seconds', 'end_seconds', 'label', 'score']), iou_threshold)
+    stats = {'video_seconds': video_seconds, 'seconds': seconds, 'windows': number_of_windows,
+             'real_time_factor': seconds / video_seconds if video_seconds else float('nan')}
+    return detections, stats
+
+
+def video_embeddings(model: torch.nn.Module, pixel_values: torch.Tensor) -> torch.Tensor:
+    """
+    The pooled embeddings the classification head of the model sees: the input of the `classifier` layer of the
+    `transformers` video classifiers (the mean pooled and normalized tokens of VideoMAE), or the video embeddings of an
+    `XCLIPVideoClassifier` (the ones compared to the class name embeddings).
+
+    :return: A (clips, embedding size) tensor
+    """
+    if isinstance(model, XCLIPVideoClassifier):
+        video_features = model.model.get_video_features(pixel_values=pixel_values)
+        # A tensor in older versions of transformers
+        return video_features if isinstance(video_features, torch.Tensor) else video_features.pooler_output
+    classifier = getattr(model, 'classifier', None)
+    if not isinstance(classifier, torch.nn.Module):
+        raise TypeError(f"{type(model).__name__} has no `classifier` layer to take the embeddings from")
+    classifier_inputs = []
+    hook = classifier.register_forward_hook(lambda module, inputs, output: classifier_inputs.append(inputs[0]))
+    try:
+        model(pixel_values=pixel_values)
+    finally:
+        hook.remove()
+    return classifier_inputs[0]
+
+
+_feature_views = {
+    'center': lambda pixel_values: pixel_values,
+    # Like the `RandomHorizontalFlip` of the training transforms
+    'flipped': lambda pixel_values: torch.flip(pixel_values, dims=[-1]),
+}
+
+
+def extract_clip_features(model: torch.nn.Module, preprocessor: ClipPreprocessor, dataset_split_path,
+                          output_directory, clips_per_video: int = 5, views: Tuple[str, ...] = ('center',),
+                          batch_size: int = 4, num_workers: int = 0, video_extension: str = "avi") -> pathlib.Path:
+    """
+    Runs the frozen backbone of a video classifier (see `video_embeddings`) once over every clip and view of a dataset
+    split, and stores the embeddings in a memory-mappable `features.npy` of shape (videos, clips * views, embedding
+    size), with an `index.json` of the videos and their labels. `ClipFeatureStore` reads it back, for training heads
+    (`train_feature_head`) and searching for similar videos, without running the backbone again.
+
+    The clips are the uniformly spread clips of `MultiClipEvaluationDataset` (each video is decoded once).
+
+    :param model: Like the ones of `load_video_classifier`
+    :param dataset_split_path: A split folder of the dataset, like `dataset/train`
+    :param output_directory: Where to write the features and the index
+    :param views: The views of each clip: 'center' (the preprocessed clip) and 'flipped' (horizontally)
+    :param batch_size: Videos per batch (so `batch_size * clips_per_video * len(views)` clips go through the model)
+    :return: The path of the index file
+    """
+    unknown_views = set(views) - set(_feature_views)
+    if unknown_views:
+        raise ValueError(f"Unknown views {sorted(unknown_views)}. Known views are {list(_feature_views)}.")
+    output_directory = pathlib.Path(output_directory)
+    output_directory.mkdir(parents=True, exist_ok=True)
+    dataset = MultiClipEvaluationDataset(dataset_split_path, preprocessor, clips_per_video=clips_per_video,
+                                         video_extension=video_extension)
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, num_workers=num_workers,
+                                         collate_fn=collate_multi_clip)
+    features_path = output_directory.joinpath('features.npy')
+    features = None
+    video_index = 0
+    model = model.eval()
+    with torch.inference_mode():
+        for batch in tqdm(loader):
+            num_videos = len(batch['labels'])
+            # (views, videos * clips, embedding size) -> (videos, clips * views, embedding size)
+            embeddings = torch.stack([video_embeddings(model, _feature_views[view](batch['pixel_values']))
+                                      for view in views])
+            embeddings = embeddings.view(len(views), num_videos, clips_per_video, -1).permute(1, 2, 0, 3)
+            embeddings = embeddings.reshape(num_videos, clips_per_video * len(views), -1)
+            if features is None:
+                features = np.lib.format.open_memmap(features_path, mode='w+', dtype=np.float32,
+                                                     shape=(len(dataset),) + tuple(embeddings.shape[1:]))
+            features[video_index:video_index + num_videos] = embeddings.numpy()
+            video_index += num_videos
+    features.flush()
+    del features
+
+    dataset_split_path = pathlib.Path(dataset_split_path)
+    index_path = output_directory.joinpath('index.json')
+    with open(index_path, 'w') as f:
+        json.dump({
+            'model': getattr(getattr(model, 'config', None), '_name_or_path', None) or type(model).__name__,
+            'preprocessor': dataclasses.asdict(preprocessor),
+            'clips_per_video': clips_per_video,
+            'views': list(views),
+            'label2id': dataset.label2id,
+            'entries': [{'path': video_path.relative_to(dataset_split_path).as_posix(), 'label': label}
+                        for video_path, label in dataset.videos],
+        }, f)
+    return index_path
+
+
+class ClipFeatureStore:
+    """
+    The embeddings of an `extract_clip_features` run: `features` is the (videos, clips * views, embedding size)
+    memory-mapped array, and `entries` the videos (their 'path' in the split and their 'label'), in the same order.
+    """
+
+    def __init__(self, directory):
+        """ :param directory: Folder of an `extract_clip_features` run """
+        self.directory = pathlib.Path(directory)
+        with open(self.directory.joinpath('index.json')) as f:
+            index = json.load(f)
+        self.model = index['model']
+        self.clips_per_video = index['clips_per_video']
+        self.views = index['views']
+        self.label2id = index['label2id']
+        self.entries = index['entries']
+        self.features = np.load(self.directory.joinpath('features.npy'), mmap_mode='r')
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def video_names(self) -> List[str]:
+        return [os.path.basename(entry['path']) for entry in self.entries]
+
+    @property
+    def labels(self) -> List[str]:
+        return [entry['label'] for entry in self.entries]
+
+    def video_embeddings(self) -> np.ndarray:
+        """ :return: The mean embedding of each video (over its clips and views), L2 normalized """
+        embeddings = self.features.mean(axis=1)
+        return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+    def nearest_neighbours(self, k: int = 5, query_embeddings: Optional[np.ndarray] = None,
+                           block_size: int = 1024) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        An exact cosine similarity search over the videos (in blocks of queries, so the similarity matrix never has
+        more than `block_size` rows).
+
+        :param query_embeddings: L2 normalized embeddings to search for (like another store's `video_embeddings()`).
+        Defaults to the videos of this store, each one leaving itself out.
+        :return: The (queries, k) indices of the most similar videos, most similar first, and their similarities
+        """
+        embeddings = self.video_embeddings()
+        leave_self_out = query_embeddings is None
+        if leave_self_out:
+            query_embeddings = embeddings
+        k = min(k, len(embeddings) - leave_self_out)
+        indices = np.empty((len(query_embeddings), k), dtype=np.int64)
+        similarities = np.empty((len(query_embeddings), k), dtype=np.float32)
+        for start in range(0, len(query_embeddings), block_size):
+            block_similarities = query_embeddings[start:start + block_size] @ embeddings.T
+            if leave_self_out:
+                np.fill_diagonal(block_similarities[:, start:], -np.inf)
+            block_indices = np.argpartition(-block_similarities, k - 1, axis=1)[:, :k]
+            block_top_similarities = np.take_along_axis(block_similarities, block_indices, axis=1)
+            order = np.argsort(-block_top_similarities, axis=1)
+            indices[start:start + block_size] = np.take_along_axis(block_indices, order, axis=1)
+            similarities[start:start + block_size] = np.take_along_axis(block_top_similarities, order, axis=1)
+        return indices, similarities
+
+    def label_targets(self, label_groups: Optional[Dict[str, List[str]]] = None,
+                      multilabel: bool = False) -> Tuple[np.ndarray, np.ndarray, Dict[int, str]]:
+        """
+        The training targets of the videos, by their labels, or by groups of them.
+
+        :param label_groups: Class name to the labels it groups, like `{'HOOK_SHOT': hook_shot_classes.values(),
+        'DUNK': dunk_classes.values()}`. Defaults to a class per label.
+        :param multilabel: Whether a video can be in several classes (the groups can overlap)
+        :return: The indices of the videos that are in a class (all of them, when multilabel), their targets (class ids,
+        or (videos, classes) multi-hot rows when multilabel), and the class names by id
+        """
+        if label_groups is None:
+            label_groups = {label: [label] for label in sorted(self.label2id, key=self.label2id.get)}
+        label_groups = {class_name: set(labels) for class_name, labels in label_groups.items()}
+        id2label = dict(enumerate(label_groups))
+        memberships = np.array([[entry['label'] in labels for labels in label_groups.values()]
+                                for entry in self.entries], dtype=bool).reshape(len(self.entries), len(id2label))
+        if multilabel:
+            return np.arange(len(self.entries)), memberships.astype(np.float32), id2label
+        overlapping = np.flatnonzero(memberships.sum(axis=1) > 1)
+        if len(overlapping):
+            raise ValueError(f"The label {self.entries[overlapping[0]]['label']} is in more than one of the groups. "
+                             f"Use `multilabel=True` for overlapping groups.")
+        video_indices = np.flatnonzero(memberships.any(axis=1))
+        return video_indices, memberships[video_indices].argmax(axis=1), id2label
+
+
+def _make_feature_head(embedding_size: int, num_labels: int, hidden_size: Optional[int],
+                       dropout: float) -> torch.nn.Module:
+    if hidden_size is None:
+        return torch.nn.Sequential(torch.nn.Dropout(dropout), torch.nn.Linear(embedding_size, num_labels))
+    return torch.nn.Sequential(torch.nn.Linear(embedding_size, hidden_size), torch.nn.GELU(),
+                               torch.nn.Dropout(dropout), torch.nn.Linear(hidden_size, num_labels))
+
+
+def evaluate_feature_head(head: torch.nn.Module, store: ClipFeatureStore,
+                          label_groups: Optional[Dict[str, List[str]]] = None, multilabel: bool = False) -> Dict:
+    """
+    Scores the videos of a store with a `train_feature_head` head, averaging the logits of each video's clips and
+    views, like `evaluate_multi_clip` does.
+
+    :return: The per video 'logits', 'predictions', 'labels' and 'video_names', and the 'accuracy' and (micro) 'f1'.
+    When multilabel, the predictions are the classes with a positive logit, and the accuracy is the exact match ratio.
+    """
+    video_indices, targets, _ = store.label_targets(label_groups, multilabel)
+    head = head.eval()
+    with torch.inference_mode():
+        logits = head(torch.from_numpy(np.asarray(store.features[video_indices]))).mean(dim=1).numpy()
+    predictions = (logits > 0).astype(np.float32) if multilabel else logits.argmax(axis=1)
+    video_names = store.video_names
+    return {
+        'logits': logits,
+        'predictions': predictions,
+        'labels': targets,
+        'video_names': [video_names[i] for i in video_indices],
+        'accuracy': accuracy_score(targets, predictions),
+        'f1': f1_score(targets, predictions, average='micro'),
+    }
+
+
+def train_feature_head(store: ClipFeatureStore, label_groups: Optional[Dict[str, List[str]]] = None,
+                       multilabel: bool = False, hidden_size: Optional[int] = None, dropout: float = 0.1,
+                       epochs: int = 50, batch_size: int = 256, learning_rate: float = 1e-3,
+                       weight_decay: float = 1e-4, validation_store: Optional[ClipFeatureStore] = None,
+                       seed: int = 0) -> Tuple[torch.nn.Module, Dict]:
+    """
+    Trains a classification head over the frozen backbone embeddings of a store, with every clip and view of a video
+    as a training example. It takes seconds on CPU, so class groupings, multilabel setups and head sizes can be compared
+    without fine-tuning the whole model for each.
+
+    :param label_groups: See `ClipFeatureStore.label_targets`
+    :param hidden_size: None for a linear head, or the hidden layer size of an MLP head
+    :param validation_store: The store of the validation split. Defaults to the training store.
+    :return: The head, with the class names as its `id2label`, and its `evaluate_feature_head` results on the
+    validation store (plus the training 'seconds')
+    """
+    start_time = time.perf_counter()
+    generator = torch.Generator().manual_seed(seed)
+    torch.manual_seed(seed)
+    video_indices, targets, id2label = store.label_targets(label_groups, multilabel)
+    features = torch.from_numpy(np.asarray(store.features[video_indices]))
+    views_per_video = features.shape[1]
+    features = features.reshape(-1, features.shape[-1])
+    targets = torch.from_numpy(np.repeat(targets, views_per_video, axis=0))
+    head = _make_feature_head(features.shape[-1], len(id2label), hidden_size, dropout)
+    head.id2label = id2label
+    loss_function = torch.nn.BCEWithLogitsLoss() if multilabel else torch.nn.CrossEntropyLoss()
+    optimizer = torch.optim.AdamW(head.parameters(), lr=learning_rate, weight_decay=weight_decay)
+    steps_per_epoch = -(-len(features) // batch_size)
+    scheduler = torch.optim.lr_scheduler.OneCycleLR(optimizer, max_lr=learning_rate,
+                                                    total_steps=epochs * steps_per_epoch)
+    head.train()
+    for _ in range(epochs):
+        for batch_indices in torch.randperm(len(features), generator=generator).split(batch_size):
+            loss = loss_function(head(features[batch_indices]), targets[batch_indices])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            scheduler.step()
+    seconds = time.perf_counter() - start_time
+
+    results = evaluate_feature_head(head, validation_store or store, label_groups, multilabel)
+    results['seconds'] = seconds
+    return head, results
+
+
+def find_near_duplicate_videos(store: ClipFeatureStore, min_similarity: float = 0.98, k: int = 5) -> pd.DataFrame:
+    """
+    :return: The pairs of videos whose embeddings are at least `min_similarity` similar (cosine), once each, most
+    similar first: 'video_name', 'label', 'other_video_name', 'other_label', 'similarity'
+    """
+    indices, similarities = store.nearest_neighbours(k)
+    video_names, labels = store.video_names, store.labels
+    rows = [{'video_name': video_names[i], 'label': labels[i], 'other_video_name': video_names[j],
+             'other_label': labels[j], 'similarity': float(similarity)}
+            for i, (neighbours, neighbour_similarities) in enumerate(zip(indices, similarities))
+            for j, similarity in zip(neighbours, neighbour_similarities)
+            if similarity >= min_similarity and i < j]
+    return pd.DataFrame(rows, columns=['video_name', 'label', 'other_video_name', 'other_label', 'similarity']) \
+        .sort_values('similarity', ascending=False, ignore_index=True)
+
+
+def find_mislabelled_videos(store: ClipFeatureStore, k: int = 10, min_agreement: float = 0.7) -> pd.DataFrame:
+    """
+    Finds the videos whose nearest neighbours mostly agree on another label than theirs.
+
+    :param min_agreement: The fraction of the `k` neighbours that must have the same other label
+    :return: 'video_name', 'label', 'neighbours_label' (the most common label of the neighbours), and 'agreement',
+    most suspect first
+    """
+    indices, _ = store.nearest_neighbours(k)
+    video_names, labels = store.video_names, store.labels
+    rows = []
+    for i, neighbours in enumerate(indices):
+        neighbours_label, count = collections.Counter(labels[j] for j in neighbours).most_common(1)[0]
+        agreement = count / len(neighbours)
+        if neighbours_label != labels[i] and agreement >= min_agreement:
+            rows.append({'video_name': video_names[i], 'label': labels[i], 'neighbours_label': neighbours_label,
+                         'agreement': agreement})
+    return pd.DataFrame(rows, columns=['video_name', 'label', 'neighbours_label', 'agreement']) \
+        .sort_values('agreement', ascending=False, ignore_index=True)
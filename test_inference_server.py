@@ -0,0 +1,109 @@
+import json
+import threading
+import time
+import types
+import urllib.error
+import urllib.request
+
+import cv2
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from inference_server import DynamicBatcher, ShotClassifierService, make_inference_server
+from model_utils import ClipPreprocessor
+
+
+class _TinyVideoClassifier(torch.nn.Module):
+    """ Scores each class by the mean brightness of the clip, like a model that learned brightness = label """
+
+    def forward(self, pixel_values):
+        brightness = pixel_values.mean(dim=(1, 2, 3, 4))
+        logits = -(brightness[:, None] - torch.tensor([-1.5, 0.0, 1.5])) ** 2 * 10
+        return types.SimpleNamespace(logits=logits)
+
+
+def _write_flat_video(path, brightness, number_of_frames=40, resolution=(64, 48)):
+    out = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'MJPG'), 30, resolution)
+    for _ in range(number_of_frames):
+        out.write(np.full((resolution[1], resolution[0], 3), brightness, dtype=np.uint8))
+    out.release()
+
+
+def test_dynamic_batcher_groups_requests():
+    def predict_batch(batch):
+        time.sleep(0.05)
+        return batch * 2
+
+    batcher = DynamicBatcher(predict_batch, max_batch_size=4, max_wait_ms=50)
+    futures = [batcher.submit(np.array([i])) for i in range(10)]
+    assert [int(future.result(timeout=5)[0]) for future in futures] == [2 * i for i in range(10)]
+    assert max(batcher.batch_sizes) == 4
+    assert sum(k * v for k, v in batcher.batch_sizes.items()) == 10
+    batcher.close()
+
+
+def test_dynamic_batcher_propagates_errors():
+    def predict_batch(batch):
+        raise RuntimeError("out of memory")
+
+    batcher = DynamicBatcher(predict_batch, max_batch_size=2, max_wait_ms=1)
+    with pytest.raises(RuntimeError):
+        batcher.submit(np.zeros(1)).result(timeout=5)
+    batcher.close()
+
+
+def test_clip_preprocessor_shape_and_normalization(tmp_path):
+    _write_flat_video(tmp_path / "video.avi", 128)
+    preprocessor = ClipPreprocessor(num_frames=4, sample_rate=2, short_side_size=32, crop_size=(24, 24),
+                                    mean=(0.5, 0.5, 0.5), std=(0.5, 0.5, 0.5))
+    pixel_values = preprocessor(str(tmp_path / "video.avi"))
+    assert pixel_values.shape == (4, 3, 24, 24) and pixel_values.dtype == np.float32
+    assert np.allclose(pixel_values, 128 / 255 * 2 - 1, atol=0.05)
+    assert np.allclose(preprocessor((tmp_path / "video.avi").read_bytes()), pixel_values)
+
+
+@pytest.fixture
+def inference_server(tmp_path):
+    preprocessor = ClipPreprocessor(num_frames=4, sample_rate=2, short_side_size=32, crop_size=(24, 24),
+                                    mean=(0.5, 0.5, 0.5), std=(0.5, 0.5, 0.5))
+    service = ShotClassifierService(_TinyVideoClassifier(), preprocessor, {0: "DUNK", 1: "LAYUP", 2: "JUMP_SHOT"},
+                                    max_batch_size=4, max_wait_ms=20, preprocess_workers=2, use_processes=False)
+    server = make_inference_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+    service.close()
+
+
+def _post(url, data, content_type):
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": content_type})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def test_inference_server_predicts_uploads_and_paths(tmp_path, inference_server):
+    for brightness, label in ((30, "DUNK"), (128, "LAYUP"), (230, "JUMP_SHOT")):
+        _write_flat_video(tmp_path / f"{label}.avi", brightness)
+
+    result = _post(f"{inference_server}/predict", (tmp_path / "DUNK.avi").read_bytes(), "video/x-msvideo")
+    assert result["label"] == "DUNK"
+    assert set(result["scores"]) == {"DUNK", "LAYUP", "JUMP_SHOT"}
+    assert sum(result["scores"].values()) == pytest.approx(1)
+
+    for label in ("LAYUP", "JUMP_SHOT"):
+        request = json.dumps({"path": str(tmp_path / f"{label}.avi")}).encode()
+        assert _post(f"{inference_server}/predict", request, "application/json")["label"] == label
+
+    with urllib.request.urlopen(f"{inference_server}/stats") as response:
+        stats = json.loads(response.read())
+    assert stats["completed_requests"] == 3
+    assert stats["p50_ms"] <= stats["p99_ms"]
+
+
+def test_inference_server_rejects_missing_paths(inference_server):
+    with pytest.raises(urllib.error.HTTPError) as e:
+        _post(f"{inference_server}/predict", json.dumps({"path": "missing.avi"}).encode(), "application/json")
+    assert e.value.code == 400
@@ -0,0 +1,353 @@
+import json
+import pickle
+import tarfile
+import types
+
+import cv2
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from model_utils import build_clip_cache, ClipCacheDataset, decode_video_frames, ClipPreprocessor, \
+    MultiClipEvaluationDataset, evaluate_multi_clip, export_video_classifier, load_onnx_video_classifier, \
+    compare_video_classifiers, tune_intra_op_num_threads, XCLIPVideoClassifier, pack_dataset_shards, \
+    ShardedClipDataset, detect_shots_in_video, _yield_sliding_windows, extract_clip_features, ClipFeatureStore, \
+    train_feature_head, find_near_duplicate_videos, find_mislabelled_videos
+
+
+def _write_numbered_video(path, number_of_frames, resolution=(32, 24), fps=30):
+    """ Writes a video whose n-th frame has brightness 2 * n, to find which frames were stored """
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), fps, resolution)
+    for i in range(number_of_frames):
+        writer.write(np.full((resolution[1], resolution[0], 3), 2 * i, dtype=np.uint8))
+    writer.release()
+
+
+def _scale_clips(sample):
+    return {**sample, "video": [clip.float() / 255 for clip in sample["video"]]}
+
+
+@pytest.fixture
+def small_split(tmp_path):
+    split = tmp_path / "train"
+    for label, lengths in (("DUNK", (40, 12)), ("JUMP_SHOT", (40, 40, 40))):
+        split.joinpath(label).mkdir(parents=True)
+        for i, length in enumerate(lengths):
+            _write_numbered_video(split / label / f"{label}_{i}.avi", length)
+    return split
+
+
+def test_decode_video_frames_stride_and_padding(small_split):
+    frames = decode_video_frames(str(small_split / "DUNK" / "DUNK_1.avi"), frame_stride=4, frames_per_video=6,
+                                 resolution=(16, 12))
+    assert frames.shape == (6, 12, 16, 3)
+    # frames 0, 4, 8 are stored, then the last one is repeated
+    assert np.allclose(frames[:, 6, 8, 0], [0, 8, 16, 16, 16, 16], atol=3)
+
+
+def test_build_clip_cache_index(small_split, tmp_path):
+    build_clip_cache(small_split, tmp_path / "cache", frame_stride=4, frames_per_video=10, resolution=(32, 24),
+                     videos_per_shard=2, num_workers=2)
+    dataset = ClipCacheDataset(tmp_path / "cache", num_frames=4, clip_sampling="uniform")
+    assert len(dataset) == 5
+    assert dataset.label2id == {"DUNK": 0, "JUMP_SHOT": 1}
+    assert len(list((tmp_path / "cache").glob("shard-*.npy"))) == 3
+    assert [entry["label_id"] for entry in dataset.entries] == [0, 0, 1, 1, 1]
+
+    sample = dataset[3]
+    assert sample["video"].shape == (3, 4, 24, 32)
+    assert sample["video"].dtype == torch.uint8
+    assert sample["label"] == 1 and sample["video_name"] == "JUMP_SHOT_1.avi"
+    # uniform sampling takes the middle clip: stored frames 3..6, i.e. video frames 12..24
+    assert np.allclose(sample["video"][0, :, 0, 0].numpy(), [24, 32, 40, 48], atol=3)
+
+
+def test_clip_cache_dataset_multi_clip_and_workers(small_split, tmp_path):
+    build_clip_cache(small_split, tmp_path / "cache", frame_stride=2, frames_per_video=8, resolution=(32, 24),
+                     num_workers=1)
+    dataset = ClipCacheDataset(tmp_path / "cache", num_frames=4, clip_sampling="uniform", clips_per_video=3,
+                               transform=_scale_clips)
+    dataset[0]
+    # the open memory maps are not pickled into the workers
+    assert pickle.loads(pickle.dumps(dataset))._shards == {}
+    clips = dataset[0]["video"]
+    assert len(clips) == 3 and clips[0].dtype == torch.float32
+    assert [round(float(c[0, 0, 0, 0]) * 255 / 4) for c in clips] == [0, 2, 4]
+
+    loader = torch.utils.data.DataLoader(ClipCacheDataset(tmp_path / "cache", num_frames=4), batch_size=2,
+                                         num_workers=2)
+    video_indices = sorted(i for batch in loader for i in batch["video_index"].tolist())
+    assert video_indices == list(range(5))
+
+
+def test_clip_cache_dataset_rejects_long_clips(small_split, tmp_path):
+    build_clip_cache(small_split, tmp_path / "cache", frames_per_video=4, resolution=(32, 24), num_workers=1)
+    with pytest.raises(ValueError):
+        ClipCacheDataset(tmp_path / "cache", num_frames=8)
+
+
+def test_pack_dataset_shards_index(small_split, tmp_path):
+    bank_info = tmp_path / "bank" / "DUNK" / "DUNK_0" / "info.json"
+    bank_info.parent.mkdir(parents=True)
+    bank_info.write_text('{"game_id": "0022200001"}')
+    # 2 of the 15KB videos, with their JSONs, tar headers and padding, fill the 40KB of 4 tar records
+    index_paths = pack_dataset_shards(tmp_path, tmp_path / "shards", videos_bank_path=tmp_path / "bank",
+                                      max_shard_bytes=4 * tarfile.RECORDSIZE)
+    index = json.loads(index_paths["train"].read_text())
+    assert index["num_videos"] == 5 and index["label2id"] == {"DUNK": 0, "JUMP_SHOT": 1}
+    assert [shard["count"] for shard in index["shards"]] == [2, 2, 1]
+    assert sorted(p.name for p in (tmp_path / "shards" / "train").iterdir()) == \
+        ["index.json", "shard-00000.tar", "shard-00001.tar", "shard-00002.tar"]
+    for shard in index["shards"]:
+        shard_bytes = (tmp_path / "shards" / "train" / shard["file"]).stat().st_size
+        assert shard["bytes"] == shard_bytes <= 4 * tarfile.RECORDSIZE
+    pack_dataset_shards(tmp_path, tmp_path / "small_shards", max_shard_bytes=4 * tarfile.RECORDSIZE - 1)
+    assert len(list((tmp_path / "small_shards" / "train").glob("shard-*.tar"))) > 3
+
+    dataset = ShardedClipDataset(tmp_path / "shards" / "train", num_frames=4, sample_rate=4, shuffle=False)
+    samples = {sample["video_name"]: sample for sample in dataset}
+    assert len(samples) == dataset.num_videos == 5
+    sample = samples["JUMP_SHOT_1.avi"]
+    assert sample["video"].shape == (3, 4, 24, 32) and sample["video"].dtype == torch.uint8
+    assert sample["label"] == 1
+    # the middle clip of the 10 stored frames: video frames 12, 16, 20, 24
+    assert np.allclose(sample["video"][0, :, 0, 0].numpy(), [24, 32, 40, 48], atol=3)
+    metadata = {}
+    for shard_path in sorted((tmp_path / "shards" / "train").glob("shard-*.tar")):
+        with tarfile.open(shard_path) as tar:
+            names = tar.getnames()
+            assert [name.rsplit(".", 1)[1] for name in names] == ["json", "avi"] * (len(names) // 2)
+            metadata.update({name: json.load(tar.extractfile(name)) for name in names[::2]})
+    assert metadata["DUNK_1.json"]["label"] == "DUNK" and metadata["DUNK_1.json"]["frames"] == 12
+    assert metadata["DUNK_0.json"]["info"] == {"game_id": "0022200001"} and metadata["DUNK_1.json"]["info"] is None
+
+
+def test_sharded_clip_dataset_reads_every_video_once_per_rank_and_worker(small_split, tmp_path):
+    pack_dataset_shards(tmp_path, tmp_path / "shards", max_shard_bytes=1)
+    split = tmp_path / "shards" / "train"
+    video_names = []
+    for rank in range(2):
+        dataset = ShardedClipDataset(split, num_frames=4, sample_rate=2, shuffle_buffer=2, rank=rank, world_size=2,
+                                     clips_per_video=2, transform=_scale_clips)
+        dataset.set_epoch(1)
+        loader = torch.utils.data.DataLoader(dataset, batch_size=None, num_workers=2)
+        rank_video_names = []
+        for sample in loader:
+            assert len(sample["video"]) == 2 and sample["video"][0].dtype == torch.float32
+            rank_video_names.append(sample["video_name"])
+        # Both ranks take 3 steps, or DDP hangs: the rank of 2 shards repeats a video
+        assert len(rank_video_names) == len(dataset) == 3
+        video_names += rank_video_names
+    assert sorted(set(video_names)) == ["DUNK_0.avi", "DUNK_1.avi", "JUMP_SHOT_0.avi", "JUMP_SHOT_1.avi",
+                                        "JUMP_SHOT_2.avi"]
+
+    first_epoch = [s["video_name"] for s in ShardedClipDataset(split, num_frames=4, shuffle_buffer=2)]
+    assert first_epoch == [s["video_name"] for s in ShardedClipDataset(split, num_frames=4, shuffle_buffer=2)]
+    with pytest.raises(ValueError):
+        ShardedClipDataset(split, world_size=6, rank=0)
+
+
+def test_sharded_clip_dataset_balances_uneven_shards_between_ranks(small_split, tmp_path):
+    # Shards of 2, 2 and 1 videos
+    pack_dataset_shards(tmp_path, tmp_path / "shards", max_shard_bytes=4 * tarfile.RECORDSIZE)
+    split = tmp_path / "shards" / "train"
+    for world_size in (2, 3):
+        for epoch in range(3):
+            rank_video_names = []
+            for rank in range(world_size):
+                dataset = ShardedClipDataset(split, num_frames=4, rank=rank, world_size=world_size, shuffle_buffer=2)
+                dataset.set_epoch(epoch)
+                rank_video_names.append([sample["video_name"] for sample in dataset])
+            assert [len(names) for names in rank_video_names] == [-(-5 // world_size)] * world_size
+            assert len({name for names in rank_video_names for name in names}) == 5
+
+
+class _BrightnessClassifier(torch.nn.Module):
+    """ Scores class 0 by how dark each clip is, and class 1 by how bright """
+
+    def forward(self, pixel_values):
+        brightness = pixel_values.mean(dim=(1, 2, 3, 4))
+        return types.SimpleNamespace(logits=torch.stack([-brightness, brightness], dim=1))
+
+
+def test_evaluate_multi_clip_matches_per_clip_evaluation(small_split):
+    preprocessor = ClipPreprocessor(num_frames=4, sample_rate=2, short_side_size=24, crop_size=(16, 16))
+    dataset = MultiClipEvaluationDataset(small_split, preprocessor, clips_per_video=3)
+    results = evaluate_multi_clip(_BrightnessClassifier(), dataset, batch_size=2)
+    assert results["labels"].tolist() == [0, 0, 1, 1, 1]
+    assert results["logits"].shape == (5, 2)
+
+    # The same clips, cut one by one from separately decoded frames, then aggregated like the notebook's
+    # compute_metrics (labels repeated per clip, logits summed with np.array_split)
+    clip_logits, clip_labels = [], []
+    for video_path, label in dataset.videos:
+        frame_count = int(cv2.VideoCapture(str(video_path)).get(cv2.CAP_PROP_FRAME_COUNT))
+        number_of_stored_frames = max(-(-frame_count // 2), 4)
+        for start in dataset.clip_starts(number_of_stored_frames):
+            frames = decode_video_frames(str(video_path), 2, 4, start_frame=2 * start)
+            pixel_values = torch.from_numpy(preprocessor.transform_frames(frames))[None]
+            clip_logits.append(_BrightnessClassifier()(pixel_values).logits[0].numpy())
+            clip_labels.append(dataset.label2id[label])
+    n = len(clip_labels) // 3
+    predictions = [np.argmax(np.sum(batch, axis=0), axis=0) for batch in np.array_split(np.array(clip_logits), n)]
+    labels = [batch[0] for batch in np.array_split(np.array(clip_labels), n)]
+    assert results["predictions"].tolist() == predictions
+    assert results["labels"].tolist() == labels
+    assert np.allclose(results["logits"], [np.sum(batch, axis=0) for batch in np.array_split(np.array(clip_logits), n)],
+                       atol=1e-4)
+
+
+def test_sliding_windows_share_frames_and_pad_short_videos(tmp_path):
+    _write_numbered_video(tmp_path / "game.avi", 60)
+    preprocessor = ClipPreprocessor(num_frames=4, sample_rate=4, short_side_size=24, crop_size=(16, 16), mean=(0, 0, 0),
+                                    std=(1, 1, 1))
+    windows = list(_yield_sliding_windows(str(tmp_path / "game.avi"), preprocessor, window_stride=8))
+    # 15 stored frames (0, 4, ..., 56), a window every 2 of them
+    assert [start for start, _ in windows] == [0, 8, 16, 24, 32, 40]
+    assert windows[1][1].shape == (4, 3, 16, 16)
+    assert np.allclose(windows[1][1][:, 0, 8, 8] * 255, [16, 24, 32, 40], atol=3)
+
+    _write_numbered_video(tmp_path / "short.avi", 6)
+    (start, window), = _yield_sliding_windows(str(tmp_path / "short.avi"), preprocessor, window_stride=8)
+    assert start == 0 and np.allclose(window[:, 0, 8, 8] * 255, [0, 8, 8, 8], atol=3)
+
+
+class _BrightShotClassifier(torch.nn.Module):
+    """ Sees a DUNK in bright clips, and nothing in dark ones """
+    config = types.SimpleNamespace(id2label={0: "BACKGROUND", 1: "DUNK", 2: "LAYUP"})
+
+    def forward(self, pixel_values):
+        brightness = pixel_values.mean(dim=(1, 2, 3, 4))
+        return types.SimpleNamespace(logits=torch.stack([20 * (0.5 - brightness), 20 * (brightness - 0.5),
+                                                         torch.zeros_like(brightness)], dim=1))
+
+
+def test_detect_shots_in_video_merges_overlapping_windows(tmp_path):
+    writer = cv2.VideoWriter(str(tmp_path / "game.avi"), cv2.VideoWriter_fourcc(*"MJPG"), 30, (32, 24))
+    for i in range(300):
+        writer.write(np.full((24, 32, 3), 250 if 120 <= i < 150 else 0, dtype=np.uint8))
+    writer.release()
+    # 32 frames windows, every 8 frames, so the shot is in a few overlapping windows
+    preprocessor = ClipPreprocessor(num_frames=8, sample_rate=4, short_side_size=24, crop_size=(16, 16), mean=(0, 0, 0),
+                                    std=(1, 1, 1))
+    detections, stats = detect_shots_in_video(_BrightShotClassifier(), preprocessor, str(tmp_path / "game.avi"),
+                                              stride_seconds=0.25, batch_size=4, background_labels=("BACKGROUND",))
+    assert stats["windows"] == 34 and stats["video_seconds"] == 10
+    assert stats["real_time_factor"] == stats["seconds"] / 10
+    assert detections["label"].tolist() == ["DUNK"]
+    assert detections.loc[0, "start_seconds"] == 4 and detections.loc[0, "end_seconds"] == pytest.approx(5.07, abs=0.01)
+    assert detections.loc[0, "score"] > 0.9
+
+
+def _tiny_videomae():
+    transformers = pytest.importorskip("transformers")
+    config = transformers.VideoMAEConfig(image_size=32, patch_size=16, num_frames=4, tubelet_size=2, hidden_size=32,
+                                         num_hidden_layers=2, num_attention_heads=2, intermediate_size=37,
+                                         num_labels=2, id2label={0: "DUNK", 1: "JUMP_SHOT"},
+                                         label2id={"DUNK": 0, "JUMP_SHOT": 1})
+    torch.manual_seed(0)
+    return transformers.VideoMAEForVideoClassification(config).eval()
+
+
+def test_clip_feature_store_trains_heads_and_finds_suspect_videos(tmp_path):
+    split = tmp_path / "train"
+    rng = np.random.default_rng(0)
+    colors = {"DUNK": (0, 0, 200), "JUMP_SHOT": (200, 0, 0), "LAYUP": (0, 200, 0)}
+    for label, color in colors.items():
+        split.joinpath(label).mkdir(parents=True)
+        for i in range(4):
+            frame = np.clip(np.array(color) + rng.integers(-30, 30, (24, 32, 3)), 0, 255).astype(np.uint8)
+            writer = cv2.VideoWriter(str(split / label / f"{label}_{i}.avi"), cv2.VideoWriter_fourcc(*"MJPG"), 30,
+                                     (32, 24))
+            for _ in range(12):
+                writer.write(frame)
+            writer.release()
+    # A dunk filed as a jump shot, and a copy of a layup
+    (split / "DUNK" / "DUNK_0.avi").rename(split / "JUMP_SHOT" / "JUMP_SHOT_dunk.avi")
+    (split / "LAYUP" / "LAYUP_copy.avi").write_bytes((split / "LAYUP" / "LAYUP_0.avi").read_bytes())
+
+    model = _tiny_videomae()
+    preprocessor = ClipPreprocessor(num_frames=4, sample_rate=2, short_side_size=36, crop_size=(32, 32))
+    extract_clip_features(model, preprocessor, split, tmp_path / "features", clips_per_video=2,
+                          views=("center", "flipped"))
+    store = ClipFeatureStore(tmp_path / "features")
+    assert store.features.shape == (13, 4, 32)
+    assert store.labels.count("JUMP_SHOT") == 5 and store.label2id == {"DUNK": 0, "JUMP_SHOT": 1, "LAYUP": 2}
+    # The embeddings are what the classifier sees: the center views give back the model's logits
+    evaluation = evaluate_multi_clip(model, MultiClipEvaluationDataset(split, preprocessor, clips_per_video=2))
+    with torch.inference_mode():
+        logits = model.classifier(torch.from_numpy(np.asarray(store.features[:, 0::2]))).sum(dim=1).numpy()
+    assert np.allclose(logits, evaluation["logits"], atol=1e-4)
+
+    head, results = train_feature_head(store, epochs=100)
+    assert head.id2label == {0: "DUNK", 1: "JUMP_SHOT", 2: "LAYUP"}
+    assert results["accuracy"] >= 12 / 13
+    _, results = train_feature_head(store, label_groups={"RIM": ["DUNK", "LAYUP"], "JUMP": ["JUMP_SHOT"]},
+                                    hidden_size=16, epochs=100)
+    assert results["labels"].tolist().count(0) == 8 and results["accuracy"] >= 12 / 13
+    _, results = train_feature_head(store, label_groups={"RIM": ["DUNK", "LAYUP"], "DUNK": ["DUNK"]},
+                                    multilabel=True, epochs=100)
+    assert results["predictions"].shape == (13, 2)
+    with pytest.raises(ValueError):
+        store.label_targets({"RIM": ["DUNK", "LAYUP"], "DUNK": ["DUNK"]})
+
+    duplicates = find_near_duplicate_videos(store, min_similarity=0.9999)
+    assert {duplicates.loc[0, "video_name"], duplicates.loc[0, "other_video_name"]} == {"LAYUP_0.avi",
+                                                                                        "LAYUP_copy.avi"}
+    suspects = find_mislabelled_videos(store, k=3)
+    assert suspects.loc[0, ["video_name", "neighbours_label"]].tolist() == ["JUMP_SHOT_dunk.avi", "DUNK"]
+
+
+def test_onnx_export_matches_the_eager_model(small_split, tmp_path):
+    pytest.importorskip("onnxruntime")
+    model = _tiny_videomae()
+    preprocessor = ClipPreprocessor(num_frames=4, sample_rate=2, short_side_size=36, crop_size=(32, 32))
+    export_video_classifier(model, preprocessor, tmp_path / "engine")
+    assert sorted(path.name for path in (tmp_path / "engine").iterdir()) == ["engine.json", "model.int8.onnx",
+                                                                             "model.onnx"]
+
+    onnx_model, onnx_preprocessor = load_onnx_video_classifier(tmp_path / "engine", quantized=False,
+                                                               intra_op_num_threads=1)
+    int8_model, _ = load_onnx_video_classifier(tmp_path / "engine")
+    assert onnx_preprocessor == preprocessor
+    assert onnx_model.config.id2label == {0: "DUNK", 1: "JUMP_SHOT"}
+
+    dataset = MultiClipEvaluationDataset(small_split, preprocessor, clips_per_video=2)
+    comparison = compare_video_classifiers({"eager": model, "onnx": onnx_model, "onnx int8": int8_model}, dataset)
+    assert comparison.loc["onnx", "max_logit_difference"] < 1e-4
+    assert comparison.loc["onnx", "agreement"] == 1
+    assert comparison.loc["onnx", "classification_report"] == comparison.loc["eager", "classification_report"]
+    assert comparison.loc["onnx int8", "max_logit_difference"] < 0.5
+
+    pixel_values = np.zeros((2, 4, 3, 32, 32), dtype=np.float32)
+    assert set(tune_intra_op_num_threads(tmp_path / "engine" / "model.onnx", pixel_values, [1, 2], repeats=1)) == {1, 2}
+
+
+def test_xclip_video_classifier_exports(tmp_path):
+    transformers = pytest.importorskip("transformers")
+    pytest.importorskip("onnxruntime")
+    text_config = dict(vocab_size=100, hidden_size=32, intermediate_size=37, num_hidden_layers=1,
+                       num_attention_heads=2, max_position_embeddings=16)
+    vision_config = dict(image_size=32, patch_size=16, num_frames=4, hidden_size=32, intermediate_size=37,
+                         num_hidden_layers=1, num_attention_heads=2, mit_hidden_size=32, mit_intermediate_size=37,
+                         mit_num_hidden_layers=1, mit_num_attention_heads=2)
+    config = transformers.XCLIPConfig(text_config=text_config, vision_config=vision_config, projection_dim=32,
+                                      prompt_layers=1, prompt_num_attention_heads=2)
+    torch.manual_seed(0)
+
+    def tokenizer(class_names, **kwargs):
+        input_ids = torch.tensor([[1 + len(name), 2 + ord(name[0]) % 90] + [0] * 14 for name in class_names])
+        return types.SimpleNamespace(input_ids=input_ids, attention_mask=(input_ids > 0).long())
+
+    model = XCLIPVideoClassifier(transformers.XCLIPModel(config).eval(), tokenizer,
+                                 id2label={0: "DUNK", 1: "LAYUP", 2: "JUMP_SHOT"}).eval()
+    preprocessor = ClipPreprocessor(num_frames=4, crop_size=(32, 32))
+    export_video_classifier(model, preprocessor, tmp_path / "engine", quantize=False)
+    onnx_model, _ = load_onnx_video_classifier(tmp_path / "engine")
+
+    pixel_values = torch.randn(3, 4, 3, 32, 32)
+    with torch.inference_mode():
+        expected_logits = model(pixel_values=pixel_values).logits
+    assert expected_logits.shape == (3, 3)
+    assert torch.allclose(onnx_model(pixel_values=pixel_values).logits, expected_logits, atol=1e-4)
@@ -1,6 +1,41 @@
+import asyncio
+import collections
+import concurrent.futures
+import errno
+import http.server
+import json
+import pathlib
+import pickle
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+import pandas as pd
+import pytesseract
 import pytest
+from nba_api.stats.endpoints import playbyplayv2
 
-from utils import add_seconds_to_time
+import utils
+import utils.api
+import utils.dataset
+import utils.video
+from benchmarks.bench_shots_event_data import get_shots_event_data_from_game_df_rowwise
+from benchmarks.synthetic import make_synthetic_pbp_data, write_synthetic_broadcast_clip
+from utils import add_seconds_to_time, cut_video, parse_game_clock, CutVideoStats, TemplateClockReader, \
+    evaluate_clock_readers, benchmark_cut_video_search_modes, ClockReader, VideosBankHarvester, \
+    TokenBucketRateLimiter, ResponseCache, get_pbp_data, ShotEventIndex, get_shots_event_data_from_game_df, \
+    get_shots_event_data_from_games_df, organize_dataset_from_videos_folder, make_split_manifest, create_tiny_dataset, \
+    HTTPRangeReader, cut_video_from_url, change_video_resolution_and_fps, get_video_backend, HarvestMetrics, \
+    load_metrics_records, HarvestStateStore, scan_videos_bank, find_defected_video_folders, ClockOCRCache, \
+    TesseractClockReader, AsyncNBAStatsClient
 
 
 @pytest.mark.parametrize("text_time_input,text_time_after_increase_input", [
@@ -25,3 +60,1166 @@ def test_add_time(text_time_input, text_time_after_increase_input):
 def test_decrease_time(text_time_input, text_time_after_decrease_input):
     result_text_time = add_seconds_to_time(text_time_input, -4)
     assert result_text_time == text_time_after_decrease_input
+
+
+@pytest.mark.parametrize("text,expected_seconds", [
+    ("3:45", 225),
+    ("HOU 98 3:45 14\nLAL 102", 225),
+    ("56.", 56),
+    ("56.3 4.2", 56.3),
+    ("102 98 24", None),
+    ("", None),
+])
+def test_parse_game_clock(text, expected_seconds):
+    assert parse_game_clock(text) == expected_seconds
+
+
+def _write_clock_video(path, clock_readings, fps=10, resolution=(64, 48)):
+    """ Writes a video whose bottom quarter brightness encodes the clock reading of each second (None = no clock) """
+    width, height = resolution
+    out = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'MJPG'), fps, resolution, isColor=True)
+    for clock in clock_readings:
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        frame[height - height // 4:] = 255 if clock is None else clock * 4
+        for _ in range(fps):
+            out.write(frame)
+    out.release()
+
+
+def _fake_read_clock_text(frame):
+    height = frame.shape[0]
+    value = frame[height - height // 4:].mean()
+    if value > 250:
+        return ""
+    return f"{round(value / 4)}.0"
+
+
+@pytest.fixture
+def fake_ocr(monkeypatch):
+    monkeypatch.setattr(utils.video, '_read_clock_text', _fake_read_clock_text)
+
+
+@pytest.mark.parametrize("clock_readings", [
+    # Clock running the whole time
+    list(range(50, 10, -1)),
+    # Clock stopped for a while, then an unreadable stretch (replay) before it runs again
+    [50] * 10 + list(range(50, 40, -1)) + [None] * 5 + list(range(40, 20, -1)),
+])
+def test_gallop_search_finds_the_same_shot_frame_with_fewer_ocr_calls(tmp_path, fake_ocr, clock_readings):
+    video_path = tmp_path / "video.avi"
+    _write_clock_video(video_path, clock_readings)
+    shot_time = add_seconds_to_time("0:25")
+
+    results = {}
+    for search_mode in ['linear', 'gallop']:
+        stats = CutVideoStats()
+        is_recording_successful = cut_video(
+            video_path=video_path.as_posix(), shot_time=shot_time, offset_seconds_before=4, offset_seconds_after=1,
+            output_path=(tmp_path / f"{search_mode}.avi").as_posix(), search_mode=search_mode, stats=stats
+        )
+        assert is_recording_successful
+        results[search_mode] = stats
+
+    assert results['gallop'].shot_frame == results['linear'].shot_frame == clock_readings.index(25) * 10
+    assert results['gallop'].ocr_calls < results['linear'].ocr_calls / 2
+
+
+def test_cut_video_reads_the_clock_of_a_synthetic_broadcast_clip(tmp_path):
+    video_path = tmp_path / "broadcast.avi"
+    clock_box = write_synthetic_broadcast_clip(video_path, seconds=12, fps=10, resolution=(640, 360), start_clock=65,
+                                               clock_stopped_seconds=2)
+    stats = CutVideoStats()
+    assert cut_video(video_path.as_posix(), "1:01", 3, 1, (tmp_path / "cut.avi").as_posix(), search_mode='gallop',
+                     stats=stats, clock_reader=TemplateClockReader.from_font(roi=clock_box,
+                                                                             use_tesseract_fallback=False))
+    # The clock starts running 2 seconds in, and goes below 1:02 on the frame after 3 more seconds
+    assert stats.shot_frame == (2 + 3) * 10 + 1
+
+
+def _render_scoreboard_frame(clock_text, clock_box=(200, 195, 100, 40)):
+    x, y, width, height = clock_box
+    frame = np.full((240, 320, 3), (40, 90, 30), dtype=np.uint8)
+    cv2.rectangle(frame, (x, y), (x + width, y + height), (20, 20, 20), -1)
+    cv2.putText(frame, clock_text, (x + 5, y + 33), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255), 2)
+    return frame
+
+
+def _clock_text(seconds):
+    return f"{seconds // 60}:{seconds % 60:02d}" if seconds >= 60 else f"{seconds}.{seconds % 10}"
+
+
+def test_template_clock_reader_reads_font_rendered_clock():
+    labelled_frames = [(_render_scoreboard_frame(_clock_text(s)), _clock_text(s)) for s in range(0, 720, 7)]
+    clock_reader = TemplateClockReader.from_font(roi=(200, 195, 100, 40), use_tesseract_fallback=False)
+
+    report = evaluate_clock_readers(labelled_frames, {'template': clock_reader})
+
+    assert report.set_index('reader').loc['template', 'accuracy'] == 1
+    assert clock_reader.template_reads == len(labelled_frames)
+
+
+def test_template_clock_reader_learns_digits_from_fallback(monkeypatch):
+    fallback_texts = []
+    monkeypatch.setattr(pytesseract, 'image_to_string',
+                        lambda *args, **kwargs: fallback_texts.pop(0))
+    clock_reader = TemplateClockReader(roi=(200, 195, 100, 40))
+
+    # Every digit shows up in these readings, so after them there is nothing left for tesseract
+    for clock_text in ["10:23", "4:56", "7:58", "9:04"]:
+        fallback_texts.append(clock_text)
+        assert clock_reader.read_text(_render_scoreboard_frame(clock_text)) == clock_text
+    assert clock_reader.known_digits == set('0123456789')
+
+    assert clock_reader.read_text(_render_scoreboard_frame("8:31")) == "8:31"
+    assert clock_reader.fallback_reads == 4
+    assert clock_reader.template_reads == 1
+
+
+def test_clock_ocr_cache_skips_the_ocr_of_scoreboards_it_has_read(tmp_path, monkeypatch):
+    ocr_calls = []
+
+    def counting_ocr(frame):
+        ocr_calls.append(frame)
+        return ["10:23", "10:22"][frame[0, 0, 0]]
+
+    monkeypatch.setattr(utils.video, '_read_clock_text', counting_ocr)
+    rng = np.random.default_rng(0)
+
+    def noisy_frame(clock_text):
+        # Compression noise, so the same scoreboard is nearly, but not exactly, the same image
+        frame = cv2.add(_render_scoreboard_frame(clock_text), rng.integers(0, 6, (240, 320, 3), dtype=np.uint8))
+        frame[0, 0, 0] = ["10:23", "10:22"].index(clock_text)
+        return frame
+
+    cache = ClockOCRCache(max_entries=8, path=tmp_path / "ocr.sqlite")
+    clock_reader = TesseractClockReader(cache=cache)
+    first_frame = noisy_frame("10:23")
+    assert clock_reader.read_text(first_frame) == "10:23"
+    assert [clock_reader.read_text(noisy_frame("10:23")) for _ in range(4)] == ["10:23"] * 4
+    assert clock_reader.read_text(first_frame) == "10:23"
+    assert clock_reader.read_text(noisy_frame("10:22")) == "10:22"
+    assert len(ocr_calls) == 2
+    stats = cache.stats()
+    assert stats["hits"] + stats["near_hits"] == 5 and stats["misses"] == 2 and stats["collisions"] == 0
+    assert stats["hit_rate"] == 5 / 7
+
+    # Another process (or the next harvest) gets the on-disk tier
+    worker_cache = pickle.loads(pickle.dumps(cache))
+    assert worker_cache.stats()["entries"] == 0
+    assert TesseractClockReader(cache=worker_cache).read_text(first_frame) == "10:23"
+    assert worker_cache.disk_hits == 1 and len(ocr_calls) == 2
+    # The next cut the worker runs gets its memory tier
+    assert pickle.loads(pickle.dumps(cache)).stats()["entries"] == 1
+
+    # A worker that never saw this scoreboard finds it on disk, though the noise made it another image
+    other_worker_cache = ClockOCRCache(path=tmp_path / "ocr.sqlite")
+    assert TesseractClockReader(cache=other_worker_cache).read_text(noisy_frame("10:23")) == "10:23"
+    assert other_worker_cache.disk_hits == 1 and len(ocr_calls) == 2
+
+    # An entry with the right key but another fingerprint is a collision, so it isn't used
+    worker_cache._entries = collections.OrderedDict(
+        (key, (kind, phash, b"another fingerprint", text))
+        for key, (kind, phash, _, text) in worker_cache._entries.items())
+    assert TesseractClockReader(cache=worker_cache).read_text(first_frame) == "10:23"
+    assert worker_cache.collisions == 1 and worker_cache.disk_hits == 2 and len(ocr_calls) == 2
+    cache_without_disk = ClockOCRCache()
+    assert TesseractClockReader(cache=cache_without_disk).read_text(first_frame) == "10:23"
+    cache_without_disk._entries = collections.OrderedDict(
+        (key, (kind, phash, b"another fingerprint", text))
+        for key, (kind, phash, _, text) in cache_without_disk._entries.items())
+    assert TesseractClockReader(cache=cache_without_disk).read_text(first_frame) == "10:23"
+    assert cache_without_disk.collisions == 1 and len(ocr_calls) == 4
+
+
+def test_clock_ocr_cache_finds_near_duplicates_by_perceptual_hash(monkeypatch):
+    clock_texts = [_clock_text(seconds) for seconds in range(623, 563, -1)]
+    monkeypatch.setattr(utils.video, '_read_clock_text', lambda frame: clock_texts[frame[0, 0, 0]])
+    rng = np.random.default_rng(0)
+
+    def noisy_frame(clock_text):
+        frame = cv2.add(_render_scoreboard_frame(clock_text), rng.integers(0, 6, (240, 320, 3), dtype=np.uint8))
+        frame[0, 0, 0] = clock_texts.index(clock_text)
+        return frame
+
+    cache = ClockOCRCache()
+    clock_reader = TesseractClockReader(cache=cache)
+    assert [clock_reader.read_text(noisy_frame(clock_text)) for clock_text in clock_texts] == clock_texts
+    assert cache.misses == len(clock_texts)
+    # Long after it was last used, the first scoreboard is still found by its hash
+    assert clock_reader.read_text(noisy_frame(clock_texts[0])) == clock_texts[0]
+    assert cache.near_hits == 1 and cache.misses == len(clock_texts)
+
+    crop = noisy_frame(clock_texts[0])[180:]
+    noisy_crop = cv2.add(crop, rng.integers(0, 6, crop.shape, dtype=np.uint8))
+    assert bin(cache.perceptual_hash(crop) ^ cache.perceptual_hash(noisy_crop)).count('1') <= 1
+    assert bin(cache.perceptual_hash(crop) ^ cache.perceptual_hash(noisy_frame("9:59")[180:])).count('1') > 8
+    with pytest.raises(ValueError):
+        ClockOCRCache(max_hash_distance=16)
+
+
+def test_stream_mode_cuts_like_linear_without_seeking(tmp_path, fake_ocr):
+    video_path = tmp_path / "video.avi"
+    _write_clock_video(video_path, list(range(40, 10, -1)))
+
+    rows = {row['search_mode']: row for row in benchmark_cut_video_search_modes(
+        video_path.as_posix(), "25.", new_resolution=(32, 24), new_fps=5, search_modes=('linear', 'stream'))}
+
+    assert rows['stream']['success'] and rows['linear']['success']
+    assert rows['stream']['shot_frame'] == rows['linear']['shot_frame'] == 150
+    assert rows['stream']['seeks'] == 0
+    assert rows['stream']['ocr_calls'] == rows['linear']['ocr_calls']
+    # Forward only decoding stops right after the cut (shot frame + 1 second)
+    assert rows['stream']['frames_decoded'] == 150 + 10
+
+
+def test_stream_mode_respects_buffer_limit(tmp_path, fake_ocr):
+    video_path = tmp_path / "video.avi"
+    _write_clock_video(video_path, list(range(40, 10, -1)))
+
+    with pytest.raises(ValueError):
+        cut_video(video_path.as_posix(), "25.", 4, 1, (tmp_path / "cut.avi").as_posix(), search_mode='stream',
+                  max_buffer_bytes=64 * 48 * 3 * 10)
+
+
+class _FakeClockReader(ClockReader):
+    def read_text(self, frame) -> str:
+        return _fake_read_clock_text(frame)
+
+
+def _fake_pbp_data(game_id):
+    rows = []
+    # Per game: 3 dunks, one of them at a time that doesn't show in its video, and 3 jump shots
+    for event_num, (action_type, description, time_string) in enumerate([
+        (7, "Player Dunk (2 PTS)", "0:05"),
+        (7, "Player Dunk (2 PTS)", "0:25"),
+        (7, "Player Dunk (2 PTS)", "0:30"),
+        (1, "Player 18' Jump Shot (2 PTS)", "0:25"),
+        (1, "Player 18' Jump Shot (2 PTS)", "0:30"),
+        (1, "Player 18' Jump Shot (2 PTS)", "0:35"),
+    ], start=1):
+        rows.append({'EVENTNUM': event_num, 'EVENTMSGTYPE': 1, 'EVENTMSGACTIONTYPE': action_type, 'PERIOD': 1,
+                     'PCTIMESTRING': time_string, 'HOMEDESCRIPTION': f"{game_id} {description}",
+                     'VISITORDESCRIPTION': None, 'VIDEO_AVAILABLE_FLAG': 1})
+    return pd.DataFrame(rows)
+
+
+def _make_test_harvester(tmp_path, **kwargs):
+    source_video_path = tmp_path / "source.avi"
+    _write_clock_video(source_video_path, list(range(40, 10, -1)))
+
+    def fake_get_video_event_info(game_id, game_event_id):
+        df = _fake_pbp_data(game_id)
+        description = df.loc[df['EVENTNUM'] == int(game_event_id), 'HOMEDESCRIPTION'].item()
+        return {'desc': description, 'video_url': source_video_path.as_posix()}
+
+    def fake_download_video(event_info, info_path, video_path):
+        with open(info_path, "w") as outfile:
+            json.dump(event_info, outfile)
+        shutil.copy(event_info['video_url'], video_path)
+
+    harvester_kwargs = dict(
+        max_number_of_class_videos_from_same_game=1, new_resolution=None, new_fps=None, download_workers=2,
+        cut_workers=2, queue_size=2, cut_video_kwargs={'clock_reader': _FakeClockReader()},
+        get_pbp_data_function=_fake_pbp_data, get_video_event_info_function=fake_get_video_event_info,
+        download_video_function=fake_download_video
+    )
+    harvester_kwargs.update(kwargs)
+    return VideosBankHarvester(tmp_path / "videos", ['DUNK', 'JUMP_SHOT'], **harvester_kwargs)
+
+
+def test_videos_bank_harvester_enforces_limits(tmp_path):
+    harvester = _make_test_harvester(tmp_path, number_of_desired_plays_per_type=3)
+    histogram = harvester.run([f"00{i}" for i in range(10)])
+
+    videos_directory = tmp_path / "videos"
+    assert histogram == {'DUNK': 3, 'JUMP_SHOT': 3}
+    for video_description in ['DUNK', 'JUMP_SHOT']:
+        video_directories = list(videos_directory.joinpath(video_description).iterdir())
+        assert len(video_directories) == 3
+        # No more than one video of a class from the same game
+        assert len({directory.name.split('_')[0] for directory in video_directories}) == 3
+        for directory in video_directories:
+            assert sorted(path.name for path in directory.iterdir()) == ['cut_video.avi', 'info.json']
+    for failed_video_directory, _ in harvester.failed_videos:
+        assert not pathlib.Path(failed_video_directory).exists()
+
+
+class _BrokenCutPool(concurrent.futures.ThreadPoolExecutor):
+    def submit(self, *args, **kwargs):
+        raise BrokenProcessPool("a cut process died")
+
+
+def test_harvester_raises_when_the_cut_pool_breaks(tmp_path, monkeypatch):
+    monkeypatch.setattr(concurrent.futures, 'ProcessPoolExecutor', _BrokenCutPool)
+    # More downloaded videos than the cut queue holds, so the download threads only finish if it's drained
+    harvester = _make_test_harvester(tmp_path, number_of_desired_plays_per_type=5, download_workers=3, queue_size=1,
+                                     max_number_of_class_videos_from_same_game=3)
+    finished = []
+    thread = threading.Thread(target=lambda: finished.append(pytest.raises(
+        BrokenProcessPool, harvester.run, [f"00{i}" for i in range(10)])), daemon=True)
+    thread.start()
+    thread.join(timeout=60)
+    assert finished, "the harvest hung"
+    assert not harvester.state.class_counts()
+
+
+def test_harvest_state_store(tmp_path):
+    state = HarvestStateStore(tmp_path / "state.sqlite")
+    assert state.is_empty()
+    state.add_games(["002", "001"])
+    state.add_games(["001", "003"])
+    assert state.pending_games() == ["002", "001", "003"]
+    state.mark_game_done("001")
+    assert state.pending_games(["003", "001", "002"]) == ["002", "003"]
+
+    state.set_event_status("002", 1, "pending", "DUNK", event_info={'video_url': "url"}, shot_time="0:25")
+    state.set_event_status("002", 2, "pending", "DUNK", event_info={}, shot_time="0:30")
+    state.set_event_status("002", 3, "pending", "LAYUP", event_info={}, shot_time="0:35")
+    state.set_event_status("002", 1, "downloaded")
+    state.set_event_status("002", 2, "cut")
+    state.set_event_status("002", 3, "failed", reason="cut failed")
+    with pytest.raises(ValueError):
+        state.set_event_status("002", 4, "cut")
+
+    assert state.event_status("002", 1) == "downloaded" and state.event_status("002", 4) is None
+    assert [(event['event_id'], event['status'], event['event_info'], event['shot_time'])
+            for event in state.unfinished_events()] == [(1, "downloaded", {'video_url': "url"}, "0:25")]
+    assert state.class_counts() == {"DUNK": 1}
+    assert state.game_class_counts() == {("002", "DUNK"): 1}
+    assert state.status_counts().loc["LAYUP", "failed"] == 1
+    assert state.failed_events()["reason"].tolist() == ["cut failed"]
+
+    # A videos bank from before the state store
+    (tmp_path / "bank" / "DUNK" / "005_7").mkdir(parents=True)
+    assert state.import_videos_bank(tmp_path / "bank", ["DUNK", "LAYUP"]) == 1
+    assert state.class_counts() == {"DUNK": 2}
+
+
+def test_harvester_resumes_without_redoing_work(tmp_path):
+    walked_games, downloaded_events = [], []
+
+    def counting_get_pbp_data(game_id):
+        walked_games.append(game_id)
+        return _fake_pbp_data(game_id)
+
+    def counting_download_video(event_info, info_path, video_path):
+        downloaded_events.append((event_info['game_id'], event_info['event_id']))
+        if event_info['game_id'] == "000":
+            raise ConnectionError("the first game's videos are gone")
+        shutil.copy(event_info['video_url'], video_path)
+
+    game_ids = [f"00{i}" for i in range(10)]
+    harvester = _make_test_harvester(tmp_path, number_of_desired_plays_per_type=2, random_state=0,
+                                     get_pbp_data_function=counting_get_pbp_data,
+                                     download_video_function=counting_download_video)
+    assert harvester.run(game_ids) == {'DUNK': 2, 'JUMP_SHOT': 2}
+    failed_events = set(harvester.state.failed_events()[["game_id", "event_id"]].itertuples(index=False, name=None))
+    assert {event for event in failed_events if event[0] == "000"}
+    done_games = set(game_ids) - set(harvester.state.pending_games())
+    assert "009" not in done_games
+
+    # A harvest that crashed after downloading a video of the last game, before cutting it
+    event_info = {'game_id': "009", 'event_id': 2, 'video_url': (tmp_path / "source.avi").as_posix()}
+    harvester.state.set_event_status("009", 2, "downloaded", "DUNK", event_info=event_info,
+                                     shot_time=add_seconds_to_time("0:25"))
+    video_directory = tmp_path / "videos" / "DUNK" / "009_2"
+    video_directory.mkdir()
+    shutil.copy(tmp_path / "source.avi", video_directory / "video.mp4")
+
+    # Like a restart, asking for more videos, with the games in another order
+    walked_games.clear()
+    downloaded_events.clear()
+    harvester = _make_test_harvester(tmp_path, number_of_desired_plays_per_type=4, random_state=0,
+                                     get_pbp_data_function=counting_get_pbp_data,
+                                     download_video_function=counting_download_video)
+    assert harvester.run(game_ids[::-1]) == {'DUNK': 4, 'JUMP_SHOT': 4}
+    assert not set(walked_games) & done_games
+    assert walked_games == sorted(walked_games)
+    assert not set(downloaded_events) & failed_events
+    assert ("009", 2) not in downloaded_events and harvester.state.event_status("009", 2) == "cut"
+    assert harvester.state.status_counts()["cut"].to_dict() == {'DUNK': 4, 'JUMP_SHOT': 4}
+
+
+def test_harvest_metrics_stages_and_counters(tmp_path):
+    metrics = HarvestMetrics(enabled=True, jsonl_path=str(tmp_path / "metrics.jsonl"))
+    with metrics.event("001_1"):
+        with metrics.stage("download") as stage:
+            stage.add("bytes_downloaded", 100)
+            metrics.count("retries")
+            with metrics.stage("cut"):
+                metrics.count("ocr_calls", 3)
+    with pytest.raises(ValueError), metrics.stage("download"):
+        raise ValueError()
+    metrics.count("retries")
+
+    records = load_metrics_records(metrics.jsonl_path)
+    assert [(record['stage'], record['event'], record['error']) for record in records] == [
+        ("cut", "001_1", None), ("download", "001_1", None), ("download", None, "ValueError")]
+    assert metrics.records == []
+    assert records[1]['wall_seconds'] >= records[0]['wall_seconds']
+    assert metrics.unattributed_counters == {"retries": 1}
+
+    summary = metrics.summary()
+    assert summary.loc["download", ["calls", "errors", "bytes_downloaded", "retries", "ocr_calls"]].tolist() == \
+        [2, 1, 100, 1, 0]
+    assert summary.loc["cut", "ocr_calls"] == 3
+    assert metrics.summary(by_event=True).loc[("001_1", "download"), "calls"] == 1
+
+    metrics.write_prometheus(str(tmp_path / "harvest.prom"))
+    lines = (tmp_path / "harvest.prom").read_text().splitlines()
+    assert "# TYPE nba_harvest_ocr_calls_total counter" in lines
+    assert 'nba_harvest_calls_total{stage="download"} 2' in lines
+    assert 'nba_harvest_ocr_calls_total{stage="cut"} 3' in lines
+
+    in_memory_metrics = HarvestMetrics(enabled=True)
+    with in_memory_metrics.stage("download"):
+        pass
+    assert [record['stage'] for record in in_memory_metrics.load_records()] == ["download"]
+
+
+def test_disabled_harvest_metrics_cost_almost_nothing(tmp_path):
+    metrics = HarvestMetrics(jsonl_path=str(tmp_path / "metrics.jsonl"))
+    timed_sum = metrics.timed("sum")(sum)
+    start_time = time.perf_counter()
+    for _ in range(100000):
+        with metrics.event("001_1"), metrics.stage("stage") as stage:
+            stage.add("bytes_downloaded", 1)
+            metrics.count("ocr_calls")
+    assert time.perf_counter() - start_time < 1
+    assert timed_sum([1, 2]) == 3
+    assert metrics.records == [] and not metrics.unattributed_counters
+    assert not (tmp_path / "metrics.jsonl").exists()
+
+
+@pytest.fixture
+def enabled_harvest_metrics(tmp_path):
+    utils.harvest_metrics.enable(str(tmp_path / "metrics.jsonl"))
+    yield utils.harvest_metrics
+    utils.harvest_metrics.disable()
+    utils.harvest_metrics.reset()
+
+
+def test_harvester_records_metrics_of_the_cut_processes(tmp_path, enabled_harvest_metrics):
+    harvester = _make_test_harvester(tmp_path, number_of_desired_plays_per_type=2)
+    harvester.run([f"00{i}" for i in range(10)])
+
+    records = enabled_harvest_metrics.load_records()
+    cut_records = [record for record in records if record['stage'] == 'cut_video']
+    # Written by the cut processes, and with a file, none are kept in memory
+    assert cut_records and enabled_harvest_metrics.records == []
+    assert all(record['event'].startswith("00") for record in cut_records)
+    assert all(record['counters']['ocr_calls'] > 0 for record in cut_records)
+    summary = enabled_harvest_metrics.summary()
+    assert summary.loc['cut_video.clock_scan', 'calls'] == summary.loc['cut_video', 'calls']
+
+
+def _achieved_rate(timestamps, burst):
+    timestamps = sorted(timestamps)
+    # The first `burst` requests may go out at once
+    return (len(timestamps) - burst) / (timestamps[-1] - timestamps[0])
+
+
+def _acquire_and_time(state_path, rate, burst, count):
+    rate_limiter = TokenBucketRateLimiter(rate=rate, burst=burst, state_path=state_path)
+    timestamps = []
+    for _ in range(count):
+        rate_limiter.acquire()
+        timestamps.append(time.time())
+    return timestamps
+
+
+@pytest.mark.parametrize("burst", [1, 5])
+def test_rate_limiter_under_thread_contention(tmp_path, burst):
+    rate = 50
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(_acquire_and_time, (tmp_path / "state").as_posix(), rate, burst, 5)
+                   for _ in range(8)]
+        timestamps = [t for future in futures for t in future.result()]
+
+    assert _achieved_rate(timestamps, burst) <= rate * 1.05
+    assert _achieved_rate(timestamps, burst) >= rate * 0.8
+
+
+def test_rate_limiter_is_shared_between_processes(tmp_path):
+    rate = 40
+    with concurrent.futures.ProcessPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(_acquire_and_time, (tmp_path / "state").as_posix(), rate, 1, 8)
+                   for _ in range(4)]
+        timestamps = [t for future in futures for t in future.result()]
+
+    assert _achieved_rate(timestamps, 1) <= rate * 1.05
+
+
+def test_rate_limiter_with_asyncio_tasks():
+    rate = 50
+    rate_limiter = TokenBucketRateLimiter(rate=rate)
+    timestamps = []
+
+    async def task():
+        for _ in range(5):
+            await rate_limiter.acquire_async()
+            timestamps.append(time.time())
+
+    async def main():
+        await asyncio.gather(*[task() for _ in range(6)])
+
+    asyncio.run(main())
+    assert _achieved_rate(timestamps, 1) <= rate * 1.05
+
+
+def test_rate_limiter_file_lock_does_not_block_the_event_loop(tmp_path):
+    rate_limiter = TokenBucketRateLimiter(rate=1000, state_path=(tmp_path / "state").as_posix())
+    lock_taken = threading.Event()
+
+    def hold_the_lock():
+        # Like another process taking its token
+        with rate_limiter._locked_state():
+            lock_taken.set()
+            time.sleep(0.3)
+
+    async def main():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        await rate_limiter.acquire_async()
+        ticker.cancel()
+        return ticks
+
+    holder = threading.Thread(target=hold_the_lock)
+    holder.start()
+    lock_taken.wait()
+    assert asyncio.run(main()) >= 10
+    holder.join()
+
+
+def test_rate_limiter_state_path_is_configurable(monkeypatch, tmp_path):
+    monkeypatch.delenv('NBA_API_RATE_LIMITER_STATE', raising=False)
+    default_path = utils.api._default_rate_limiter_state_path()
+    assert pathlib.Path(default_path).name.startswith('nba_api_rate_limiter-')
+    monkeypatch.setenv('HOME', str(tmp_path))
+    assert utils.api._default_rate_limiter_state_path() != default_path
+    monkeypatch.setenv('NBA_API_RATE_LIMITER_STATE', str(tmp_path / "shared"))
+    assert utils.api._default_rate_limiter_state_path() == str(tmp_path / "shared")
+
+
+def test_rate_limiter_slows_down_on_failures():
+    rate_limiter = TokenBucketRateLimiter(rate=100, recovery_factor=2)
+    rate_limiter.penalize()
+    rate_limiter.penalize()
+    assert rate_limiter.slowdown == 4
+    rate_limiter.acquire()
+    start_time = time.time()
+    rate_limiter.acquire()
+    # 4 times slower than 100 requests a second
+    assert time.time() - start_time >= 0.035
+    for _ in range(3):
+        rate_limiter.reward()
+    assert rate_limiter.slowdown == 1
+
+
+class _FakePlayByPlayV2:
+    calls = 0
+
+    def __init__(self, game_id, timeout):
+        _FakePlayByPlayV2.calls += 1
+        self.game_id = game_id
+
+    def get_dict(self):
+        df = _fake_pbp_data(self.game_id)
+        return {'resultSets': [{'name': 'PlayByPlay', 'headers': list(df.columns), 'rowSet': df.values.tolist()},
+                               {'name': 'AvailableVideo', 'headers': ['VIDEO_AVAILABLE_FLAG'], 'rowSet': [[1]]}]}
+
+
+@pytest.fixture
+def stub_nba_api(monkeypatch, tmp_path):
+    _FakePlayByPlayV2.calls = 0
+    monkeypatch.setattr(playbyplayv2, 'PlayByPlayV2', _FakePlayByPlayV2)
+    monkeypatch.setattr(utils.api, 'nba_api_rate_limiter', TokenBucketRateLimiter(rate=1000))
+    response_cache = ResponseCache((tmp_path / "cache.sqlite").as_posix())
+    monkeypatch.setattr(utils.api, 'nba_api_response_cache', response_cache)
+    return response_cache
+
+
+def test_cached_pbp_data_skips_the_api(stub_nba_api):
+    first_df = get_pbp_data("0021")
+    second_df = get_pbp_data("0021")
+    get_pbp_data("0022")
+
+    pd.testing.assert_frame_equal(first_df, second_df)
+    pd.testing.assert_frame_equal(first_df, _fake_pbp_data("0021"), check_dtype=False)
+    assert _FakePlayByPlayV2.calls == 2
+    stats = stub_nba_api.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 2, 2)
+
+
+class _MockNBAStatsHandler(http.server.BaseHTTPRequestHandler):
+    """ Answers like stats.nba.com, after failing the first `failures` requests like it does when throttling """
+    protocol_version = "HTTP/1.1"
+    failures = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.requests.append(self.path)
+            cls.connections.add(self.client_address)
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+            fail = len(cls.requests) <= cls.failures
+        time.sleep(0.02)
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+        endpoint = url.path.rsplit('/', 1)[-1]
+        if fail:
+            status, body = 500, b"<html>Access Denied</html>"
+        elif endpoint == 'playbyplayv2':
+            status, body = 200, json.dumps(_FakePlayByPlayV2(params['GameID'], timeout=None).get_dict()).encode()
+        elif endpoint == 'videoeventsasset':
+            status, body = 200, json.dumps({'resultSets': {
+                'Meta': {'videoUrls': [{'lurl': f"https://videos/{params['GameEventID']}.mp4"}]},
+                'playlist': [{'dsc': f"Event {params['GameEventID']}"}]}}).encode()
+        else:
+            status, body = 200, json.dumps({'resultSets': [{'name': 'LeagueGameFinderResults',
+                                                            'headers': ['GAME_ID', 'LEAGUE_ID'],
+                                                            'rowSet': [["0021", params['LeagueID']]]}]}).encode()
+        with cls.lock:
+            cls.in_flight -= 1
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def mock_nba_stats_server(monkeypatch, tmp_path):
+    monkeypatch.setattr(utils.api, 'nba_api_response_cache', ResponseCache((tmp_path / "cache.sqlite").as_posix()))
+    handler = type("Handler", (_MockNBAStatsHandler,), {"requests": [], "connections": set(), "in_flight": 0,
+                                                        "max_in_flight": 0})
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/stats/{{endpoint}}", handler
+    server.shutdown()
+    server.server_close()
+
+
+def test_async_nba_stats_client_reuses_connections_within_the_rate_budget(mock_nba_stats_server):
+    base_url, handler = mock_nba_stats_server
+    handler.failures = 2
+    rate_limiter = TokenBucketRateLimiter(rate=100)
+    game_ids = [f"00{i:03d}" for i in range(20)]
+
+    async def harvest():
+        async with AsyncNBAStatsClient(max_in_flight=4, retry_wait=(0, 0), rate_limiter=rate_limiter,
+                                       base_url=base_url, headers={}) as client:
+            pbp_dfs = await asyncio.gather(*[client.get_pbp_data(game_id) for game_id in game_ids])
+            event_info = await client.get_video_event_info("00000", 7)
+            games_df = await client.league_game_finder(league_id_nullable='00')
+            # Cached
+            await client.get_pbp_data(game_ids[0])
+            return pbp_dfs, event_info, games_df, client.requests_made
+
+    start_time = time.time()
+    pbp_dfs, event_info, games_df, requests_made = asyncio.run(harvest())
+
+    for game_id, pbp_df in zip(game_ids, pbp_dfs):
+        pd.testing.assert_frame_equal(pbp_df, _fake_pbp_data(game_id), check_dtype=False)
+    assert event_info == {'desc': "Event 7", 'video_url': "https://videos/7.mp4"}
+    assert games_df.to_dict('records') == [{'GAME_ID': "0021", 'LEAGUE_ID': "00"}]
+    # The 2 failures were retried, and the rest went over no more than the 4 kept-alive connections
+    assert requests_made == len(handler.requests) == 22 + 2
+    assert len(handler.connections) <= 4 and 1 < handler.max_in_flight <= 4
+    assert time.time() - start_time >= 23 / 100
+    assert "/stats/playbyplayv2?EndPeriod=0&GameID=00000&StartPeriod=0" in handler.requests
+    assert get_pbp_data(game_ids[1]).equals(pbp_dfs[1])
+
+
+def test_empty_and_error_responses_are_not_cached(stub_nba_api):
+    responses = [{'message': "An error occurred"},
+                 {'resultSets': [{'name': 'PlayByPlay', 'headers': [], 'rowSet': []}]},
+                 _FakePlayByPlayV2("0021", timeout=None).get_dict()]
+    calls = []
+
+    def call_api(game_id):
+        calls.append(game_id)
+        return responses[len(calls) - 1]
+
+    for _ in range(4):
+        response = utils.api._cached_nba_api_call('playbyplayv2', {'game_id': "0021"}, call_api)
+    assert len(calls) == 3 and response == responses[2]
+
+    # Entries cached before they were rejected count as missing
+    stub_nba_api.set('videoeventsasset', {'game_id': "0021", 'game_event_id': "7"},
+                     {'resultSets': {'Meta': {'videoUrls': []}, 'playlist': []}})
+    assert stub_nba_api.get('videoeventsasset', {'game_id': "0021", 'game_event_id': "7"},
+                            utils.api._has_nba_api_data) is None
+
+
+def test_response_cache_counts_lookups_from_many_threads(tmp_path):
+    response_cache = ResponseCache((tmp_path / "cache.sqlite").as_posix())
+    response_cache.set('endpoint', {'id': 1}, {'value': 1})
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda i: response_cache.get('endpoint', {'id': i % 2}), range(400)))
+    assert (response_cache.hits, response_cache.misses) == (200, 200)
+    # A hit of an entry used lately doesn't write
+    total_changes = response_cache._connection.total_changes
+    assert response_cache.get('endpoint', {'id': 1}) == {'value': 1}
+    assert response_cache._connection.total_changes == total_changes
+    assert pickle.loads(pickle.dumps(response_cache)).get('endpoint', {'id': 1}) == {'value': 1}
+
+
+def test_response_cache_ttl_and_size_eviction(tmp_path):
+    response_cache = ResponseCache((tmp_path / "cache.sqlite").as_posix(), ttl_seconds=0.2)
+    response_cache.set('endpoint', {'id': 1}, {'value': 1})
+    assert response_cache.get('endpoint', {'id': 1}) == {'value': 1}
+    time.sleep(0.3)
+    assert response_cache.get('endpoint', {'id': 1}) is None
+
+    payload = {'value': list(range(100))}
+    entry_size = len(zlib.compress(json.dumps(payload).encode(), 6))
+    response_cache = ResponseCache((tmp_path / "sized.sqlite").as_posix(), max_size_bytes=3 * entry_size,
+                                   access_time_resolution_seconds=0)
+    for i in range(3):
+        response_cache.set('endpoint', {'id': i}, payload)
+    # Touching the first entry makes the second one the least recently used
+    response_cache.get('endpoint', {'id': 0})
+    response_cache.set('endpoint', {'id': 3}, payload)
+    assert response_cache.get('endpoint', {'id': 1}) is None
+    assert all(response_cache.get('endpoint', {'id': i}) == payload for i in [0, 2, 3])
+    assert response_cache.stats()['evictions'] == 1
+
+
+def test_response_cache_concurrent_readers_and_writers(tmp_path):
+    path = (tmp_path / "cache.sqlite").as_posix()
+
+    def work(worker):
+        response_cache = ResponseCache(path)
+        for i in range(30):
+            response_cache.set('endpoint', {'id': i % 10}, {'worker': worker, 'i': i})
+            assert response_cache.get('endpoint', {'id': i % 10}) is not None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(work, range(8)))
+    assert ResponseCache(path).stats()['entries'] == 10
+
+
+def test_shot_event_index(tmp_path):
+    shot_event_index = ShotEventIndex(tmp_path / "index")
+    game_ids = ["0021900001", "0021900002", "0022000001"]
+    assert shot_event_index.add_games(game_ids[:2], get_pbp_data_function=_fake_pbp_data) == 2
+
+    # Reopening picks up the manifest, so only the new game is fetched
+    shot_event_index = ShotEventIndex(tmp_path / "index")
+    assert shot_event_index.add_games(game_ids, get_pbp_data_function=_fake_pbp_data) == 1
+
+    assert shot_event_index.shot_type_histogram() == {1: 9, 7: 9}
+    assert set(shot_event_index.load(seasons=["2020"])['GAME_ID']) == {"0022000001"}
+
+    events = shot_event_index.sample_events('DUNK', number_of_events=5, max_events_per_game=1, random_state=0)
+    assert len(events) == 3
+    assert events['GAME_ID'].is_unique
+    assert (events['SHOT_TYPE'] == 'DUNK').all()
+    events = shot_event_index.sample_events('JUMP_SHOT', number_of_events=5, max_events_per_game=2, random_state=0)
+    assert len(events) == 5
+    assert events['GAME_ID'].value_counts().max() == 2
+
+
+def test_vectorised_shots_event_data_matches_rowwise():
+    df = make_synthetic_pbp_data(number_of_games=5, seed=1)
+    original_df = df.copy()
+
+    per_game = []
+    for game_id, game_df in df.groupby('GAME_ID', sort=False):
+        game_df = game_df.drop(columns='GAME_ID').reset_index(drop=True)
+        expected = get_shots_event_data_from_game_df_rowwise(game_df.copy())
+        actual = get_shots_event_data_from_game_df(game_df)
+        pd.testing.assert_frame_equal(actual, expected)
+        per_game.append(expected.assign(GAME_ID=game_id))
+
+    # All the games at once give the same events
+    all_games = get_shots_event_data_from_games_df(df)
+    expected = pd.concat(per_game, ignore_index=True)
+    pd.testing.assert_frame_equal(all_games.reset_index(drop=True), expected[all_games.columns])
+    # The input is left as it was
+    pd.testing.assert_frame_equal(df, original_df)
+
+
+def test_vectorised_shots_event_data_does_not_cross_games():
+    # A rebound squeezed between shots of different games is not a rebound between shots
+    df = pd.DataFrame({
+        'GAME_ID': ['1', '1', '2', '2'], 'EVENTNUM': [1, 2, 1, 2], 'EVENTMSGTYPE': [2, 4, 1, 4],
+        'EVENTMSGACTIONTYPE': [1, 0, 1, 0], 'PERIOD': [1, 1, 1, 1], 'PCTIMESTRING': ['0:03', '0:02', '11:59', '11:58'],
+        'HOMEDESCRIPTION': ['Shot', 'Rebound', 'Shot', 'Rebound'], 'VISITORDESCRIPTION': [None] * 4,
+        'VIDEO_AVAILABLE_FLAG': [1, 1, 1, 1],
+    })
+    assert list(get_shots_event_data_from_games_df(df)['GAME_ID']) == ['1', '2']
+
+
+def test_shots_event_data_raises_on_a_missing_clock():
+    df = make_synthetic_pbp_data(number_of_games=1, seed=2).drop(columns='GAME_ID')
+    df.loc[5, 'PCTIMESTRING'] = None
+    with pytest.raises(ValueError, match="row 5"):
+        get_shots_event_data_from_game_df(df)
+
+
+def _make_videos_bank(root, videos_per_type):
+    for video_type, number_of_videos in videos_per_type.items():
+        for i in range(number_of_videos):
+            video_folder = root / video_type / f"{video_type}_{i:03d}"
+            video_folder.mkdir(parents=True, exist_ok=True)
+            video_folder.joinpath("cut_video.avi").write_bytes(f"{video_type} {i}".encode())
+
+
+def test_split_manifest_is_stratified_and_reproducible(tmp_path):
+    _make_videos_bank(tmp_path / "bank", {"DUNK": 23, "LAYUP": 40})
+    manifest = make_split_manifest(tmp_path / "bank", ["DUNK", "LAYUP"], number_of_videos_per_category=20,
+                                   random_state=3)
+    counts = manifest.groupby(["video_type", "split"]).size().to_dict()
+    assert counts == {(video_type, split): count for video_type in ("DUNK", "LAYUP")
+                      for split, count in (("test", 2), ("train", 16), ("val", 2))}
+    assert manifest.equals(make_split_manifest(tmp_path / "bank", ["DUNK", "LAYUP"], 20, random_state=3))
+    assert not manifest.equals(make_split_manifest(tmp_path / "bank", ["DUNK", "LAYUP"], 20, random_state=4))
+
+
+def test_organize_dataset_links_and_is_incremental(tmp_path):
+    _make_videos_bank(tmp_path / "bank", {"DUNK": 10})
+    manifest = organize_dataset_from_videos_folder(tmp_path / "bank", tmp_path / "dataset", ["DUNK"])
+    first_video = manifest.iloc[0]
+    dataset_video = tmp_path / "dataset" / first_video["split"] / "DUNK" / f"{first_video['name']}.avi"
+    assert dataset_video.samefile(tmp_path / "bank" / first_video["source"])
+
+    _make_videos_bank(tmp_path / "bank", {"DUNK": 20})
+    new_manifest = organize_dataset_from_videos_folder(tmp_path / "bank", tmp_path / "dataset", ["DUNK"])
+    assert new_manifest.head(10).equals(manifest.astype(str))
+    assert new_manifest["split"].value_counts().to_dict() == {"train": 16, "val": 2, "test": 2}
+    assert len(list((tmp_path / "dataset").glob("*/DUNK/*.avi"))) == 20
+
+
+def test_organize_dataset_copies_across_filesystems(tmp_path, monkeypatch):
+    def cross_device_link(source, destination):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr(utils.dataset.os, "link", cross_device_link)
+    _make_videos_bank(tmp_path / "bank", {"DUNK": 10})
+    organize_dataset_from_videos_folder(tmp_path / "bank", tmp_path / "dataset", ["DUNK"])
+    dataset_videos = list((tmp_path / "dataset").glob("*/DUNK/*.avi"))
+    assert len(dataset_videos) == 10
+    assert not any(video.samefile(tmp_path / "bank" / "DUNK" / video.stem / "cut_video.avi")
+                   for video in dataset_videos)
+
+
+def test_create_tiny_dataset_is_a_manifest_subset(tmp_path):
+    _make_videos_bank(tmp_path / "bank", {"DUNK": 20, "LAYUP": 20})
+    organize_dataset_from_videos_folder(tmp_path / "bank", tmp_path / "dataset", ["DUNK", "LAYUP"])
+    tiny_manifest = create_tiny_dataset(tmp_path / "dataset", train_video_num=3, test_video_num=1)
+    assert tiny_manifest.groupby("split").size().to_dict() == {"test": 2, "train": 6, "val": 2}
+    for row in tiny_manifest.itertuples():
+        assert (tmp_path / "dataset_tiny" / row.source).samefile(tmp_path / "dataset" / row.source)
+
+
+def _write_bank_video(bank, video_type, name, seconds=4, fps=30, resolution=(320, 256)):
+    video_path = bank / video_type / name / "cut_video.avi"
+    video_path.parent.mkdir(parents=True, exist_ok=True)
+    out = cv2.VideoWriter(str(video_path), cv2.VideoWriter_fourcc(*'XVID'), fps, resolution)
+    for i in range(int(seconds * fps)):
+        out.write(np.full((resolution[1], resolution[0], 3), i * 2, dtype=np.uint8))
+    out.release()
+    return video_path
+
+
+def test_scan_videos_bank_finds_broken_videos_and_probes_only_changed_ones(tmp_path, monkeypatch):
+    bank = tmp_path / "bank"
+    _write_bank_video(bank, "DUNK", "001_1")
+    truncated_path = _write_bank_video(bank, "DUNK", "001_2")
+    truncated_path.write_bytes(truncated_path.read_bytes()[:truncated_path.stat().st_size // 2])
+    _write_bank_video(bank, "DUNK", "001_3", resolution=(640, 360))
+    _write_bank_video(bank, "LAYUP", "002_1", seconds=1)
+    (bank / "LAYUP" / "002_2").mkdir()
+    (bank / "LAYUP" / "002_2" / "info.json").write_text("{}")
+    # Not harvested into yet
+    (bank / "LAYUP" / "002_3").mkdir()
+
+    report = scan_videos_bank(bank, ["DUNK", "LAYUP"], quarantine_path=tmp_path / "quarantine.txt")
+    assert dict(zip(report["source"], report["issues"])) == {
+        "DUNK/001_1/cut_video.avi": "", "DUNK/001_2/cut_video.avi": "undecodable",
+        "DUNK/001_3/cut_video.avi": "resolution", "LAYUP/002_1/cut_video.avi": "too_short",
+        "LAYUP/002_2/cut_video.avi": "missing"}
+    assert (tmp_path / "quarantine.txt").read_text().splitlines() == list(report["source"][1:])
+    assert find_defected_video_folders(bank) == [str(bank / "LAYUP" / "002_2")]
+
+    probed_paths = []
+    probe_video = utils.dataset.probe_video
+    monkeypatch.setattr(utils.dataset, "probe_video",
+                        lambda path, full_decode: probed_paths.append(path) or probe_video(path, full_decode))
+    pd.testing.assert_frame_equal(scan_videos_bank(bank, ["DUNK", "LAYUP"]), report)
+    assert probed_paths == []
+
+    # Cut again, at the right resolution
+    _write_bank_video(bank, "DUNK", "001_3")
+    report = scan_videos_bank(bank, ["DUNK", "LAYUP"])
+    assert probed_paths == [str(bank / "DUNK" / "001_3" / "cut_video.avi")]
+    quarantine = report.loc[report["issues"] != "", "source"]
+    assert list(quarantine) == ["DUNK/001_2/cut_video.avi", "LAYUP/002_1/cut_video.avi", "LAYUP/002_2/cut_video.avi"]
+    manifest = make_split_manifest(bank, ["DUNK", "LAYUP"], excluded_sources=quarantine)
+    assert sorted(manifest["source"]) == ["DUNK/001_1/cut_video.avi", "DUNK/001_3/cut_video.avi"]
+
+
+class _RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+    """ Serves the files of `directory`, with range requests support (unless `supports_ranges` is False) """
+    directory = None
+    supports_ranges = True
+    bytes_sent = 0
+
+    def do_GET(self):
+        data = self.directory.joinpath(self.path.lstrip("/")).read_bytes()
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", "")) if self.supports_ranges else None
+        if match:
+            start, end = int(match[1]), min(int(match[2] or len(data) - 1), len(data) - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            start, end = 0, len(data) - 1
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        try:
+            self.wfile.write(data[start:end + 1])
+            type(self).bytes_sent += end - start + 1
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(params=[True, False], ids=["ranges", "no_ranges"])
+def video_server(request, tmp_path):
+    served_directory = tmp_path / "served"
+    served_directory.mkdir()
+    handler = type("Handler", (_RangeRequestHandler,), {"directory": served_directory,
+                                                        "supports_ranges": request.param})
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield served_directory, f"http://127.0.0.1:{server.server_address[1]}", handler
+    server.shutdown()
+    server.server_close()
+
+
+def test_http_range_reader_reads_only_what_it_needs(video_server):
+    served_directory, url, handler = video_server
+    data = np.random.default_rng(0).integers(0, 256, 100_000, dtype=np.uint8).tobytes()
+    served_directory.joinpath("data.bin").write_bytes(data)
+    if not handler.supports_ranges:
+        with pytest.raises(ValueError):
+            HTTPRangeReader(f"{url}/data.bin")
+        return
+
+    with HTTPRangeReader(f"{url}/data.bin", block_size=4096, prefetch_blocks=1) as reader:
+        assert reader.size == len(data)
+        assert reader.read(10) == data[:10]
+        reader.seek(50_000)
+        assert reader.read(10_000) == data[50_000:60_000]
+        reader.seek(-5, 2)
+        assert reader.read() == data[-5:]
+        assert reader.read() == b""
+    assert reader.bytes_downloaded < len(data) / 2
+
+
+def test_cut_video_from_url_fetches_only_the_needed_segment(tmp_path, fake_ocr, video_server):
+    served_directory, url, handler = video_server
+    _write_clock_video(served_directory / "video.avi", list(range(59, 0, -1)) + [None] * 60)
+    video_size = served_directory.joinpath("video.avi").stat().st_size
+
+    cut_video(str(served_directory / "video.avi"), "55.", 4, 1, str(tmp_path / "local_cut.avi"), search_mode="stream")
+    stats = CutVideoStats()
+    assert cut_video_from_url(f"{url}/video.avi", "55.", 4, 1, str(tmp_path / "remote_cut.avi"), stats=stats,
+                              block_size=8 * 1024)
+    assert stats.shot_frame == 40
+
+    local_cut, remote_cut = cv2.VideoCapture(str(tmp_path / "local_cut.avi")), \
+        cv2.VideoCapture(str(tmp_path / "remote_cut.avi"))
+    assert local_cut.get(cv2.CAP_PROP_FRAME_COUNT) == remote_cut.get(cv2.CAP_PROP_FRAME_COUNT) == 50
+    assert np.array_equal(local_cut.read()[1], remote_cut.read()[1])
+    local_cut.release()
+    remote_cut.release()
+    if handler.supports_ranges:
+        assert stats.bytes_downloaded < video_size / 4
+    else:
+        assert stats.bytes_downloaded == video_size
+
+
+@pytest.mark.parametrize("video_server", [True], indirect=True)
+def test_videos_bank_harvester_segment_fetch_mode(tmp_path, video_server):
+    served_directory, url, _ = video_server
+    _write_clock_video(served_directory / "video.avi", list(range(40, 10, -1)))
+
+    def fake_get_video_event_info(game_id, game_event_id):
+        df = _fake_pbp_data(game_id)
+        description = df.loc[df['EVENTNUM'] == int(game_event_id), 'HOMEDESCRIPTION'].item()
+        return {'desc': description, 'video_url': f"{url}/video.avi"}
+
+    def download_video_must_not_be_called(event_info, info_path, video_path):
+        raise AssertionError("segment fetch mode should not download whole videos")
+
+    harvester = VideosBankHarvester(
+        tmp_path / "videos", ['DUNK'], number_of_desired_plays_per_type=2, new_resolution=None, new_fps=None,
+        download_workers=1, cut_workers=1, use_processes=False, fetch_mode='segment',
+        cut_video_kwargs={'clock_reader': _FakeClockReader()}, get_pbp_data_function=_fake_pbp_data,
+        get_video_event_info_function=fake_get_video_event_info,
+        download_video_function=download_video_must_not_be_called
+    )
+    assert harvester.run(["001", "002", "003"]) == {'DUNK': 2}
+    assert harvester.failed_videos == []
+    for directory in (tmp_path / "videos" / "DUNK").iterdir():
+        assert sorted(path.name for path in directory.iterdir()) == ['cut_video.avi', 'info.json']
+
+
+def _write_numbered_video(path, number_of_frames, fps=30, resolution=(64, 48)):
+    """ Writes a video whose n-th frame has brightness 2 * n """
+    out = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'MJPG'), fps, resolution, isColor=True)
+    for i in range(number_of_frames):
+        out.write(np.full((resolution[1], resolution[0], 3), 2 * i, dtype=np.uint8))
+    out.release()
+
+
+def _read_brightnesses(path):
+    cap = cv2.VideoCapture(str(path))
+    brightnesses = []
+    ret, frame = cap.read()
+    while ret:
+        brightnesses.append(round(frame.mean() / 2))
+        ret, frame = cap.read()
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return brightnesses, fps
+
+
+@pytest.mark.parametrize("video_backend", ["opencv", "pyav"])
+def test_video_backends_change_resolution_and_fps(tmp_path, video_backend):
+    if video_backend == "pyav":
+        pytest.importorskip("av")
+    _write_numbered_video(tmp_path / "video.avi", 60)
+    assert change_video_resolution_and_fps(str(tmp_path / "video.avi"), str(tmp_path / "new.avi"), (32, 24), 10,
+                                           video_backend=video_backend)
+    brightnesses, fps = _read_brightnesses(tmp_path / "new.avi")
+    assert fps == 10
+    assert cv2.VideoCapture(str(tmp_path / "new.avi")).read()[1].shape == (24, 32, 3)
+    # XVID is lossy
+    assert np.allclose(brightnesses, range(0, 60, 3), atol=3)
+
+
+def test_pyav_backend_cuts_like_opencv(tmp_path, fake_ocr):
+    pytest.importorskip("av")
+    video_path = tmp_path / "video.avi"
+    _write_clock_video(video_path, list(range(40, 10, -1)))
+    brightnesses = {}
+    for video_backend in ["opencv", "pyav"]:
+        output_path = tmp_path / f"cut_{video_backend}.avi"
+        assert cut_video(video_path.as_posix(), "25.", 4, 1, output_path.as_posix(), new_resolution=(32, 24),
+                         new_fps=5, search_mode='gallop', video_backend=video_backend)
+        brightnesses[video_backend], fps = _read_brightnesses(output_path)
+        assert fps == 5
+    assert len(brightnesses["pyav"]) == len(brightnesses["opencv"]) == 25
+    assert np.allclose(brightnesses["pyav"], brightnesses["opencv"], atol=2)
+
+
+def test_pyav_backend_stream_copy(tmp_path):
+    pytest.importorskip("av")
+    _write_numbered_video(tmp_path / "video.avi", 60)
+    backend = get_video_backend("pyav")
+    # MJPG frames are all keyframes, so the copy starts right on the start frame
+    assert backend.transcode(tmp_path / "video.avi", str(tmp_path / "copy.avi"), start_frame=20,
+                             number_of_frames=15) == 15
+    brightnesses, fps = _read_brightnesses(tmp_path / "copy.avi")
+    assert fps == 30
+    assert np.allclose(brightnesses, range(20, 35), atol=1)
+
+
+def test_pyav_backend_stream_copies_only_from_a_keyframe(tmp_path, monkeypatch):
+    av = pytest.importorskip("av")
+    video_path = tmp_path / "video.avi"
+    with av.open(str(video_path), 'w') as output:
+        stream = output.add_stream('mpeg4', rate=30)
+        stream.width, stream.height, stream.pix_fmt = 64, 48, 'yuv420p'
+        stream.codec_context.gop_size = 10
+        for i in range(60):
+            frame = av.VideoFrame.from_ndarray(np.full((48, 64, 3), 2 * i, dtype=np.uint8), format='rgb24')
+            frame.pts = i
+            output.mux(stream.encode(frame))
+        output.mux(stream.encode(None))
+    keyframes = [i for i, packet in enumerate(packet for packet in av.open(str(video_path)).demux(video=0)
+                                              if packet.dts is not None) if packet.is_keyframe]
+    assert 23 in keyframes and 20 not in keyframes
+    source_brightnesses, _ = _read_brightnesses(video_path)
+    backend = get_video_backend("pyav")
+
+    stats = CutVideoStats()
+    assert backend.transcode(video_path, str(tmp_path / "copy.avi"), start_frame=23, number_of_frames=15,
+                             stats=stats) == 15
+    assert (stats.packets_copied, stats.frames_decoded) == (15, 0)
+    assert _read_brightnesses(tmp_path / "copy.avi")[0] == source_brightnesses[23:38]
+
+    # Not a keyframe, so transcoded, to start on the frame itself
+    stats = CutVideoStats()
+    assert backend.transcode(video_path, str(tmp_path / "cut.avi"), start_frame=20, number_of_frames=15,
+                             stats=stats) == 15
+    assert (stats.packets_copied, stats.frames_decoded) == (0, 15)
+    assert np.allclose(_read_brightnesses(tmp_path / "cut.avi")[0], source_brightnesses[20:35], atol=1)
+
+    # Nothing to change, so the whole video is copied
+    copies = []
+    copy_packets = utils.video.PyAVVideoBackend._copy_packets
+    monkeypatch.setattr(utils.video.PyAVVideoBackend, '_copy_packets',
+                        lambda *args, **kwargs: copies.append(args) or copy_packets(*args, **kwargs))
+    assert change_video_resolution_and_fps(str(video_path), str(tmp_path / "same.avi"), video_backend="pyav")
+    assert len(copies) == 1
+    assert _read_brightnesses(tmp_path / "same.avi")[0] == source_brightnesses
+
+
+_slow_modules = {'cv2', 'numpy', 'pandas', 'pytesseract', 'nba_api', 'youtube_dl', 'requests', 'tqdm'}
+
+
+def _import_times(statement: str) -> dict:
+    """ :return: Module name to its depth in the import tree and cumulative import microseconds, when running the
+    statement in a new interpreter (`python -X importtime`) """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], capture_output=True, text=True,
+                            check=True, cwd=pathlib.Path(__file__).parent)
+    import_times = {}
+    for match in re.finditer(r'^import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)$', result.stderr, re.MULTILINE):
+        import_times[match.group(3)] = ((len(match.group(2)) - 1) // 2, int(match.group(1)))
+    return import_times
+
+
+@pytest.mark.parametrize("statement,budget_ms,allowed_slow_modules", [
+    ("import utils", 50, set()),
+    ("from utils import add_seconds_to_time, prior_shot_type_to_shot_dsc, get_shot_type_name", 50, set()),
+    # What a cut worker needs
+    ("from utils import cut_video, TemplateClockReader", 1000, {'cv2', 'numpy'}),
+])
+def test_import_time_budget(statement, budget_ms, allowed_slow_modules):
+    startup_modules = set(_import_times('pass'))
+    import_times = {name: depth_and_time for name, depth_and_time in _import_times(statement).items()
+                    if name not in startup_modules}
+    slow_modules = {name.split('.')[0] for name in import_times} & _slow_modules
+    assert slow_modules <= allowed_slow_modules
+    import_ms = sum(microseconds for depth, microseconds in import_times.values() if depth == 0) / 1000
+    assert import_ms < budget_ms
+
+
+def test_utils_names_are_imported_from_their_submodules():
+    for submodule_name in utils._submodule_names:
+        submodule = getattr(utils, submodule_name)
+        for name, value in vars(submodule).items():
+            if not name.startswith('_') and getattr(value, '__module__', None) == submodule.__name__:
+                assert getattr(utils, name) is value
+    assert utils.nba_api_rate_limiter is utils.api.nba_api_rate_limiter
+    with pytest.raises(AttributeError):
+        utils.no_such_name
@@ -0,0 +1,69 @@
+"""
+Utilities for harvesting videos of NBA shots, and for making datasets of them. Split by what they need to import:
+
+- `utils.taxonomy`: Shot types, play descriptions and game clock strings. Only the standard library.
+- `utils.metrics`: Per stage timing and counters of a harvest
+- `utils.sqlite`: The thread-safe SQLite connections of the caches and stores
+- `utils.api`: The NBA stats API (rate limited and cached), the shot events of the play-by-play data, and the
+  `ShotEventIndex`
+- `utils.video`: Video backends, reading the game clock, and cutting videos around a shot
+- `utils.dataset`: The videos bank harvester and its state, and splitting the bank into a dataset
+
+`import utils` imports none of them. A name (like `from utils import cut_video`) imports its submodule on first
+access, and the slowest dependencies (pandas in `utils.video`, pytesseract, nba_api, youtube_dl) are imported by the
+functions that use them. Set module state (like `nba_api_rate_limiter`) on its submodule, where it is used.
+"""
+import importlib
+
+_submodule_names = {
+    'taxonomy': (
+        'original_name_conversion_dict', 'prior_shot_type_to_shot_dsc', 'prior_shot_type_histogram',
+        'hook_shot_classes', 'bank_shot_classes', 'jump_shot_classes', 'layup_classes', 'dunk_classes', 'cut_classes',
+        'putback_classes', '_game_clock_pattern', 'parse_game_clock', 'add_seconds_to_time', 'get_event_msg_action',
+        'get_shot_type_name', 'get_season_from_game_id',
+    ),
+    'metrics': (
+        '_NullStage', '_null_stage', '_current_stage', '_current_event', '_Stage', 'HarvestMetrics',
+        'load_metrics_records', 'summarize_metrics_records', '_prometheus_name', 'write_prometheus_textfile',
+        'harvest_metrics',
+    ),
+    'api': (
+        'TokenBucketRateLimiter', '_lock_file', '_unlock_file', '_default_rate_limiter_state_path', 'nba_api_cooldown',
+        'nba_api_rate_limiter', 'gap_manager', '_log_nba_api_retry', '_before_nba_api_retry_sleep', 'ResponseCache',
+        'nba_api_response_cache', '_has_nba_api_data', '_cached_nba_api_call', '_get_pbp_json_from_api', 'get_pbp_data',
+        '_get_video_event_json_from_api', 'get_video_event_info', '_result_set_data_frame', '_video_event_info',
+        'AsyncNBAStatsClient', '_clock_strings_to_seconds', '_shifted', 'get_shots_event_data_from_games_df',
+        'get_shots_event_data_from_game_df', 'ShotEventIndex', 'save_event_info', 'download_video',
+    ),
+    'video': (
+        'VideoBackend', '_fps_decrease_factor', 'OpenCVVideoBackend', 'PyAVVideoBackend', 'video_backends',
+        'get_video_backend', 'change_video_resolution_and_fps', '_read_clock_text', 'ClockOCRCache', 'ClockReader',
+        'TesseractClockReader', '_binarize_clock_box', '_segment_clock_glyphs', '_split_touching_digits',
+        '_glyph_vector', 'TemplateClockReader', 'evaluate_clock_readers', 'load_labelled_clock_frames', 'CutVideoStats',
+        '_ClockProbe', '_find_shot_frame_linear', '_find_shot_frame_gallop', '_shot_frame_search_functions',
+        '_cut_video_streaming', '_open_video_capture', 'cut_video', 'benchmark_cut_video_search_modes',
+        'compare_cut_video_search_modes', 'HTTPRangeReader', 'cut_video_from_url', '_cut_and_validate', 'probe_video',
+    ),
+    'dataset': (
+        'dataset_splits', '_assign_splits', 'make_split_manifest', 'manifest_from_dataset_folder',
+        'load_split_manifest', '_place_dataset_file', 'materialize_split_manifest',
+        'organize_dataset_from_videos_folder', 'HarvestStateStore', '_HarvestJob', '_HarvestQuota',
+        '_pipeline_sentinel', 'VideosBankHarvester', 'VideoProbeCache', 'scan_videos_bank',
+        'find_defected_video_folders', '_yield_without_desktop_ini', 'create_tiny_dataset',
+    ),
+}
+_name_to_submodule = {name: submodule for submodule, names in _submodule_names.items() for name in names}
+
+__all__ = sorted(name for name in _name_to_submodule if not name.startswith('_'))
+
+
+def __getattr__(name: str):
+    if name in _submodule_names:
+        return importlib.import_module(f'{__name__}.{name}')
+    if name in _name_to_submodule:
+        return getattr(importlib.import_module(f'{__name__}.{_name_to_submodule[name]}'), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_submodule_names) | set(_name_to_submodule))
@@ -0,0 +1,755 @@
+"""
+The NBA stats API (rate limited, retried and cached), the shot events of the play-by-play data, and the event videos
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from json import JSONDecodeError
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+from _socket import gaierror
+from requests import ConnectionError as RequestsConnectionError
+from tenacity import retry, stop_after_attempt, wait_random, retry_if_exception_type, before_sleep_log
+from tqdm import tqdm
+from urllib3.exceptions import HTTPError
+
+from utils.metrics import harvest_metrics
+from utils.sqlite import _ThreadLocalSQLite
+from utils.taxonomy import putback_classes, get_shot_type_name, get_season_from_game_id
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucketRateLimiter:
+    """
+    This is due to the NBA API blocking us if we make requests too frequently. A token bucket (`rate` tokens a second,
+    holding up to `burst` tokens), shared by every thread, asyncio task and process on the machine that uses the same
+    `state_path`. The bucket state lives in that file, and is updated under an exclusive file lock.
+
+    When the API starts failing (`penalize`, called by the retries) the rate drops, and it recovers gradually with
+    every successful request (`reward`). Being part of the shared state, the slowdown applies to all the processes.
+    """
+    _state_format = '<dd'
+
+    def __init__(self, rate: float, burst: int = 1, state_path: Optional[str] = None,
+                 penalty_factor: float = 2.0, recovery_factor: float = 1.1, max_slowdown: float = 16.0):
+        """
+        :param rate: Requests per second
+        :param burst: How many requests can be made at once, after a quiet period
+        :param state_path: File shared between the processes. If None, the limiter is private to this process.
+        :param penalty_factor: How much slower to go after each failure
+        :param recovery_factor: How much faster to go after each success, until back to `rate`
+        :param max_slowdown: Lower limit for the rate, as a fraction of it
+        """
+        if rate <= 0 or burst < 1:
+            raise ValueError(f"rate ({rate}) must be positive and burst ({burst}) at least 1")
+        self.rate = rate
+        self.burst = burst
+        self.state_path = state_path
+        self.penalty_factor = penalty_factor
+        self.recovery_factor = recovery_factor
+        self.max_slowdown = max_slowdown
+        self._thread_lock = threading.Lock()
+        # In-process state, for when there is no state file
+        self._state = (0.0, 1.0)
+        # Seconds this process spent waiting for the limiter
+        self.total_wait_time = 0.0
+
+    @contextmanager
+    def _locked_state(self):
+        """ Yields the current (theoretical arrival time, slowdown) state, and a function for saving a new one """
+        with self._thread_lock:
+            if self.state_path is None:
+                def save(new_state):
+                    self._state = new_state
+
+                yield self._state, save
+                return
+
+            with open(self.state_path, 'a+b') as f:
+                _lock_file(f)
+                try:
+                    f.seek(0)
+                    data = f.read(struct.calcsize(self._state_format))
+                    state = struct.unpack(self._state_format, data) if data else (0.0, 1.0)
+
+                    def save(new_state):
+                        f.seek(0)
+                        f.truncate()
+                        f.write(struct.pack(self._state_format, *new_state))
+                        f.flush()
+
+                    yield state, save
+                finally:
+                    _unlock_file(f)
+
+    def reserve(self) -> float:
+        """
+        Takes a token, possibly one that will only be available in the future.
+
+        :return: How many seconds to wait before using the token
+        """
+        with self._locked_state() as (state, save):
+            theoretical_arrival_time, slowdown = state
+            interval = slowdown / self.rate
+            now = time.time()
+            # The bucket is full once the theoretical arrival time is `burst` intervals in the past
+            start_time = max(theoretical_arrival_time, now - (self.burst - 1) * interval)
+            save((start_time + interval, slowdown))
+        return max(0.0, start_time - now)
+
+    def acquire(self) -> float:
+        """ Blocks until a token is available. :return: The time waited """
+        wait_time = self.reserve()
+        if wait_time > 0:
+            time.sleep(wait_time)
+        self.total_wait_time += wait_time
+        harvest_metrics.count('rate_limit_wait_seconds', wait_time)
+        return wait_time
+
+    async def acquire_async(self) -> float:
+        """ Like `acquire`, without blocking the event loop (taking the file lock included) """
+        wait_time = await asyncio.to_thread(self.reserve)
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+        self.total_wait_time += wait_time
+        harvest_metrics.count('rate_limit_wait_seconds', wait_time)
+        return wait_time
+
+    @contextmanager
+    def action_gap(self):
+        """ Like the old `ActionGapManager.action_gap`. Waits for a token before running the block """
+        self.acquire()
+        yield
+
+    def _update_slowdown(self, factor: float):
+        with self._locked_state() as (state, save):
+            theoretical_arrival_time, slowdown = state
+            save((theoretical_arrival_time, min(self.max_slowdown, max(1.0, slowdown * factor))))
+
+    def penalize(self):
+        """ Slows down after a failed request """
+        self._update_slowdown(self.penalty_factor)
+
+    def reward(self):
+        """ Gradually goes back to the configured rate after a successful request """
+        self._update_slowdown(1 / self.recovery_factor)
+
+    @property
+    def slowdown(self) -> float:
+        with self._locked_state() as (state, _):
+            return state[1]
+
+
+def _lock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _default_rate_limiter_state_path() -> str:
+    """
+    The state file of `nba_api_rate_limiter`: `$NBA_API_RATE_LIMITER_STATE` if set, or a file in the temporary
+    folder, named after the user and this checkout, so other users and checkouts on the machine have their own
+    """
+    state_path = os.environ.get('NBA_API_RATE_LIMITER_STATE')
+    if state_path:
+        return state_path
+    namespace = hashlib.sha1(f"{os.path.expanduser('~')}|{pathlib.Path(__file__).resolve().parent}".encode())
+    return os.path.join(tempfile.gettempdir(), f"nba_api_rate_limiter-{namespace.hexdigest()[:12]}")
+
+
+# This is for not overloading the NBA API and getting blocked. Shared by all the processes of this checkout (or of
+# every checkout, with the same `NBA_API_RATE_LIMITER_STATE`).
+nba_api_cooldown = 0.6
+nba_api_rate_limiter = TokenBucketRateLimiter(rate=1 / nba_api_cooldown, burst=1,
+                                              state_path=_default_rate_limiter_state_path())
+gap_manager = nba_api_rate_limiter
+
+
+_log_nba_api_retry = before_sleep_log(logger, logging.DEBUG)
+# What the NBA API calls are retried on: connection errors, and responses that aren't JSON (errors and throttling)
+_nba_api_retry_exceptions = (JSONDecodeError, ConnectionError, gaierror, HTTPError, RequestsConnectionError)
+
+
+def _before_nba_api_retry_sleep(retry_state):
+    # The API is failing, maybe because we're too fast for it
+    nba_api_rate_limiter.penalize()
+    harvest_metrics.count('retries')
+    _log_nba_api_retry(retry_state)
+
+
+class ResponseCache(_ThreadLocalSQLite):
+    """
+    An on-disk cache of API responses (JSON-able values), keyed by endpoint and parameters. Stored compressed in an
+    SQLite database in WAL mode, so many threads and processes can read and write it at once.
+
+    Entries older than `ttl_seconds` are treated as missing, and once the cache is bigger than `max_size_bytes` the
+    least recently used entries are evicted. Values that `is_valid` rejects (like error responses) are neither stored
+    nor returned.
+
+    A hit only writes its access time when the stored one is older than `access_time_resolution_seconds`, so the reads
+    of many workers don't wait on each other for the write lock, at the cost of a coarser least recently used order.
+    """
+    _schema = (
+        'CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, '
+        'created REAL NOT NULL, accessed REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)',
+    )
+
+    def __init__(self, path: str, ttl_seconds: Optional[float] = None, max_size_bytes: Optional[int] = None,
+                 access_time_resolution_seconds: float = 60 * 60):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_size_bytes = max_size_bytes
+        self.access_time_resolution_seconds = access_time_resolution_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # The counters are updated by every thread using the cache
+        self._counters_lock = threading.Lock()
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        del state['_counters_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._counters_lock = threading.Lock()
+
+    def _count(self, counter: str, value: int = 1):
+        with self._counters_lock:
+            setattr(self, counter, getattr(self, counter) + value)
+
+    @staticmethod
+    def _key(endpoint: str, params: Dict) -> str:
+        return f"{endpoint}?{json.dumps(params, sort_keys=True, default=str)}"
+
+    def get(self, endpoint: str, params: Dict, is_valid: Optional[Callable] = None):
+        """
+        :param is_valid: Whether a cached value can be used. Entries cached before it rejected them count as missing.
+        :return: The cached value, or None if it isn't cached (or expired, or not valid)
+        """
+        key = self._key(endpoint, params)
+        row = self._connection.execute('SELECT value, created, accessed FROM responses WHERE key = ?',
+                                       (key,)).fetchone()
+        now = time.time()
+        if row is None or (self.ttl_seconds is not None and now - row[1] > self.ttl_seconds):
+            self._count('misses')
+            return None
+        value = json.loads(zlib.decompress(row[0]))
+        if is_valid is not None and not is_valid(value):
+            self._count('misses')
+            return None
+        if now - row[2] > self.access_time_resolution_seconds:
+            self._connection.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+        self._count('hits')
+        return value
+
+    def set(self, endpoint: str, params: Dict, value, is_valid: Optional[Callable] = None):
+        """ :param is_valid: Whether the value can be cached. If it can't, it isn't stored. """
+        if is_valid is not None and not is_valid(value):
+            return
+        data = zlib.compress(json.dumps(value).encode(), 6)
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute('INSERT OR REPLACE INTO responses (key, value, size, created, accessed) '
+                               'VALUES (?, ?, ?, ?, ?)', (self._key(endpoint, params), data, len(data), now, now))
+            if self.ttl_seconds is not None:
+                connection.execute('DELETE FROM responses WHERE created < ?', (now - self.ttl_seconds,))
+            if self.max_size_bytes is not None:
+                self._evict(connection)
+
+    def _evict(self, connection: sqlite3.Connection):
+        total_size = connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total_size <= self.max_size_bytes:
+            return
+        keys_to_evict = []
+        for key, size in connection.execute('SELECT key, size FROM responses ORDER BY accessed'):
+            if total_size <= self.max_size_bytes:
+                break
+            keys_to_evict.append((key,))
+            total_size -= size
+        connection.executemany('DELETE FROM responses WHERE key = ?', keys_to_evict)
+        self._count('evictions', len(keys_to_evict))
+
+    def get_or_call(self, endpoint: str, params: Dict, function: Callable, is_valid: Optional[Callable] = None):
+        """ :return: The cached value, or the value of `function(**params)` (which is then cached, if `is_valid`) """
+        value = self.get(endpoint, params, is_valid)
+        if value is None:
+            value = function(**params)
+            self.set(endpoint, params, value, is_valid)
+        return value
+
+    def clear(self):
+        self._connection.execute('DELETE FROM responses')
+
+    def stats(self) -> Dict[str, float]:
+        entries, size = self._connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions, 'entries': entries, 'size_bytes': size}
+
+
+# Responses of the NBA API. Past games don't change, but the video urls might, so entries expire after a month.
+# Set to None to always go to the API.
+nba_api_response_cache = ResponseCache(
+    os.path.join(os.path.expanduser('~'), '.cache', 'nba_api_responses.sqlite'),
+    ttl_seconds=30 * 24 * 60 * 60, max_size_bytes=2 * 1024 ** 3
+)
+
+
+def _has_nba_api_data(response_json) -> bool:
+    """
+    Whether a response of the NBA API is worth caching: not an error (which has no result sets), and not empty
+    (every result set without rows, like the empty responses PlayByPlayV2 gives for some games). These can be
+    different the next time, so they are asked for again.
+    """
+    result_sets = response_json.get('resultSets') if isinstance(response_json, dict) else None
+    if isinstance(result_sets, list):
+        return any(result_set.get('rowSet') for result_set in result_sets)
+    if isinstance(result_sets, dict):
+        # VideoEventsAsset: the urls under 'Meta', and the events under 'playlist'
+        return bool(result_sets.get('playlist'))
+    return False
+
+
+def _cached_nba_api_call(endpoint: str, params: Dict, function: Callable) -> Dict:
+    if nba_api_response_cache is None:
+        return function(**params)
+    return nba_api_response_cache.get_or_call(endpoint, params, function, _has_nba_api_data)
+
+
+@retry(stop=stop_after_attempt(50), wait=wait_random(min=1, max=2),
+       retry=retry_if_exception_type(_nba_api_retry_exceptions),
+       reraise=True,
+       before_sleep=_before_nba_api_retry_sleep)
+def _get_pbp_json_from_api(game_id: str) -> Dict:
+    # nba_api is slow to import, and only needed on a cache miss
+    from nba_api.stats.endpoints import playbyplayv2
+
+    with nba_api_rate_limiter.action_gap():
+        raw_data = playbyplayv2.PlayByPlayV2(game_id=game_id, timeout=60 * 5)
+    nba_api_rate_limiter.reward()
+    return raw_data.get_dict()
+
+
+def _result_set_data_frame(response_json: Dict, name: str) -> pd.DataFrame:
+    """ Like the `get_data_frames()` of the nba_api endpoints, for one result set """
+    result_set = next(result_set for result_set in response_json['resultSets'] if result_set['name'] == name)
+    return pd.DataFrame(result_set['rowSet'], columns=result_set['headers'])
+
+
+@harvest_metrics.timed('get_pbp_data')
+def get_pbp_data(game_id):
+    pbp_json = _cached_nba_api_call('playbyplayv2', {'game_id': game_id}, _get_pbp_json_from_api)
+    # Same as `PlayByPlayV2.get_data_frames()[0]`
+    return _result_set_data_frame(pbp_json, 'PlayByPlay')
+
+
+@retry(stop=stop_after_attempt(50), wait=wait_random(min=1, max=2),
+       retry=retry_if_exception_type(_nba_api_retry_exceptions),
+       reraise=True,
+       before_sleep=_before_nba_api_retry_sleep)
+def _get_video_event_json_from_api(game_id: str, game_event_id: str) -> Dict:
+    from nba_api.stats.endpoints import videoeventsasset
+
+    with nba_api_rate_limiter.action_gap():
+        raw_data = videoeventsasset.VideoEventsAsset(game_id=game_id, game_event_id=str(game_event_id), timeout=5 * 60)
+    nba_api_rate_limiter.reward()
+    json = raw_data.get_dict()
+    return json
+
+
+@harvest_metrics.timed('get_video_event_info')
+def get_video_event_info(game_id, game_event_id) -> Dict[str, str]:
+    video_event_dict = _cached_nba_api_call('videoeventsasset',
+                                            {'game_id': game_id, 'game_event_id': str(game_event_id)},
+                                            _get_video_event_json_from_api)
+    return _video_event_info(video_event_dict)
+
+
+def _video_event_info(video_event_dict: Dict) -> Dict[str, str]:
+    video_urls = video_event_dict['resultSets']['Meta']['videoUrls']
+    playlist = video_event_dict['resultSets']['playlist']
+    return {'desc': playlist[0]['dsc'], 'video_url': video_urls[0]['lurl']}
+
+
+class AsyncNBAStatsClient:
+    """
+    Calls the NBA stats API endpoints we use (LeagueGameFinder, PlayByPlayV2 and VideoEventsAsset) from asyncio, many
+    at once, over a pool of keep-alive connections, instead of a blocking call (and a new connection) at a time.
+
+    Every request still takes a token of `nba_api_rate_limiter` (shared with the blocking calls, and with the other
+    processes), so running more at once only helps while the rate budget allows it, and is retried like the blocking
+    calls are. The play-by-play and video event responses go through `nba_api_response_cache`, like the blocking calls.
+    The results have the same shapes as `get_pbp_data`, `get_video_event_info` and `LeagueGameFinder`'s data frame.
+
+    Usage (`await` works as is in a notebook):
+        async with AsyncNBAStatsClient() as client:
+            pbp_dfs = await asyncio.gather(*[client.get_pbp_data(game_id) for game_id in game_ids])
+    """
+    base_url = "https://stats.nba.com/stats/{endpoint}"
+
+    def __init__(self, max_in_flight: int = 8, timeout: float = 60 * 5, max_attempts: int = 50,
+                 retry_wait: tuple = (1, 2), rate_limiter: Optional[TokenBucketRateLimiter] = None,
+                 base_url: Optional[str] = None, headers: Optional[Dict[str, str]] = None):
+        """
+        :param max_in_flight: Requests sent at once (and connections kept open)
+        :param timeout: Seconds for a whole request
+        :param retry_wait: The (min, max) seconds between attempts
+        :param rate_limiter: Defaults to `nba_api_rate_limiter`
+        :param base_url: Where the endpoints are, with an `{endpoint}` placeholder (for tests)
+        :param headers: Defaults to nba_api's headers
+        """
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.retry_wait = retry_wait
+        self._rate_limiter = rate_limiter
+        self.base_url = base_url or self.base_url
+        self.headers = headers
+        self._session = None
+        self._semaphore = None
+        self.requests_made = 0
+
+    @property
+    def rate_limiter(self) -> TokenBucketRateLimiter:
+        # Looked up on every call, so it's the module's current limiter
+        return self._rate_limiter if self._rate_limiter is not None else nba_api_rate_limiter
+
+    async def __aenter__(self) -> 'AsyncNBAStatsClient':
+        # aiohttp is slow to import, and only needed here
+        import aiohttp
+
+        headers = self.headers
+        if headers is None:
+            from nba_api.stats.library.http import NBAStatsHTTP
+
+            headers = NBAStatsHTTP.headers
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_in_flight, keepalive_timeout=60),
+            headers=headers, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+        self._session = None
+
+    async def _before_retry_sleep(self, retry_state):
+        # Under the limiter's file lock, so not on the event loop
+        await asyncio.to_thread(self.rate_limiter.penalize)
+        harvest_metrics.count('retries')
+        _log_nba_api_retry(retry_state)
+
+    async def _get_json(self, endpoint_class, **kwargs) -> Dict:
+        """ Sends the request the nba_api endpoint class would send, and returns its JSON response """
+        import aiohttp
+        from tenacity import AsyncRetrying
+
+        if self._session is None:
+            raise RuntimeError("AsyncNBAStatsClient must be used in an `async with` block")
+        # The endpoint classes know the endpoint names and the default parameters, so they build the request
+        endpoint = endpoint_class(**kwargs, get_request=False)
+        # Sorted, and without the None values, like nba_api (and requests) send them
+        params = sorted((key, str(value)) for key, value in endpoint.parameters.items() if value is not None)
+        url = self.base_url.format(endpoint=endpoint.endpoint)
+        async for attempt in AsyncRetrying(
+                stop=stop_after_attempt(self.max_attempts), wait=wait_random(*self.retry_wait),
+                retry=retry_if_exception_type(_nba_api_retry_exceptions + (aiohttp.ClientError, asyncio.TimeoutError)),
+                reraise=True, before_sleep=self._before_retry_sleep):
+            with attempt:
+                async with self._semaphore:
+                    await self.rate_limiter.acquire_async()
+                    self.requests_made += 1
+                    async with self._session.get(url, params=params) as response:
+                        contents = await response.text()
+                response_json = json.loads(contents)
+        await asyncio.to_thread(self.rate_limiter.reward)
+        return response_json
+
+    async def _cached_get_json(self, endpoint: str, params: Dict, endpoint_class, **kwargs) -> Dict:
+        response_cache = nba_api_response_cache
+        if response_cache is not None:
+            response_json = await asyncio.to_thread(response_cache.get, endpoint, params, _has_nba_api_data)
+            if response_json is not None:
+                return response_json
+        response_json = await self._get_json(endpoint_class, **kwargs)
+        if response_cache is not None:
+            await asyncio.to_thread(response_cache.set, endpoint, params, response_json, _has_nba_api_data)
+        return response_json
+
+    async def get_pbp_data(self, game_id: str) -> pd.DataFrame:
+        """ Like `get_pbp_data` """
+        from nba_api.stats.endpoints import playbyplayv2
+
+        with harvest_metrics.stage('get_pbp_data'):
+            pbp_json = await self._cached_get_json('playbyplayv2', {'game_id': game_id}, playbyplayv2.PlayByPlayV2,
+                                                   game_id=game_id)
+        return _result_set_data_frame(pbp_json, 'PlayByPlay')
+
+    async def get_video_event_info(self, game_id: str, game_event_id) -> Dict[str, str]:
+        """ Like `get_video_event_info` """
+        from nba_api.stats.endpoints import videoeventsasset
+
+        with harvest_metrics.stage('get_video_event_info'):
+            video_event_dict = await self._cached_get_json(
+                'videoeventsasset', {'game_id': game_id, 'game_event_id': str(game_event_id)},
+                videoeventsasset.VideoEventsAsset, game_id=game_id, game_event_id=str(game_event_id))
+        return _video_event_info(video_event_dict)
+
+    async def league_game_finder(self, **kwargs) -> pd.DataFrame:
+        """
+        :param kwargs: The parameters of `LeagueGameFinder`, like `league_id_nullable='00'`
+        :return: Like `LeagueGameFinder(**kwargs).get_data_frames()[0]`. Not cached, since there are new games every
+        day.
+        """
+        from nba_api.stats.endpoints import leaguegamefinder
+
+        response_json = await self._get_json(leaguegamefinder.LeagueGameFinder, **kwargs)
+        return _result_set_data_frame(response_json, 'LeagueGameFinderResults')
+
+
+def _clock_strings_to_seconds(clock_strings: pd.Series) -> np.ndarray:
+    """ Parses "M:SS" clock strings into integer seconds. Raises if a clock is missing, like the row-wise version. """
+    # A period has at most 721 different clock readings, so only those get parsed
+    codes, unique_clock_strings = pd.factorize(clock_strings)
+    # Missing clocks get the code -1, which would index the last clock reading
+    missing = np.flatnonzero(codes < 0)
+    if len(missing):
+        raise ValueError(f"{len(missing)} events have no `PCTIMESTRING`, the first at row {missing[0]}")
+    parts = pd.Series(unique_clock_strings).str.split(':', n=1, expand=True)
+    unique_seconds = parts[0].astype(np.int64).to_numpy() * 60 + parts[1].astype(np.int64).to_numpy()
+    return unique_seconds[codes]
+
+
+def _shifted(values: np.ndarray, periods: int, invalid: np.ndarray, fill_value) -> np.ndarray:
+    """ Like `Series.shift`, but with `fill_value` wherever `invalid` (rows with no neighbor in their group) """
+    shifted = np.roll(values, periods)
+    return np.where(invalid, fill_value, shifted)
+
+
+def get_shots_event_data_from_games_df(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Vectorised `get_shots_event_data_from_game_df`, for the play-by-play data of many games at once. The events of
+    every game (`GAME_ID`, if present) must be contiguous and in order, and neighbouring events are only looked at
+    within the same game and period. The input frame is not modified.
+
+    :return: The shot events, with `GAME_ID` as the first column if it's in `df`
+    """
+    REBOUND_EVENT_TYPE = 4
+    number_of_events = len(df.index)
+    event_type = df['EVENTMSGTYPE'].to_numpy()
+    period = df['PERIOD'].to_numpy()
+    game = pd.factorize(df['GAME_ID'])[0] if 'GAME_ID' in df.columns else np.zeros(number_of_events, dtype=np.int64)
+    # Where each (game, period) group starts and ends
+    starts_group = np.ones(number_of_events, dtype=bool)
+    starts_group[1:] = (game[1:] != game[:-1]) | (period[1:] != period[:-1])
+    ends_group = np.ones(number_of_events, dtype=bool)
+    ends_group[:-1] = starts_group[1:]
+
+    # Time from last event based on the shot clock. Periods start at 12:00 (5:00 for overtimes).
+    clock = _clock_strings_to_seconds(df['PCTIMESTRING'])
+    period_start_clock = np.where(period <= 4, 12 * 60, 5 * 60)
+    time_from_previous_event = np.where(starts_group, period_start_clock, np.roll(clock, 1)) - clock
+    # Remove shots which happens less than 4 secs directly after/before a rebound. These videos likely contains 2 shots.
+    is_rebound_between_shots = (
+        # Event is a rebound
+        (event_type == REBOUND_EVENT_TYPE) &
+        # Event less than 4 seconds after is a shot
+        (_shifted(event_type, 1, starts_group, -1) == 2) & (time_from_previous_event < 4) &
+        # Event less than 4 seconds before is a shot
+        (_shifted(event_type, -1, ends_group, 3) <= 2) & (_shifted(time_from_previous_event, -1, ends_group, 4) < 4)
+    )
+    is_removed = (is_rebound_between_shots | _shifted(is_rebound_between_shots, 1, starts_group, False) |
+                  _shifted(is_rebound_between_shots, -1, ends_group, False))
+
+    is_shot = (
+        ~is_removed &
+        # Remove every play other than a shot
+        (event_type <= 2) &
+        # Remove plays without video
+        (df['VIDEO_AVAILABLE_FLAG'].to_numpy() == 1) &
+        # Remove blocked shots. We don't want them because They'll be harder to classify
+        ~(df['HOMEDESCRIPTION'].str.contains('BLOCK', regex=False, na=False).to_numpy() |
+          df['VISITORDESCRIPTION'].str.contains('BLOCK', regex=False, na=False).to_numpy()) &
+        # Remove tip and putback shots. They will be hard to classify
+        ~df['EVENTMSGACTIONTYPE'].isin(putback_classes.keys()).to_numpy()
+    )
+    columns = ['EVENTNUM', 'EVENTMSGACTIONTYPE', 'PERIOD', 'PCTIMESTRING', 'EVENTMSGTYPE', 'VIDEO_AVAILABLE_FLAG']
+    if 'GAME_ID' in df.columns:
+        columns.insert(0, 'GAME_ID')
+    # Selecting the rows copies them, so `df` stays as it was
+    descriptions = df.loc[is_shot, ['HOMEDESCRIPTION', 'VISITORDESCRIPTION']]
+    shots_event_data = df.loc[is_shot, columns]
+    # Create `DESCRIPTION` from either teams column (doesn't matter to us)
+    # Makes sure before that we didn't mess up, and have a play wite 2 descriptions
+    if descriptions.notna().all(axis=1).any():
+        raise ValueError("df has a row where both `VISITORDESCRIPTION` and `HOMEDESCRIPTION` and not None")
+    description = descriptions['HOMEDESCRIPTION'].fillna(descriptions['VISITORDESCRIPTION'])
+    # Make sure that every line has a not-None description
+    if not description.notna().all():
+        raise ValueError("df has a row where `DESCRIPTION` is None")
+    shots_event_data.insert(columns.index('PCTIMESTRING') + 1, 'DESCRIPTION', description)
+    return shots_event_data
+
+
+def get_shots_event_data_from_game_df(df):
+    shots_event_data = get_shots_event_data_from_games_df(df)
+    return shots_event_data.drop(columns='GAME_ID', errors='ignore')
+
+
+class ShotEventIndex:
+    """
+    The filtered shot events (`get_shots_event_data_from_game_df`) of every processed game, stored as Parquet files
+    partitioned by season, with a manifest of the games already processed. Games are added incrementally, and
+    training sets are sampled from the index alone, without going to the NBA API.
+    """
+    _dtypes = {'GAME_ID': str, 'EVENTNUM': 'int64', 'EVENTMSGACTIONTYPE': 'int64', 'PERIOD': 'int64',
+               'PCTIMESTRING': str, 'DESCRIPTION': str, 'EVENTMSGTYPE': 'int64', 'VIDEO_AVAILABLE_FLAG': 'int64',
+               'SHOT_TYPE': str}
+
+    def __init__(self, root_directory):
+        self.root_directory = pathlib.Path(root_directory)
+        self.shots_directory = self.root_directory.joinpath('shots')
+        self.manifest_path = self.root_directory.joinpath('manifest.json')
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self) -> Dict[str, int]:
+        """ :return: Game id to the number of its shot events in the index """
+        if not self.manifest_path.exists():
+            return {}
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def _save_manifest(self):
+        temp_path = self.manifest_path.with_suffix('.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(temp_path, self.manifest_path)
+
+    def is_processed(self, game_id: str) -> bool:
+        return str(game_id) in self.manifest
+
+    def _flush(self, game_ids: List[str], pbp_dfs: List[pd.DataFrame]):
+        """ Filters the shot events out of the play-by-play data of a batch of games, and writes them to the index """
+        if not pbp_dfs:
+            return
+        df = get_shots_event_data_from_games_df(pd.concat(pbp_dfs, ignore_index=True))
+        df = df.assign(SHOT_TYPE=df['EVENTMSGACTIONTYPE'].map(get_shot_type_name)).astype(self._dtypes)
+        df['SEASON'] = df['GAME_ID'].map(get_season_from_game_id)
+        part_name = f"part-{time.time_ns()}.parquet"
+        for season, season_df in df.groupby('SEASON'):
+            season_directory = self.shots_directory.joinpath(f"SEASON={season}")
+            season_directory.mkdir(parents=True, exist_ok=True)
+            season_df.drop(columns='SEASON').to_parquet(season_directory.joinpath(part_name), index=False)
+        # Only now the games are safely in the index
+        counts = df['GAME_ID'].value_counts()
+        for game_id in game_ids:
+            self.manifest[game_id] = int(counts.get(game_id, 0))
+        self._save_manifest()
+
+    def add_games(self, game_ids: Iterable[str], get_pbp_data_function: Callable = None,
+                  flush_every: int = 100) -> int:
+        """
+        Indexes the shot events of the games that are not in the index yet.
+
+        :param game_ids: Games to index
+        :param get_pbp_data_function: Replaces `get_pbp_data` (for tests)
+        :param flush_every: Number of games to filter and write to the index at once
+        :return: Number of newly indexed games
+        """
+        get_pbp_data_function = get_pbp_data_function or get_pbp_data
+        batch_game_ids, pbp_dfs = [], []
+        added_games = 0
+        for game_id in tqdm([game_id for game_id in game_ids if not self.is_processed(game_id)]):
+            pbp_df = get_pbp_data_function(game_id=game_id)
+            batch_game_ids.append(str(game_id))
+            pbp_dfs.append(pbp_df.assign(GAME_ID=str(game_id)))
+            added_games += 1
+            if len(pbp_dfs) >= flush_every:
+                self._flush(batch_game_ids, pbp_dfs)
+                batch_game_ids, pbp_dfs = [], []
+        self._flush(batch_game_ids, pbp_dfs)
+        return added_games
+
+    def load(self, shot_types: Optional[Iterable[str]] = None, seasons: Optional[Iterable[str]] = None,
+             columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """ :return: The indexed shot events, optionally only of some shot types and seasons """
+        if not self.shots_directory.exists():
+            return pd.DataFrame(columns=list(self._dtypes) + ['SEASON'])
+        filters = []
+        if shot_types is not None:
+            filters.append(('SHOT_TYPE', 'in', list(shot_types)))
+        if seasons is not None:
+            filters.append(('SEASON', 'in', [str(season) for season in seasons]))
+        df = pd.read_parquet(self.shots_directory, columns=columns, filters=filters or None)
+        if 'SEASON' in df.columns:
+            df['SEASON'] = df['SEASON'].astype(str)
+        return df
+
+    def sample_events(self, shot_type: str, number_of_events: int, max_events_per_game: int = 1,
+                      random_state: Optional[int] = None) -> pd.DataFrame:
+        """
+        :return: Up to `number_of_events` random events (with video) of the shot type, at most `max_events_per_game`
+        of them from the same game
+        """
+        df = self.load(shot_types=[shot_type])
+        df = df[df['VIDEO_AVAILABLE_FLAG'] == 1]
+        df = df.sample(frac=1, random_state=random_state)
+        df = df[df.groupby('GAME_ID').cumcount() < max_events_per_game]
+        return df.head(number_of_events).reset_index(drop=True)
+
+    def shot_type_histogram(self) -> Dict[int, int]:
+        """ :return: Like `prior_shot_type_histogram`, but counted from the index (so only shots with video) """
+        counts = self.load(columns=['EVENTMSGACTIONTYPE'])['EVENTMSGACTIONTYPE'].value_counts()
+        return {int(k): int(v) for k, v in sorted(counts.items())}
+
+
+def save_event_info(event_info, info_path):
+    with open(info_path, "w") as outfile:
+        json.dump(event_info, outfile)
+
+
+def download_video(event_info, info_path, video_path):
+    import youtube_dl
+
+    # Save video_event info
+    save_event_info(event_info, info_path)
+    # Save video
+    ydl_opts = {'outtmpl': video_path.as_posix(), 'quiet': True}
+    with harvest_metrics.stage('download_video') as stage, youtube_dl.YoutubeDL(ydl_opts) as ydl:
+        ydl.download([event_info['video_url']])
+        if harvest_metrics.enabled and video_path.exists():
+            stage.add('bytes_downloaded', video_path.stat().st_size)
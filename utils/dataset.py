@@ -0,0 +1,921 @@
+"""
+Harvesting the videos bank (`VideosBankHarvester` and its `HarvestStateStore`), and organizing it into dataset splits
+"""
+import concurrent.futures
+import errno
+import functools
+import json
+import logging
+import os
+import pathlib
+import queue
+import shutil
+import threading
+import time
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Tuple, Optional, Iterable, List, Callable
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from utils.api import get_pbp_data, get_shots_event_data_from_game_df, get_video_event_info, download_video, \
+    save_event_info
+from utils.metrics import harvest_metrics
+from utils.sqlite import _ThreadLocalSQLite
+from utils.taxonomy import get_shot_type_name, get_event_msg_action, add_seconds_to_time
+from utils.video import cut_video, cut_video_from_url, probe_video, _cut_and_validate
+
+logger = logging.getLogger(__name__)
+
+
+dataset_splits = ('train', 'val', 'test')
+
+
+def _assign_splits(split_counts: Dict[str, int], split_ratios: Dict[str, float],
+                   number_of_new_videos: int) -> List[str]:
+    """
+    Hands out splits to new videos of a category, each time to the split that is furthest below its ratio, so a
+    category's splits stay as close to the ratios as possible however many videos are added, and at which runs.
+    """
+    split_counts = dict(split_counts)
+    assigned_splits = []
+    for _ in range(number_of_new_videos):
+        total = sum(split_counts.values()) + 1
+        split = max(split_ratios, key=lambda s: split_ratios[s] * total - split_counts[s])
+        split_counts[split] += 1
+        assigned_splits.append(split)
+    return assigned_splits
+
+
+def make_split_manifest(root_dir, video_type_categories: Iterable[str],
+                        number_of_videos_per_category: Optional[int] = None,
+                        train_val_test_split: Tuple[float, float, float] = (0.8, 0.1, 0.1), random_state: int = 0,
+                        existing_manifest: Optional[pd.DataFrame] = None,
+                        video_file_name: str = "cut_video.avi",
+                        excluded_sources: Iterable[str] = ()) -> pd.DataFrame:
+    """
+    Splits the videos of a videos bank (`root_dir/<video type>/<video folder>/cut_video.avi`) into train/val/test,
+    stratified by video type.
+
+    The split is reproducible: the same bank and `random_state` give the same manifest. It is also incremental: the
+    videos of `existing_manifest` keep their split, and only the videos that are new in the bank are shuffled and added,
+    to the splits that are below their ratio.
+
+    :param number_of_videos_per_category: Maximum number of videos of each type in the manifest (all of them if None)
+    :param excluded_sources: Videos to leave out of the new ones (like the quarantine of `scan_videos_bank`)
+    :return: The manifest - a row per video, with its 'video_type', 'split', 'name' (of the video in the dataset), and
+    'source' (its path, relative to `root_dir`)
+    """
+    if not np.isclose(sum(train_val_test_split), 1):
+        raise ValueError(f"split {train_val_test_split} is not right")
+    split_ratios = dict(zip(dataset_splits, train_val_test_split))
+    if existing_manifest is None:
+        existing_manifest = pd.DataFrame(columns=['video_type', 'split', 'name', 'source'])
+
+    root_dir = pathlib.Path(root_dir)
+    excluded_sources = set(excluded_sources)
+    manifest_parts = [existing_manifest]
+    for video_type in video_type_categories:
+        existing_videos = existing_manifest[existing_manifest['video_type'] == video_type]
+        known_sources = set(existing_videos['source'])
+        new_sources = sorted(path.relative_to(root_dir).as_posix()
+                             for path in root_dir.joinpath(video_type).glob(f"*/{video_file_name}"))
+        new_sources = [source for source in new_sources
+                       if source not in known_sources and source not in excluded_sources]
+        # Seeded per video type, so a type's split doesn't depend on the other types
+        rng = np.random.default_rng([random_state, zlib.crc32(video_type.encode())])
+        rng.shuffle(new_sources)
+        if number_of_videos_per_category is not None:
+            new_sources = new_sources[:max(number_of_videos_per_category - len(existing_videos.index), 0)]
+
+        split_counts = existing_videos['split'].value_counts().reindex(dataset_splits, fill_value=0).to_dict()
+        manifest_parts.append(pd.DataFrame({
+            'video_type': video_type,
+            'split': _assign_splits(split_counts, split_ratios, len(new_sources)),
+            'name': [pathlib.PurePosixPath(source).parent.name for source in new_sources],
+            'source': new_sources,
+        }))
+    manifest_parts = [part for part in manifest_parts if not part.empty]
+    if not manifest_parts:
+        return existing_manifest
+    return pd.concat(manifest_parts, ignore_index=True)
+
+
+def manifest_from_dataset_folder(dataset_path) -> pd.DataFrame:
+    """ :return: The manifest of an already organized dataset (`<split>/<video type>/<name>.avi`), with its own files
+    as sources """
+    dataset_path = pathlib.Path(dataset_path)
+    rows = [{'video_type': video_path.parent.name, 'split': split, 'name': video_path.stem,
+             'source': video_path.relative_to(dataset_path).as_posix()}
+            for split in dataset_splits
+            for video_path in sorted(dataset_path.joinpath(split).glob("*/*.avi"))]
+    return pd.DataFrame(rows, columns=['video_type', 'split', 'name', 'source'])
+
+
+def load_split_manifest(manifest_path) -> pd.DataFrame:
+    return pd.read_csv(manifest_path, dtype=str, keep_default_na=False)
+
+
+def _place_dataset_file(source: str, destination: str, link_mode: str) -> str:
+    if os.path.lexists(destination):
+        return 'existing'
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        if link_mode == 'hardlink':
+            os.link(source, destination)
+            return 'linked'
+        if link_mode == 'symlink':
+            os.symlink(os.path.abspath(source), destination)
+            return 'linked'
+    except OSError as e:
+        # Hard links can't cross filesystems (nor drives on Windows), so only then fall back to copying
+        if e.errno != errno.EXDEV:
+            raise
+    shutil.copy2(source, destination)
+    return 'copied'
+
+
+def materialize_split_manifest(manifest: pd.DataFrame, source_root, new_root_dir, link_mode: str = 'hardlink',
+                               num_workers: int = 16) -> Dict[str, int]:
+    """
+    Creates the dataset folders of a manifest (`new_root_dir/<split>/<video type>/<name>.avi`), by linking each video
+    to its source instead of copying it. Videos that are already in place are left alone, so re-running after adding
+    videos to the manifest only adds them.
+
+    :param source_root: The folder the manifest's sources are relative to
+    :param link_mode: 'hardlink', 'symlink' or 'copy'. Hard links are copied when they would cross filesystems.
+    :return: The number of videos 'linked', 'copied', and already 'existing'
+    """
+    if link_mode not in ('hardlink', 'symlink', 'copy'):
+        raise ValueError(f"Unknown link mode `{link_mode}`")
+    source_root = pathlib.Path(source_root)
+    new_root_dir = pathlib.Path(new_root_dir)
+    results = {'linked': 0, 'copied': 0, 'existing': 0}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(_place_dataset_file, str(source_root.joinpath(row.source)),
+                                   str(new_root_dir.joinpath(row.split, row.video_type, f"{row.name}.avi")),
+                                   link_mode)
+                   for row in manifest.itertuples(index=False)]
+        for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
+            results[future.result()] += 1
+    return results
+
+
+def organize_dataset_from_videos_folder(root_dir: str, new_root_dir: str, video_type_categories: Iterable[str],
+                                        number_of_videos_per_category: Optional[int] = None,
+                                        train_val_test_split: Tuple[float, float, float] = (0.8, 0.1, 0.1),
+                                        random_state: int = 0, link_mode: str = 'hardlink',
+                                        num_workers: int = 16, excluded_sources: Iterable[str] = ()) -> pd.DataFrame:
+    """
+    Splits a videos bank into a train/val/test dataset, with a manifest kept in `new_root_dir/manifest.csv`.
+    Re-running it on the same `new_root_dir` after harvesting more videos adds them, without moving the existing ones.
+    See `make_split_manifest` and `materialize_split_manifest`.
+
+    :return: The manifest
+    """
+    manifest_path = pathlib.Path(new_root_dir, 'manifest.csv')
+    existing_manifest = load_split_manifest(manifest_path) if manifest_path.exists() else None
+    manifest = make_split_manifest(root_dir, video_type_categories, number_of_videos_per_category,
+                                   train_val_test_split, random_state, existing_manifest,
+                                   excluded_sources=excluded_sources)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    manifest.to_csv(manifest_path, index=False)
+    results = materialize_split_manifest(manifest, root_dir, new_root_dir, link_mode, num_workers)
+    logger.info(f"Dataset organized in {new_root_dir}: {results}")
+    return manifest
+
+
+class HarvestStateStore(_ThreadLocalSQLite):
+    """
+    The state of a harvest, in an SQLite database in WAL mode: the games in the order they were first given, whether
+    each was fully walked, and every event picked for harvesting, with its status:
+    - 'pending': picked, not downloaded yet
+    - 'downloaded': downloaded, not cut yet
+    - 'cut': in the videos bank
+    - 'failed': the download or the cut failed (with the reason). Never retried.
+    - 'skipped': dropped before it was done (the harvest stopped). Picked again by the next harvest.
+
+    Every update is its own transaction, so a crash at any point leaves a consistent state to resume from.
+    """
+    statuses = ('pending', 'downloaded', 'cut', 'failed', 'skipped')
+    unfinished_statuses = ('pending', 'downloaded', 'skipped')
+    _schema = (
+        'CREATE TABLE IF NOT EXISTS games ('
+        'game_id TEXT PRIMARY KEY, position INTEGER NOT NULL, done INTEGER NOT NULL DEFAULT 0)',
+        'CREATE TABLE IF NOT EXISTS events ('
+        'game_id TEXT NOT NULL, event_id INTEGER NOT NULL, video_type TEXT NOT NULL, status TEXT NOT NULL, '
+        'reason TEXT, event_info TEXT, shot_time TEXT, updated REAL NOT NULL, PRIMARY KEY (game_id, event_id))',
+        'CREATE INDEX IF NOT EXISTS events_status ON events (status, video_type)',
+    )
+
+    def __init__(self, path: str):
+        self.path = str(path)
+
+    def is_empty(self) -> bool:
+        return self._connection.execute('SELECT NOT EXISTS (SELECT 1 FROM games) AND '
+                                        'NOT EXISTS (SELECT 1 FROM events)').fetchone()[0] == 1
+
+    def add_games(self, game_ids: Iterable[str]):
+        """ Adds the new games after the known ones. The known games keep their place. """
+        with self._transaction() as connection:
+            position = connection.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM games').fetchone()[0]
+            connection.executemany('INSERT OR IGNORE INTO games (game_id, position) VALUES (?, ?)',
+                                   ((str(game_id), position + i) for i, game_id in enumerate(game_ids)))
+
+    def pending_games(self, game_ids: Optional[Iterable[str]] = None) -> List[str]:
+        """ :return: The games that weren't fully walked (out of `game_ids`, if given), in the order they were added """
+        pending = [row[0] for row in self._connection.execute('SELECT game_id FROM games WHERE NOT done '
+                                                              'ORDER BY position')]
+        if game_ids is None:
+            return pending
+        game_ids = {str(game_id) for game_id in game_ids}
+        return [game_id for game_id in pending if game_id in game_ids]
+
+    def mark_game_done(self, game_id: str):
+        self._connection.execute('UPDATE games SET done = 1 WHERE game_id = ?', (str(game_id),))
+
+    def event_status(self, game_id: str, event_id: int) -> Optional[str]:
+        row = self._connection.execute('SELECT status FROM events WHERE game_id = ? AND event_id = ?',
+                                       (str(game_id), int(event_id))).fetchone()
+        return row[0] if row else None
+
+    def set_event_status(self, game_id: str, event_id: int, status: str, video_type: Optional[str] = None,
+                         reason: Optional[str] = None, event_info: Optional[Dict] = None,
+                         shot_time: Optional[str] = None):
+        """ Records an event (with all its details), or updates the status of a recorded one (without `video_type`) """
+        if status not in self.statuses:
+            raise ValueError(f"Unknown status `{status}`. Options are {list(self.statuses)}")
+        event_info = json.dumps(event_info) if event_info is not None else None
+        if video_type is None:
+            cursor = self._connection.execute(
+                'UPDATE events SET status = ?, reason = ?, event_info = COALESCE(?, event_info), '
+                'shot_time = COALESCE(?, shot_time), updated = ? WHERE game_id = ? AND event_id = ?',
+                (status, reason, event_info, shot_time, time.time(), str(game_id), int(event_id)))
+            if cursor.rowcount == 0:
+                raise ValueError(f"Event {event_id} of game {game_id} isn't recorded, so it needs a video type")
+            return
+        self._connection.execute(
+            'INSERT OR REPLACE INTO events (game_id, event_id, video_type, status, reason, event_info, shot_time, '
+            'updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (str(game_id), int(event_id), video_type, status, reason, event_info, shot_time, time.time()))
+
+    def unfinished_events(self) -> List[Dict]:
+        """ :return: The events that were picked but not finished, oldest first, with their event info """
+        rows = self._connection.execute(
+            f"SELECT game_id, event_id, video_type, status, event_info, shot_time FROM events "
+            f"WHERE status IN ({', '.join('?' * len(self.unfinished_statuses))}) AND event_info IS NOT NULL "
+            f"ORDER BY updated", self.unfinished_statuses)
+        return [{'game_id': game_id, 'event_id': event_id, 'video_type': video_type, 'status': status,
+                 'event_info': json.loads(event_info), 'shot_time': shot_time}
+                for game_id, event_id, video_type, status, event_info, shot_time in rows]
+
+    def class_counts(self, status: str = 'cut') -> Dict[str, int]:
+        """ :return: The number of events of each video type with the status """
+        return dict(self._connection.execute('SELECT video_type, COUNT(*) FROM events WHERE status = ? '
+                                             'GROUP BY video_type', (status,)).fetchall())
+
+    def game_class_counts(self, statuses: Iterable[str] = ('cut',)) -> Dict[Tuple[str, str], int]:
+        """ :return: The number of events of each (game, video type) with one of the statuses """
+        statuses = tuple(statuses)
+        rows = self._connection.execute(f"SELECT game_id, video_type, COUNT(*) FROM events "
+                                        f"WHERE status IN ({', '.join('?' * len(statuses))}) "
+                                        f"GROUP BY game_id, video_type", statuses)
+        return {(game_id, video_type): count for game_id, video_type, count in rows}
+
+    def status_counts(self) -> pd.DataFrame:
+        """ :return: The number of events of each video type (rows) in each status (columns) """
+        df = pd.read_sql_query('SELECT video_type, status, COUNT(*) AS count FROM events GROUP BY video_type, status',
+                               self._connection)
+        return df.pivot(index='video_type', columns='status', values='count').reindex(
+            columns=list(self.statuses)).fillna(0).astype(int)
+
+    def failed_events(self) -> pd.DataFrame:
+        return pd.read_sql_query("SELECT game_id, event_id, video_type, reason, updated FROM events "
+                                 "WHERE status = 'failed' ORDER BY updated", self._connection)
+
+    def import_videos_bank(self, videos_directory, video_types: Iterable[str]) -> int:
+        """
+        Records the videos of a videos bank harvested before there was a state store as cut (their folders are named
+        `<game id>_<event id>`)
+
+        :return: The number of videos recorded
+        """
+        now = time.time()
+        rows = []
+        for video_type in video_types:
+            class_directory = pathlib.Path(videos_directory, video_type)
+            if not class_directory.exists():
+                continue
+            for entry in os.scandir(class_directory):
+                game_id, _, event_id = entry.name.rpartition('_')
+                if entry.is_dir() and game_id and event_id.isdigit():
+                    rows.append((game_id, int(event_id), video_type, 'cut', now))
+        with self._transaction() as connection:
+            connection.executemany('INSERT OR IGNORE INTO events (game_id, event_id, video_type, status, updated) '
+                                   'VALUES (?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+
+@dataclass
+class _HarvestJob:
+    game_id: str
+    event_id: int
+    video_description: str
+    video_directory: pathlib.Path
+    event_info: Dict
+    shot_time: str
+    # Resumed from the state store, with the video already downloaded
+    is_downloaded: bool = False
+
+
+class _HarvestQuota:
+    """ Per class (and per class in a game) counts of harvested videos, plus the ones still in the pipeline """
+
+    def __init__(self, video_type_histogram: Dict[str, int], number_of_desired_plays_per_type: int,
+                 max_number_of_class_videos_from_same_game: int,
+                 game_counts: Optional[Dict[Tuple[str, str], int]] = None):
+        """ :param game_counts: (game id, video type) to the number of videos of it already harvested """
+        self._lock = threading.Lock()
+        self.done = dict(video_type_histogram)
+        self.in_flight = {k: 0 for k in video_type_histogram}
+        self._game_counts = defaultdict(int, game_counts or {})
+        self.number_of_desired_plays_per_type = number_of_desired_plays_per_type
+        self.max_number_of_class_videos_from_same_game = max_number_of_class_videos_from_same_game
+
+    def is_game_full(self, game_id: str, video_description: str) -> bool:
+        with self._lock:
+            return self._game_counts[(game_id, video_description)] >= self.max_number_of_class_videos_from_same_game
+
+    def is_class_full(self, video_description: str) -> bool:
+        with self._lock:
+            return (self.done[video_description] + self.in_flight[video_description] >=
+                    self.number_of_desired_plays_per_type)
+
+    def try_reserve(self, game_id: str, video_description: str) -> bool:
+        """ Reserves a place for a video, so videos still being downloaded or cut count against the limits """
+        with self._lock:
+            key = (game_id, video_description)
+            if self._game_counts[key] >= self.max_number_of_class_videos_from_same_game:
+                return False
+            if (self.done[video_description] + self.in_flight[video_description] >=
+                    self.number_of_desired_plays_per_type):
+                return False
+            self._game_counts[key] += 1
+            self.in_flight[video_description] += 1
+            return True
+
+    def commit(self, job: _HarvestJob):
+        with self._lock:
+            self.in_flight[job.video_description] -= 1
+            self.done[job.video_description] += 1
+
+    def release(self, job: _HarvestJob):
+        with self._lock:
+            self.in_flight[job.video_description] -= 1
+            self._game_counts[(job.game_id, job.video_description)] -= 1
+
+    def is_full(self) -> bool:
+        with self._lock:
+            return all(value >= self.number_of_desired_plays_per_type for value in self.done.values())
+
+
+_pipeline_sentinel = object()
+
+
+class VideosBankHarvester:
+    """
+    Fills a videos bank with cut shot videos, in a pipeline:
+    NBA API (a single thread, to keep the rate limit) -> download (a thread pool) -> cut (a process pool).
+    The stages are connected with bounded queues, so no stage runs too far ahead of the others.
+
+    The per class limits are enforced exactly: a video counts against them from the moment it is picked until its cut
+    fails (and then its place is given back).
+
+    The progress is kept in a `HarvestStateStore`, so a stopped (or crashed) harvest resumes where it was: the events
+    it left unfinished first, then the games it didn't walk yet, in the order they were first given. Events that
+    failed are never tried again.
+
+    With `harvest_metrics` enabled, the stages of every event are timed (see `HarvestMetrics`). Give it a
+    `jsonl_path`, so the cut processes write their records too.
+    """
+
+    def __init__(self, videos_directory, video_type_categories: Iterable[str],
+                 number_of_desired_plays_per_type: int, max_number_of_class_videos_from_same_game: int = 1,
+                 offset_seconds_before: int = 4, offset_seconds_after: int = 1,
+                 new_resolution: Optional[Tuple[int, int]] = (320, 256), new_fps: Optional[int] = 30,
+                 download_workers: int = 4, cut_workers: Optional[int] = None, queue_size: int = 8,
+                 use_processes: bool = True, random_state: Optional[int] = None,
+                 cut_video_kwargs: Optional[Dict] = None, fetch_mode: str = 'download',
+                 state_path: Optional[str] = None,
+                 get_pbp_data_function: Callable = None, get_video_event_info_function: Callable = None,
+                 download_video_function: Callable = None, cut_video_function: Callable = None):
+        """
+        :param videos_directory: Root of the videos bank. Each video goes to `<shot type>/<game id>_<event id>/`
+        :param video_type_categories: The shot types to harvest
+        :param number_of_desired_plays_per_type: How many videos to have for each shot type
+        :param max_number_of_class_videos_from_same_game: How many videos of the same shot type to take from a game
+        :param download_workers: Number of download threads
+        :param cut_workers: Number of cut processes. Defaults to the number of cores.
+        :param queue_size: Size of the queues between the stages
+        :param use_processes: Cut in a process pool (or in a thread pool, if False)
+        :param random_state: Seed for the order of events in a game
+        :param cut_video_kwargs: Extra arguments for `cut_video` (like `search_mode`). Must be picklable.
+        :param fetch_mode: 'download' downloads each whole video before cutting it. 'segment' cuts straight from the
+        video url, fetching only the needed part of the video (see `cut_video_from_url`), and the download stage only
+        saves the event info.
+        :param state_path: The `HarvestStateStore` database. Defaults to `<videos_directory>.harvest.sqlite`, next to
+        the videos bank (so the bank itself only has videos in it).
+        :param get_pbp_data_function: Replaces `get_pbp_data` (for tests)
+        :param get_video_event_info_function: Replaces `get_video_event_info` (for tests)
+        :param download_video_function: Replaces `download_video` (for tests)
+        :param cut_video_function: Replaces `cut_video`. Must be picklable.
+        """
+        self.videos_directory = pathlib.Path(videos_directory)
+        self.video_type_categories = list(video_type_categories)
+        self.number_of_desired_plays_per_type = number_of_desired_plays_per_type
+        self.max_number_of_class_videos_from_same_game = max_number_of_class_videos_from_same_game
+        self.offset_seconds_before = offset_seconds_before
+        self.offset_seconds_after = offset_seconds_after
+        self.new_resolution = new_resolution
+        self.new_fps = new_fps
+        self.download_workers = download_workers
+        self.cut_workers = cut_workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.use_processes = use_processes
+        self.random_state = random_state
+        self.cut_video_kwargs = cut_video_kwargs or {}
+        if fetch_mode not in ('download', 'segment'):
+            raise ValueError(f"Unknown fetch mode `{fetch_mode}`")
+        self.fetch_mode = fetch_mode
+        self.state = HarvestStateStore(state_path or self.videos_directory.with_name(
+            f"{self.videos_directory.name}.harvest.sqlite"))
+        self.get_pbp_data = get_pbp_data_function or get_pbp_data
+        self.get_video_event_info = get_video_event_info_function or get_video_event_info
+        self.download_video = download_video_function or download_video
+        self.cut_video = cut_video_function or (cut_video_from_url if fetch_mode == 'segment' else cut_video)
+        self.failed_videos = []
+        self._errors = []
+
+    def _existing_video_type_histogram(self) -> Dict[str, int]:
+        if self.state.is_empty() and self.videos_directory.exists():
+            # A videos bank from before the state store
+            self.state.import_videos_bank(self.videos_directory, self.video_type_categories)
+        counts = self.state.class_counts('cut')
+        return {video_description: counts.get(video_description, 0) for video_description in self.video_type_categories}
+
+    def _put(self, q: queue.Queue, item, stop_event: threading.Event) -> bool:
+        """ Blocking put, that gives up if the pipeline is stopped """
+        while not stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _resume_jobs(self, quota: _HarvestQuota, download_queue: queue.Queue, stop_event: threading.Event) -> bool:
+        """ Puts the unfinished events of the previous harvests back in the pipeline. :return: False if stopped """
+        for event in self.state.unfinished_events():
+            if stop_event.is_set():
+                return False
+            video_description = event['video_type']
+            if video_description not in quota.done or not quota.try_reserve(event['game_id'], video_description):
+                continue
+            video_directory = self.videos_directory.joinpath(video_description,
+                                                             f"{event['game_id']}_{event['event_id']}")
+            job = _HarvestJob(game_id=event['game_id'], event_id=event['event_id'],
+                              video_description=video_description, video_directory=video_directory,
+                              event_info=event['event_info'], shot_time=event['shot_time'],
+                              is_downloaded=event['status'] == 'downloaded' and (
+                                  self.fetch_mode == 'segment' or video_directory.joinpath('video.mp4').exists()))
+            if not self._put(download_queue, job, stop_event):
+                quota.release(job)
+                return False
+        return True
+
+    def _produce_jobs(self, game_ids: Iterable[str], quota: _HarvestQuota, download_queue: queue.Queue,
+                      stop_event: threading.Event):
+        """ The NBA API stage. Runs on a single thread, so the API calls stay sequential """
+        try:
+            if not self._resume_jobs(quota, download_queue, stop_event):
+                return
+            for game_id in self.state.pending_games(game_ids):
+                if stop_event.is_set():
+                    return
+                df = get_shots_event_data_from_game_df(self.get_pbp_data(game_id=game_id))
+                if len(df.index) == 0:
+                    logger.info(f"Game {game_id} doesn't have video records of shots...")
+                    self.state.mark_game_done(game_id)
+                    continue
+
+                for _, shot_event_data in df.sample(frac=1, random_state=self.random_state).iterrows():
+                    if stop_event.is_set():
+                        return
+                    event_id, event_action_id, period, play_clock_time, description, event_msg_type, \
+                        video_available_flag = shot_event_data
+                    video_description = get_shot_type_name(event_action_id)
+                    if video_description not in quota.done or not video_available_flag:
+                        continue
+                    if quota.is_game_full(game_id, video_description) or quota.is_class_full(video_description):
+                        continue
+
+                    if self.state.event_status(game_id, event_id) is not None:
+                        # Harvested, failed, or resumed already
+                        continue
+                    if not quota.try_reserve(game_id, video_description):
+                        continue
+
+                    video_directory = self.videos_directory.joinpath(video_description, f"{game_id}_{event_id}")
+                    with harvest_metrics.event(f"{game_id}_{event_id}"):
+                        video_event_info = self.get_video_event_info(game_id=game_id, game_event_id=str(event_id))
+                    if video_event_info['desc'] != description:
+                        reason = f"{video_event_info['desc']} is different that {description}"
+                        self.state.set_event_status(game_id, event_id, 'failed', video_description, reason)
+                        raise ValueError(reason)
+                    event_info = {
+                        'game_id': game_id, 'event_id': event_id, 'time': play_clock_time,
+                        'event_msg_type': event_msg_type,
+                        'event_action_id': event_action_id,
+                        'event_msg_action': get_event_msg_action(description)
+                    }
+                    event_info.update(video_event_info)
+                    job = _HarvestJob(game_id=game_id, event_id=event_id, video_description=video_description,
+                                      video_directory=video_directory, event_info=event_info,
+                                      shot_time=add_seconds_to_time(play_clock_time))
+                    self.state.set_event_status(game_id, event_id, 'pending', video_description,
+                                                event_info=event_info, shot_time=job.shot_time)
+                    if not self._put(download_queue, job, stop_event):
+                        quota.release(job)
+                        self.state.set_event_status(game_id, event_id, 'skipped', reason="stopped")
+                        return
+                self.state.mark_game_done(game_id)
+        except Exception as e:
+            self._errors.append(e)
+            stop_event.set()
+        finally:
+            for _ in range(self.download_workers):
+                download_queue.put(_pipeline_sentinel)
+
+    def _download_jobs(self, download_queue: queue.Queue, cut_queue: queue.Queue, result_queue: queue.Queue,
+                       stop_event: threading.Event):
+        """ The download stage. Several of these run on threads """
+        try:
+            while True:
+                job = download_queue.get()
+                if job is _pipeline_sentinel:
+                    return
+                if stop_event.is_set():
+                    result_queue.put((job, False, "stopped"))
+                    continue
+                try:
+                    if not job.is_downloaded:
+                        if job.video_directory.exists():
+                            # Left by a harvest that stopped in the middle of this job
+                            shutil.rmtree(job.video_directory)
+                        job.video_directory.mkdir(parents=True)
+                        if self.fetch_mode == 'segment':
+                            save_event_info(job.event_info, job.video_directory.joinpath('info.json'))
+                        else:
+                            with harvest_metrics.event(f"{job.game_id}_{job.event_id}"):
+                                self.download_video(job.event_info, job.video_directory.joinpath('info.json'),
+                                                    job.video_directory.joinpath('video.mp4'))
+                        self.state.set_event_status(job.game_id, job.event_id, 'downloaded')
+                except Exception as e:
+                    logger.exception(f"Failed downloading {job.video_directory}")
+                    result_queue.put((job, False, f"download failed: {e!r}"))
+                    continue
+                if not self._put(cut_queue, job, stop_event):
+                    result_queue.put((job, False, "stopped"))
+        finally:
+            cut_queue.put(_pipeline_sentinel)
+
+    def _dispatch_cuts(self, cut_queue: queue.Queue, result_queue: queue.Queue, stop_event: threading.Event):
+        """ The cut stage. Feeds the cut pool, keeping at most two jobs per worker in it """
+        executor_class = concurrent.futures.ProcessPoolExecutor if self.use_processes \
+            else concurrent.futures.ThreadPoolExecutor
+        slots = threading.Semaphore(2 * self.cut_workers)
+        finished_download_workers = 0
+        futures = []
+
+        def on_done(future, job):
+            slots.release()
+            try:
+                result_queue.put((job, future.result(), "cut failed"))
+            except Exception as e:
+                result_queue.put((job, False, f"cut failed: {e!r}"))
+
+        job = None
+        try:
+            with executor_class(max_workers=self.cut_workers) as executor:
+                while finished_download_workers < self.download_workers:
+                    job = cut_queue.get()
+                    if job is _pipeline_sentinel:
+                        finished_download_workers += 1
+                        job = None
+                        continue
+                    if stop_event.is_set():
+                        result_queue.put((job, False, "stopped"))
+                        job = None
+                        continue
+                    slots.acquire()
+                    video_path = job.event_info['video_url'] if self.fetch_mode == 'segment' \
+                        else job.video_directory.joinpath('video.mp4').as_posix()
+                    cut_kwargs = dict(
+                        video_path=video_path,
+                        shot_time=job.shot_time,
+                        offset_seconds_before=self.offset_seconds_before,
+                        offset_seconds_after=self.offset_seconds_after,
+                        output_path=job.video_directory.joinpath('cut_video.avi').as_posix(),
+                        new_resolution=self.new_resolution,
+                        new_fps=self.new_fps,
+                        **self.cut_video_kwargs
+                    )
+                    metrics_path = harvest_metrics.jsonl_path if harvest_metrics.enabled else None
+                    future = executor.submit(_cut_and_validate, self.cut_video, cut_kwargs, metrics_path,
+                                             f"{job.game_id}_{job.event_id}")
+                    future.add_done_callback(functools.partial(on_done, job=job))
+                    futures.append(future)
+                    job = None
+                concurrent.futures.wait(futures)
+        except Exception as e:
+            self._errors.append(e)
+            stop_event.set()
+            # Keeps draining the cut queue, or the download threads block on it forever
+            if job is not None:
+                result_queue.put((job, False, "stopped"))
+            while finished_download_workers < self.download_workers:
+                job = cut_queue.get()
+                if job is _pipeline_sentinel:
+                    finished_download_workers += 1
+                else:
+                    result_queue.put((job, False, "stopped"))
+        finally:
+            result_queue.put(_pipeline_sentinel)
+
+    def run(self, game_ids: Iterable[str]) -> Dict[str, int]:
+        """
+        Harvests videos from the games, in the given order, until there are enough videos of each type.
+
+        :return: The number of videos of each shot type in the videos bank
+        """
+        quota = _HarvestQuota(self._existing_video_type_histogram(), self.number_of_desired_plays_per_type,
+                              self.max_number_of_class_videos_from_same_game, self.state.game_class_counts())
+        game_ids = [str(game_id) for game_id in game_ids]
+        self.state.add_games(game_ids)
+        download_queue = queue.Queue(maxsize=self.queue_size)
+        cut_queue = queue.Queue(maxsize=self.queue_size)
+        result_queue = queue.Queue()
+        stop_event = threading.Event()
+        self.failed_videos = []
+        self._errors = []
+
+        threads = [threading.Thread(target=self._produce_jobs, args=(game_ids, quota, download_queue, stop_event),
+                                    name='harvester-api', daemon=True),
+                   threading.Thread(target=self._dispatch_cuts, args=(cut_queue, result_queue, stop_event),
+                                    name='harvester-cut', daemon=True)]
+        threads += [threading.Thread(target=self._download_jobs,
+                                     args=(download_queue, cut_queue, result_queue, stop_event),
+                                     name=f'harvester-download-{i}', daemon=True)
+                    for i in range(self.download_workers)]
+        for thread in threads:
+            thread.start()
+
+        # The validation stage. Runs here, so only this thread touches the finished videos
+        try:
+            while True:
+                result = result_queue.get()
+                if result is _pipeline_sentinel:
+                    break
+                job, is_recording_successful, failure_reason = result
+                if is_recording_successful:
+                    job.video_directory.joinpath('video.mp4').unlink(missing_ok=True)
+                    self.state.set_event_status(job.game_id, job.event_id, 'cut')
+                    quota.commit(job)
+                    logger.info(f"Harvested {job.video_directory}")
+                    if quota.is_full():
+                        logger.info("Got all the videos we need")
+                        stop_event.set()
+                else:
+                    if job.video_directory.exists():
+                        shutil.rmtree(job.video_directory)
+                    quota.release(job)
+                    if failure_reason == "stopped":
+                        # Not the event's fault, so the next harvest picks it up again
+                        self.state.set_event_status(job.game_id, job.event_id, 'skipped', reason=failure_reason)
+                    else:
+                        self.state.set_event_status(job.game_id, job.event_id, 'failed', reason=failure_reason)
+                        self.failed_videos.append((job.video_directory.as_posix(), failure_reason))
+        finally:
+            stop_event.set()
+            for thread in threads:
+                thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+        if harvest_metrics.enabled:
+            logger.info(f"Harvest metrics:\n{harvest_metrics.summary().round(3).to_string()}")
+        return quota.done
+
+
+class VideoProbeCache(_ThreadLocalSQLite):
+    """
+    Video probes (`probe_video`) in an SQLite database, by the video's path relative to the videos bank (its 'source',
+    like in `make_split_manifest`), so the bank can be moved. A probe is valid while its file keeps the same
+    modification time and size.
+    """
+    _schema = (
+        'CREATE TABLE IF NOT EXISTS probes (source TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL, '
+        'full_decode INTEGER NOT NULL, frames INTEGER NOT NULL, fps REAL NOT NULL, width INTEGER NOT NULL, '
+        'height INTEGER NOT NULL, seconds REAL NOT NULL, decodes INTEGER NOT NULL)',
+    )
+
+    def __init__(self, path: str):
+        self.path = str(path)
+
+    def load(self) -> Dict[str, Dict]:
+        """ :return: Video source to its probe, with the 'mtime_ns' and 'size' of the file when it was probed """
+        cursor = self._connection.execute('SELECT * FROM probes')
+        columns = [column[0] for column in cursor.description]
+        probes = {row[0]: dict(zip(columns, row)) for row in cursor}
+        for probe in probes.values():
+            probe['decodes'] = bool(probe['decodes'])
+        return probes
+
+    def save(self, probes: List[Dict]):
+        """ :param probes: Probes, each with its video 'source', and the 'mtime_ns', 'size' and 'full_decode' it was
+        probed with """
+        with self._transaction() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO probes (source, mtime_ns, size, full_decode, frames, fps, width, height, '
+                'seconds, decodes) VALUES (:source, :mtime_ns, :size, :full_decode, :frames, :fps, :width, :height, '
+                ':seconds, :decodes)', probes)
+
+    def forget(self, sources: Iterable[str]):
+        with self._transaction() as connection:
+            connection.executemany('DELETE FROM probes WHERE source = ?', ((source,) for source in sources))
+
+
+def _walk_videos_bank(videos_directory, video_types: Optional[Iterable[str]] = None,
+                      video_file_name: str = "cut_video.avi"):
+    """
+    Yields the (video type, event folder, the `os.stat_result` of its video) of every (non empty) event folder in a
+    videos bank, with None for the stat if the folder has no video
+    """
+    if video_types is None:
+        with os.scandir(videos_directory) as entries:
+            video_types = sorted(entry.name for entry in entries if entry.is_dir())
+    for video_type in video_types:
+        class_directory = os.path.join(videos_directory, video_type)
+        if not os.path.isdir(class_directory):
+            continue
+        with os.scandir(class_directory) as entries:
+            event_folders = sorted(entry.path for entry in entries if entry.is_dir())
+        for event_folder in event_folders:
+            try:
+                video_stat = os.stat(os.path.join(event_folder, video_file_name))
+            except FileNotFoundError:
+                with os.scandir(event_folder) as entries:
+                    if next(entries, None) is None:
+                        # Nothing was harvested into it
+                        continue
+                video_stat = None
+            yield video_type, event_folder, video_stat
+
+
+def _video_issues(probe: Dict, expected_resolution: Optional[Tuple[int, int]], expected_fps: Optional[float],
+                  min_seconds: float) -> List[str]:
+    if not probe['frames']:
+        return ['no_frames']
+    issues = []
+    if not probe['decodes']:
+        issues.append('undecodable')
+    if expected_resolution is not None and (probe['width'], probe['height']) != tuple(expected_resolution):
+        issues.append('resolution')
+    if expected_fps is not None and abs(probe['fps'] - expected_fps) > 0.5:
+        issues.append('fps')
+    if probe['seconds'] < min_seconds:
+        issues.append('too_short')
+    return issues
+
+
+def scan_videos_bank(videos_directory, video_types: Optional[Iterable[str]] = None, cache_path: Optional[str] = None,
+                     expected_resolution: Optional[Tuple[int, int]] = (320, 256), expected_fps: Optional[float] = 30,
+                     min_seconds: float = 3, full_decode: bool = False, num_workers: Optional[int] = None,
+                     quarantine_path: Optional[str] = None, video_file_name: str = "cut_video.avi") -> pd.DataFrame:
+    """
+    Checks every video of a videos bank, so broken ones don't get into a dataset: probes its container header and
+    whether it decodes (see `probe_video`), in parallel. Probes are cached by path, modification time and size, so a
+    re-scan only probes the new and changed videos.
+
+    Issues are 'missing' (an event folder without a video), 'no_frames', 'undecodable', 'resolution', 'fps' and
+    'too_short'. Pass the quarantine (the 'source' of every video with issues) to `organize_dataset_from_videos_folder`,
+    to leave them out.
+
+    :param video_types: Folders of the bank to scan (all of them if None)
+    :param cache_path: The probes' database. Defaults to `<videos_directory>.scan.sqlite`, next to the bank.
+    :param expected_resolution: The (width, height) of `VideosBankHarvester.new_resolution` (None to not check it)
+    :param expected_fps: `VideosBankHarvester.new_fps` (None to not check it)
+    :param min_seconds: Shortest valid video. `cut_video` doesn't write cuts under 3 seconds.
+    :param full_decode: Decode every frame, instead of the first and last ones (slower, and catches corruption in
+    the middle)
+    :param num_workers: Probing threads. Defaults to the number of cores.
+    :param quarantine_path: Also writes the quarantine to this file, a source per line
+    :return: The report: a row per event folder, with its 'video_type', 'source' (relative to the bank, like in
+    `make_split_manifest`), its probe, and its 'issues' (comma separated, empty if it's fine)
+    """
+    videos_directory = pathlib.Path(videos_directory)
+    cache = VideoProbeCache(cache_path or videos_directory.with_name(f"{videos_directory.name}.scan.sqlite"))
+    cached_probes = cache.load()
+    rows, videos_to_probe = [], []
+    for video_type, event_folder, video_stat in _walk_videos_bank(videos_directory, video_types, video_file_name):
+        row = {'video_type': video_type, 'source': f"{video_type}/{os.path.basename(event_folder)}/{video_file_name}",
+               'path': os.path.join(event_folder, video_file_name)}
+        rows.append(row)
+        if video_stat is None:
+            continue
+        row.update(mtime_ns=video_stat.st_mtime_ns, size=video_stat.st_size)
+        cached_probe = cached_probes.get(row['source'])
+        if cached_probe is not None and cached_probe['mtime_ns'] == video_stat.st_mtime_ns and \
+                cached_probe['size'] == video_stat.st_size and cached_probe['full_decode'] >= full_decode:
+            row['probe'] = cached_probe
+        else:
+            videos_to_probe.append(row)
+
+    if videos_to_probe:
+        logger.info(f"Probing {len(videos_to_probe)} of {len(rows)} videos")
+        new_probes = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers or os.cpu_count() or 1) as executor:
+            futures = {executor.submit(probe_video, row['path'], full_decode): row for row in videos_to_probe}
+            for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
+                row = futures[future]
+                row['probe'] = {'source': row['source'], 'mtime_ns': row['mtime_ns'], 'size': row['size'],
+                                'full_decode': full_decode, **future.result()}
+                new_probes.append(row['probe'])
+                if len(new_probes) >= 1000:
+                    cache.save(new_probes)
+                    new_probes = []
+        cache.save(new_probes)
+    # Videos that were deleted since the last scan
+    scanned_sources = {row['source'] for row in rows}
+    scanned_video_types = {row['video_type'] for row in rows}
+    cache.forget(source for source in cached_probes if source not in scanned_sources and
+                 source.split('/')[0] in scanned_video_types)
+
+    probe_columns = ['frames', 'fps', 'width', 'height', 'seconds', 'decodes']
+    report = pd.DataFrame([
+        {'video_type': row['video_type'], 'source': row['source'],
+         **({column: row['probe'][column] for column in probe_columns} if 'probe' in row else {}),
+         'issues': ','.join(_video_issues(row['probe'], expected_resolution, expected_fps, min_seconds)
+                            if 'probe' in row else ['missing'])}
+        for row in rows], columns=['video_type', 'source'] + probe_columns + ['issues'])
+    report['decodes'] = report['decodes'].astype('boolean')
+    if quarantine_path is not None:
+        pathlib.Path(quarantine_path).write_text(''.join(f"{source}\n" for source in
+                                                         report.loc[report['issues'] != '', 'source']))
+    return report
+
+
+def find_defected_video_folders(root_folder):
+    """ :return: The event folders without a video. See `scan_videos_bank`, that also checks the videos. """
+    return [event_folder for _, event_folder, video_stat in _walk_videos_bank(root_folder) if video_stat is None]
+
+
+def _yield_without_desktop_ini(path_iterator):
+    for item in path_iterator:
+        if item.name == 'desktop.ini':
+            continue
+        else:
+            yield item
+
+
+def create_tiny_dataset(original_dataset_path: pathlib.Path, train_video_num: int = 8, test_video_num: int = 1,
+                        random_state: int = 0, link_mode: str = 'hardlink') -> pd.DataFrame:
+    """
+    Creates `<dataset>_tiny` next to the dataset, with `train_video_num` videos of each type in train, and
+    `test_video_num` in the other splits, linked to the dataset's videos.
+
+    :return: The tiny dataset's manifest (a subset of the dataset's one)
+    """
+    # Get the original basename without the extension
+    basename = original_dataset_path.stem
+    # Get the original extension (suffix)
+    extension = original_dataset_path.suffix
+    # Create the new basename with "tiny" added
+    new_basename = f"{basename}_tiny{extension}"
+    # Create the new Path with the updated basename
+    tiny_dataset_path = original_dataset_path.with_name(new_basename)
+
+    # The dataset's own files are the sources, whatever videos bank it was made from
+    manifest = manifest_from_dataset_folder(original_dataset_path)
+    manifest = manifest.sample(frac=1, random_state=random_state)
+    video_num = np.where(manifest['split'] == 'train', train_video_num, test_video_num)
+    tiny_manifest = manifest[manifest.groupby(['split', 'video_type']).cumcount().to_numpy() < video_num]
+    tiny_manifest = tiny_manifest.sort_values(['split', 'video_type', 'name']).reset_index(drop=True)
+
+    tiny_dataset_path.mkdir(parents=True, exist_ok=True)
+    tiny_manifest.to_csv(tiny_dataset_path.joinpath('manifest.csv'), index=False)
+    materialize_split_manifest(tiny_manifest, original_dataset_path, tiny_dataset_path, link_mode)
+    return tiny_manifest
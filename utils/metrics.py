@@ -0,0 +1,238 @@
+"""
+Per stage timing and counters of a harvest (see `HarvestMetrics`), and their summaries
+"""
+import contextvars
+import functools
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # Imported by the summaries, so recording doesn't need it
+    import pandas as pd
+
+
+class _NullStage:
+    """ What `HarvestMetrics.stage` returns when the metrics are disabled: a context manager that does nothing """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def add(self, name: str, value: float = 1):
+        pass
+
+
+_null_stage = _NullStage()
+# The innermost open stage, and the event being worked on. Context variables, so they follow both threads and asyncio
+# tasks.
+_current_stage = contextvars.ContextVar('current_stage', default=None)
+_current_event = contextvars.ContextVar('current_event', default=None)
+
+
+class _Stage:
+    __slots__ = ('metrics', 'name', 'event', 'counters', '_wall_start', '_cpu_start', '_token')
+
+    def __init__(self, metrics: 'HarvestMetrics', name: str):
+        self.metrics = metrics
+        self.name = name
+        self.counters = defaultdict(float)
+
+    def __enter__(self):
+        self.event = _current_event.get()
+        self._token = _current_stage.set(self)
+        self._cpu_start = time.thread_time()
+        self._wall_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_seconds = time.perf_counter() - self._wall_start
+        cpu_seconds = time.thread_time() - self._cpu_start
+        _current_stage.reset(self._token)
+        self.metrics._record({'time': time.time(), 'pid': os.getpid(), 'stage': self.name, 'event': self.event,
+                              'wall_seconds': wall_seconds, 'cpu_seconds': cpu_seconds,
+                              'error': exc_type.__name__ if exc_type is not None else None,
+                              'counters': dict(self.counters)})
+        return False
+
+    def add(self, name: str, value: float = 1):
+        self.counters[name] += value
+
+
+class HarvestMetrics:
+    """
+    Per stage timing and counters, for finding where the time of a harvest goes.
+
+    A stage (`with harvest_metrics.stage('download_video'):`, or the `timed` decorator) records its wall time and CPU
+    time (of its thread), and the counters added while it's the innermost open stage: OCR calls, bytes, retries,
+    rate limiter wait... (`count`). Stages started inside `with harvest_metrics.event(...)` are labelled with that
+    event. Each finished stage is a record, appended to `jsonl_path`, which the processes of a harvest can share, or
+    kept in `records` without one (so a long harvest writing to a file doesn't grow in memory).
+
+    Disabled (the default), `stage` and `event` return a shared do-nothing context manager, and `count` returns right
+    away, so the instrumentation costs a method call.
+    """
+
+    def __init__(self, enabled: bool = False, jsonl_path: Optional[str] = None):
+        self.enabled = False
+        self.jsonl_path = None
+        self.records = []
+        self.unattributed_counters = defaultdict(float)
+        self._lock = threading.Lock()
+        if enabled:
+            self.enable(jsonl_path)
+
+    def enable(self, jsonl_path: Optional[str] = None):
+        """ :param jsonl_path: Where to append the records, as JSON lines """
+        self.jsonl_path = jsonl_path
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        """ Forgets the records and counters kept in memory (the JSON-lines file is left as is) """
+        with self._lock:
+            self.records = []
+            self.unattributed_counters = defaultdict(float)
+
+    def stage(self, name: str):
+        """ :return: A context manager timing the block. Its `add(name, value)` adds to a counter of the stage. """
+        if not self.enabled:
+            return _null_stage
+        return _Stage(self, name)
+
+    def timed(self, name: str):
+        """ A decorator timing every call of the function as a stage """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with _Stage(self, name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def _event(self, event: str):
+        token = _current_event.set(event)
+        try:
+            yield
+        finally:
+            _current_event.reset(token)
+
+    def event(self, event: Optional[str]):
+        """ :return: A context manager labelling the stages started in it with `event` (like "<game id>_<event id>") """
+        if not self.enabled or event is None:
+            return _null_stage
+        return self._event(str(event))
+
+    def count(self, name: str, value: float = 1):
+        """ Adds to a counter of the innermost open stage (or to `unattributed_counters`, if there is none) """
+        if not self.enabled:
+            return
+        stage = _current_stage.get()
+        if stage is not None and stage.metrics is self:
+            stage.counters[name] += value
+        else:
+            with self._lock:
+                self.unattributed_counters[name] += value
+
+    def _record(self, record: Dict):
+        with self._lock:
+            if self.jsonl_path is None:
+                self.records.append(record)
+                return
+            # Opened per record, so forked processes never share a handle. A single append of a whole line.
+            with open(self.jsonl_path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+    def load_records(self) -> List[Dict]:
+        """ :return: The records of all the processes that wrote to `jsonl_path`, or the ones in memory if it's None """
+        if self.jsonl_path is None:
+            with self._lock:
+                return list(self.records)
+        return load_metrics_records(self.jsonl_path)
+
+    def summary(self, by_event: bool = False) -> 'pd.DataFrame':
+        """ See `summarize_metrics_records` """
+        return summarize_metrics_records(self.load_records(), by_event)
+
+    def write_prometheus(self, path: str, prefix: str = 'nba_harvest'):
+        """ See `write_prometheus_textfile` """
+        write_prometheus_textfile(self.summary(), path, prefix)
+
+
+def load_metrics_records(jsonl_path: str) -> List[Dict]:
+    with open(jsonl_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize_metrics_records(records: List[Dict], by_event: bool = False) -> 'pd.DataFrame':
+    """
+    :param by_event: A row per stage of each event, instead of a row per stage
+    :return: The number of calls and errors, the total wall and CPU seconds, the mean and max wall time, and the total
+    of every counter. A stage's time includes the time of the stages nested in it.
+    """
+    import pandas as pd
+
+    group_columns = ['event', 'stage'] if by_event else ['stage']
+    if not records:
+        return pd.DataFrame(columns=['calls', 'errors', 'wall_seconds', 'cpu_seconds', 'mean_wall_ms', 'max_wall_ms'])
+    df = pd.DataFrame([{column: record[column] for column in ('event', 'stage', 'wall_seconds', 'cpu_seconds',
+                                                                'error')} for record in records])
+    df['event'] = df['event'].fillna('-')
+    counters = pd.DataFrame([record['counters'] for record in records], index=df.index).fillna(0)
+    df = pd.concat([df, counters], axis=1)
+    grouped = df.groupby(group_columns, sort=True)
+    summary = pd.DataFrame({
+        'calls': grouped.size(),
+        'errors': grouped['error'].count(),
+        'wall_seconds': grouped['wall_seconds'].sum(),
+        'cpu_seconds': grouped['cpu_seconds'].sum(),
+        'mean_wall_ms': grouped['wall_seconds'].mean() * 1000,
+        'max_wall_ms': grouped['wall_seconds'].max() * 1000,
+    })
+    if len(counters.columns):
+        summary = summary.join(grouped[list(counters.columns)].sum())
+    return summary if by_event else summary.sort_values('wall_seconds', ascending=False)
+
+
+def _prometheus_name(name: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def write_prometheus_textfile(stage_summary: 'pd.DataFrame', path: str, prefix: str = 'nba_harvest'):
+    """
+    Writes a per stage summary (`summarize_metrics_records`) in the Prometheus text format, for node_exporter's
+    textfile collector. The file is replaced atomically, so the collector never reads half of it.
+    """
+    metrics = {'calls': 'Finished stages', 'errors': 'Stages that raised', 'wall_seconds': 'Wall time in the stage',
+               'cpu_seconds': 'CPU time in the stage'}
+    metrics.update({column: f"Total {column} counted in the stage" for column in stage_summary.columns
+                    if column not in metrics and column not in ('mean_wall_ms', 'max_wall_ms')})
+    lines = []
+    for column, help_text in metrics.items():
+        name = f"{prefix}_{_prometheus_name(column)}_total"
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for stage, value in stage_summary[column].items():
+            label = str(stage).replace('\\', '\\\\').replace('"', '\\"')
+            lines.append(f'{name}{{stage="{label}"}} {float(value):g}')
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(temp_path, path)
+
+
+# Disabled by default. `harvest_metrics.enable("harvest_metrics.jsonl")` before a harvest, and
+# `harvest_metrics.summary()` after it.
+harvest_metrics = HarvestMetrics()
@@ -0,0 +1,50 @@
+"""
+The SQLite databases of the caches and stores: a connection per thread, in WAL mode, so many threads and processes can
+use a database at once
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Tuple
+
+
+class _ThreadLocalSQLite:
+    """
+    A mixin for the classes keeping their data in the SQLite database at `self.path`. `_schema` are the statements
+    creating its tables (with IF NOT EXISTS), run on every new connection. Pickled, it leaves its connections behind.
+    """
+    path: str
+    _schema: Tuple[str, ...] = ()
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections can't be shared between threads, so each thread gets its own
+        local = self.__dict__.get('_local') or self.__dict__.setdefault('_local', threading.local())
+        connection = getattr(local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in self._schema:
+                connection.execute(statement)
+            local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        """ Yields the connection of the thread, in a transaction that holds the write lock from its start """
+        connection = self._connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_local', None)
+        return state
@@ -0,0 +1,233 @@
+"""
+The NBA's vocabulary: shot types (`EVENTMSGACTIONTYPE`s) and the names we save them under, play descriptions, game ids
+and game clock strings. Only needs the standard library, so it's cheap to import.
+"""
+import re
+from datetime import datetime, timedelta
+from typing import Optional
+
+
+# Dict for names in the original NBA data that we want to be saved differently
+original_name_conversion_dict = {
+    'FADEAWAY_JUMPER': "FADEAWAY_JUMP_SHOT",
+    'RUNNING_PULL': "RUNNING_PULLUP"
+}
+
+# Each shot type to it's name
+prior_shot_type_to_shot_dsc = {
+    1: 'JUMP_SHOT',
+    2: 'RUNNING_JUMP_SHOT',
+    3: 'HOOK_SHOT',
+    5: 'LAYUP',
+    6: 'DRIVING_LAYUP',
+    7: 'DUNK',
+    8: 'SLAM_DUNK',
+    9: 'DRIVING_DUNK',
+    40: 'LAYUP',
+    41: 'RUNNING_LAYUP',
+    42: 'DRIVING_LAYUP',
+    43: 'ALLEY_OOP_LAYUP',
+    44: 'REVERSE_LAYUP',
+    45: 'JUMP_SHOT',
+    46: 'RUNNING_JUMP_SHOT',
+    47: 'TURNAROUND_JUMP_SHOT',
+    48: 'DUNK',
+    49: 'DRIVING_DUNK',
+    50: 'RUNNING_DUNK',
+    51: 'REVERSE_DUNK',
+    52: 'ALLEY_OOP_DUNK',
+    55: 'HOOK_SHOT',
+    56: 'RUNNING_HOOK_SHOT',
+    57: 'DRIVING_HOOK_SHOT',
+    58: 'TURNAROUND_HOOK_SHOT',
+    63: 'FADEAWAY_JUMP_SHOT',
+    65: 'JUMP_HOOK_SHOT',
+    66: 'JUMP_BANK_SHOT',
+    67: 'HOOK_BANK_SHOT',
+    71: 'FINGER_ROLL_LAYUP',
+    73: 'DRIVING_REVERSE_LAYUP',
+    74: 'RUNNING_REVERSE_LAYUP',
+    75: 'DRIVING_FINGER_ROLL_LAYUP',
+    76: 'RUNNING_FINGER_ROLL_LAYUP',
+    77: 'DRIVING_JUMP_SHOT',
+    78: 'FLOATING_JUMP_SHOT',
+    79: 'PULLUP_JUMP_SHOT',
+    80: 'STEP_BACK_JUMP_SHOT',
+    81: 'PULLUP_BANK_SHOT',
+    82: 'DRIVING_BANK_SHOT',
+    83: 'FADEAWAY_BANK_SHOT',
+    84: 'RUNNING_BANK_SHOT',
+    85: 'TURNAROUND_BANK_SHOT',
+    86: 'TURNAROUND_FADEAWAY_SHOT',
+    88: 'DRIVING_SLAM_DUNK',
+    89: 'REVERSE_SLAM_DUNK',
+    90: 'RUNNING_SLAM_DUNK',
+    93: 'DRIVING_BANK_HOOK_SHOT',
+    94: 'JUMP_BANK_HOOK_SHOT',
+    95: 'RUNNING_BANK_HOOK_SHOT',
+    96: 'TURNAROUND_BANK_HOOK_SHOT',
+    98: 'CUTTING_LAYUP_SHOT',
+    99: 'CUTTING_FINGER_ROLL_LAYUP_SHOT',
+    100: 'RUNNING_ALLEY_OOP_LAYUP_SHOT',
+    101: 'DRIVING_FLOATING_JUMP_SHOT',
+    102: 'DRIVING_FLOATING_BANK_JUMP_SHOT',
+    103: 'RUNNING_PULLUP',
+    104: 'STEP_BACK_BANK_JUMP_SHOT',
+    105: 'TURNAROUND_FADEAWAY_BANK_JUMP_SHOT',
+    106: 'RUNNING_ALLEY_OOP_DUNK_SHOT',
+    108: 'CUTTING_DUNK_SHOT',
+    109: 'DRIVING_REVERSE_DUNK_SHOT',
+    110: 'RUNNING_REVERSE_DUNK_SHOT'
+}
+
+# Each shot type to it's number of plays throughout the whole NBA-API database, as counted once.
+# `ShotEventIndex.shot_type_histogram` counts it from the index instead.
+prior_shot_type_histogram = {
+    1: 730831,
+    2: 11918,
+    3: 25977,
+    5: 80179,
+    6: 97103,
+    7: 18542,
+    8: 1545,
+    9: 10152,
+    40: 480,
+    41: 29625,
+    42: 36213,
+    43: 8101,
+    44: 13496,
+    45: 1181,
+    46: 6828,
+    47: 28379,
+    48: 181,
+    49: 3770,
+    50: 12209,
+    51: 939,
+    52: 15174,
+    55: 208,
+    56: 777,
+    57: 10332,
+    58: 18482,
+    63: 30673,
+    65: 1385,
+    66: 9190,
+    67: 1272,
+    71: 4399,
+    73: 16346,
+    74: 2791,
+    75: 32975,
+    76: 6354,
+    77: 1555,
+    78: 41092,
+    79: 187947,
+    80: 69034,
+    81: 811,
+    82: 2323,
+    83: 573,
+    84: 955,
+    85: 1481,
+    86: 21988,
+    88: 639,
+    89: 38,
+    90: 192,
+    93: 1598,
+    94: 28,
+    95: 29,
+    96: 1394,
+    98: 35834,
+    99: 4628,
+    100: 570,
+    101: 56258,
+    102: 17084,
+    103: 8435,
+    104: 523,
+    105: 3057,
+    106: 1497,
+    108: 21683,
+    109: 331,
+    110: 143
+}
+
+hook_shot_classes = {k: v for k, v in prior_shot_type_to_shot_dsc.items() if 'HOOK' in v}
+bank_shot_classes = {k: v for k, v in prior_shot_type_to_shot_dsc.items() if 'BANK' in v}
+jump_shot_classes = {k: v for k, v in prior_shot_type_to_shot_dsc.items() if 'JUMP_SHOT' in v}
+layup_classes = {k: v for k, v in prior_shot_type_to_shot_dsc.items() if 'LAYUP' in v}
+dunk_classes = {k: v for k, v in prior_shot_type_to_shot_dsc.items() if 'DUNK' in v}
+cut_classes = {k: v for k, v in prior_shot_type_to_shot_dsc.items() if 'CUT' in v}
+putback_classes = {k: v for k, v in prior_shot_type_to_shot_dsc.items() if 'TIP_' in v or 'PUTBACK' in v}
+
+
+# Game-clock readings look like "3:45" (a minute or more left) or "56.3" / "56." (under a minute)
+_game_clock_pattern = re.compile(r'(?<!\d)(\d{1,2}):(\d{2})(?!\d)|(?<![\d:])(\d{1,2})\.(\d?)(?!\d)')
+
+
+def parse_game_clock(text: str) -> Optional[float]:
+    """
+    Extracts the game-clock reading out of an OCR text of the scoreboard.
+
+    :param text: The OCR text. Can contain other scoreboard noise (scores, shot clock, period...)
+    :return: The game clock in seconds, or None if no game-clock reading was found in the text
+    """
+    minutes_readings, seconds_readings = [], []
+    for minutes, seconds, under_minute_seconds, tenths in _game_clock_pattern.findall(text):
+        if minutes:
+            if int(minutes) <= 12 and int(seconds) < 60:
+                minutes_readings.append(int(minutes) * 60 + int(seconds))
+        elif int(under_minute_seconds) < 60:
+            seconds_readings.append(int(under_minute_seconds) + (int(tenths) / 10 if tenths else 0))
+    if minutes_readings:
+        # "M:SS" readings are unambiguous
+        return float(minutes_readings[0])
+    if seconds_readings:
+        # Under a minute the shot clock can also show tenths, but it is never above the game clock
+        return float(max(seconds_readings))
+    return None
+
+
+def add_seconds_to_time(time_str, seconds_to_add=0):
+    # Parse the input time string into a datetime object
+    time_format = "%M:%S"
+    time_obj = datetime.strptime(time_str, time_format)
+
+    if time_obj.minute != 0:
+        # Regular case. There is what to decrease from
+        new_time_obj = time_obj + timedelta(seconds=seconds_to_add)
+    else:
+        # Spacial case. Need to make sure we don't go below 0
+        new_time_obj = time_obj + timedelta(seconds=max(seconds_to_add, -time_obj.second))
+
+    # Check if the time is under a minute
+    if new_time_obj.minute == 0:
+        # Format the result as seconds only (without leading zeros)
+        result_time_str = f'{new_time_obj.strftime("%S")}.'
+    else:
+        # Format the result as minutes and seconds
+        result_time_str = new_time_obj.strftime("%M:%S")
+
+    # Remove leading zero from minutes (if present)
+    if result_time_str.startswith('0'):
+        result_time_str = result_time_str[1:]
+
+    return result_time_str
+
+
+def get_event_msg_action(description):
+    p = re.compile('(\s{2}|\' )([\w+ ]*)')
+
+    match = p.findall(description)
+    if not match:
+        return None
+    else:
+        event_msg_action = re.sub(' ', '_', match[0][1]).upper().rstrip("_").replace("3PT_", "")
+        return event_msg_action
+
+
+def get_shot_type_name(event_action_id: int) -> Optional[str]:
+    """ :return: The name we save videos of this `EVENTMSGACTIONTYPE` under, or None if it's not a known shot type """
+    video_description = prior_shot_type_to_shot_dsc.get(event_action_id)
+    return original_name_conversion_dict.get(video_description, video_description)
+
+
+def get_season_from_game_id(game_id: str) -> str:
+    """ NBA game ids look like `0021900001`, where `19` is the season (2019-20) """
+    return f"20{str(game_id)[3:5]}"
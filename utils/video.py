@@ -0,0 +1,1487 @@
+"""
+Reading videos (locally or over HTTP range requests), transcoding them, reading the game clock, and cutting them
+around a shot
+"""
+import collections
+import concurrent.futures
+import fractions
+import functools
+import hashlib
+import io
+import itertools
+import json
+import logging
+import os
+import pathlib
+import platform
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Tuple, Optional, Iterable, List, TYPE_CHECKING
+
+import cv2
+import numpy as np
+
+from utils.metrics import harvest_metrics
+from utils.sqlite import _ThreadLocalSQLite
+from utils.taxonomy import _game_clock_pattern, parse_game_clock, add_seconds_to_time
+
+if TYPE_CHECKING:
+    # Imported where they are used, since they are slow to import
+    import pandas as pd
+    import requests
+
+logger = logging.getLogger(__name__)
+
+
+class VideoBackend:
+    """
+    The video I/O of `change_video_resolution_and_fps` and `cut_video`: decoding a range of frames of a video, dropping
+    frames to lower the fps, resizing, and encoding the result (an XVID .avi).
+    """
+    name = None
+
+    def transcode(self, video_path, output_path: str, new_resolution: Optional[Tuple[int, int]] = None,
+                  new_fps: Optional[int] = None, start_frame: int = 0, number_of_frames: Optional[int] = None,
+                  stats: Optional['CutVideoStats'] = None) -> int:
+        """
+        :param video_path: Path to the video, or a binary file object
+        :param new_resolution: Defaults to the video resolution
+        :param new_fps: Must divide the video fps. Every (fps / new_fps) frame is kept, counting from `start_frame`.
+        :param start_frame: The first frame to take
+        :param number_of_frames: How many frames of the video (before the fps decrease) to take. All of them if None.
+        :return: The number of frames written
+        """
+        raise NotImplementedError()
+
+
+def _fps_decrease_factor(fps: float, new_fps: Optional[float]) -> int:
+    fps_decrease_factor = fps / new_fps if new_fps else 1
+    if not float(fps_decrease_factor).is_integer():
+        raise ValueError(f"New fps ({new_fps}) must be a divisor of the current fps ({fps})")
+    return int(fps_decrease_factor)
+
+
+class OpenCVVideoBackend(VideoBackend):
+    """ Decodes with `cv2.VideoCapture`, resizes with `cv2.resize` frame by frame, encodes with `cv2.VideoWriter` """
+    name = 'opencv'
+
+    def write_frames(self, cap: cv2.VideoCapture, output_path: str, new_resolution: Optional[Tuple[int, int]],
+                     new_fps: Optional[int], start_frame: int, number_of_frames: Optional[int],
+                     stats: Optional['CutVideoStats'] = None) -> int:
+        """ `transcode`, on an already open capture """
+        fps = int(cap.get(cv2.CAP_PROP_FPS))
+        new_fps = new_fps if new_fps else fps
+        fps_decrease_factor = _fps_decrease_factor(fps, new_fps)
+        current_frame = start_frame
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        if stats is not None:
+            stats.seeks += 1
+        # Read first frame
+        ret, frame = cap.read()
+        if not ret:
+            # Video has ended, without us recording anything
+            return 0
+
+        # Get height, width, and channels from the frame.shape tuple
+        height, width, channels = frame.shape
+        resolution = (width, height)
+
+        # Initialize the video writer to save the cut video
+        fourcc = cv2.VideoWriter_fourcc(*'XVID')
+        # Specify the new_resolution for the cut video
+        new_resolution = new_resolution if new_resolution else resolution
+        out = cv2.VideoWriter(output_path, fourcc, new_fps, new_resolution, isColor=True)
+        new_video_current_frame = 0
+        end_frame = None if number_of_frames is None else start_frame + number_of_frames
+
+        while ret and (end_frame is None or current_frame < end_frame):
+            if stats is not None:
+                stats.frames_decoded += 1
+            if current_frame % fps_decrease_factor == 0:
+                if resolution != new_resolution:
+                    # Resize the frame to the desired new_resolution before writing it
+                    frame = cv2.resize(frame, new_resolution, interpolation=cv2.INTER_AREA)
+                # Write the frame to the cut video
+                out.write(frame)
+                new_video_current_frame += 1
+
+            current_frame += 1
+            # Read next frame
+            ret, frame = cap.read()
+
+        # We're done recording
+        out.release()
+        return new_video_current_frame
+
+    def transcode(self, video_path, output_path: str, new_resolution: Optional[Tuple[int, int]] = None,
+                  new_fps: Optional[int] = None, start_frame: int = 0, number_of_frames: Optional[int] = None,
+                  stats: Optional['CutVideoStats'] = None) -> int:
+        cap = _open_video_capture(video_path)
+        try:
+            return self.write_frames(cap, output_path, new_resolution, new_fps, start_frame, number_of_frames, stats)
+        finally:
+            cap.release()
+
+
+class PyAVVideoBackend(VideoBackend):
+    """
+    Decodes and encodes with FFmpeg (through PyAV), both multi-threaded, with the fps decrease and the resize done in
+    an FFmpeg filter graph (`select` and `scale`) instead of in python.
+
+    When the frames are kept as they are (same resolution and fps), and `start_frame` is a keyframe, the compressed
+    packets are copied as they are (stream copy), with no decoding or encoding at all. A copy has to start on a
+    keyframe, so any other start is transcoded, to keep the cut starting exactly at `start_frame`.
+    """
+    name = 'pyav'
+
+    def __init__(self, threads: int = 0, quality: int = 3, stream_copy: bool = True):
+        """
+        :param threads: Decoding and encoding threads (0 lets FFmpeg choose by the number of cores)
+        :param quality: The MPEG-4 quantizer (2 - 31, lower is better)
+        :param stream_copy: Copy the packets when there's nothing to change, instead of decoding and encoding
+        """
+        try:
+            import av
+        except ImportError as e:
+            raise ImportError("The pyav video backend needs PyAV (pip install av)") from e
+        self._av = av
+        self.threads = threads
+        self.quality = quality
+        self.stream_copy = stream_copy
+
+    def _open(self, video_path):
+        if isinstance(video_path, io.IOBase):
+            video_path.seek(0)
+        container = self._av.open(video_path)
+        stream = container.streams.video[0]
+        stream.thread_type = 'AUTO'
+        stream.thread_count = self.threads
+        return container, stream
+
+    def _seek(self, container, stream, start_frame: int, fps) -> None:
+        # Lands on the last keyframe before the frame. Even for the first frame, since the stream may have been read.
+        container.seek(int(start_frame / fps / stream.time_base) + (stream.start_time or 0), stream=stream,
+                       backward=True)
+
+    @staticmethod
+    def _frame_index(timestamp: int, stream, fps) -> int:
+        return round((timestamp - (stream.start_time or 0)) * stream.time_base * fps)
+
+    def _starts_on_keyframe(self, container, stream, start_frame: int, fps) -> bool:
+        """ Whether the first packet after seeking to `start_frame` is a keyframe of that very frame """
+        self._seek(container, stream, start_frame, fps)
+        for packet in container.demux(stream):
+            if packet.dts is None:
+                continue
+            return packet.is_keyframe and self._frame_index(packet.pts, stream, fps) == start_frame
+        return False
+
+    def _copy_packets(self, container, stream, output_path: str, fps, start_frame: int,
+                      end_frame: Optional[int], stats: Optional['CutVideoStats'] = None) -> int:
+        """ :return: The number of copied frames from `start_frame` to before `end_frame` """
+        with self._av.open(output_path, 'w') as output:
+            output_stream = output.add_stream_from_template(stream)
+            output_stream.time_base = fractions.Fraction(1, int(fps))
+            self._seek(container, stream, start_frame, fps)
+            first_pts = None
+            copied_frames = 0
+            for packet in container.demux(stream):
+                if packet.dts is None:
+                    # The flush packet at the end of the stream
+                    continue
+                if end_frame is not None and self._frame_index(packet.dts, stream, fps) >= end_frame:
+                    break
+                frame_index = self._frame_index(packet.pts, stream, fps)
+                # Reordered (B-frame) packets can be decoded before `end_frame` but shown after it
+                copied_frames += start_frame <= frame_index and (end_frame is None or frame_index < end_frame)
+                if first_pts is None:
+                    first_pts = packet.pts
+                packet.pts -= first_pts
+                packet.dts -= first_pts
+                packet.stream = output_stream
+                output.mux(packet)
+                if stats is not None:
+                    stats.packets_copied += 1
+        return copied_frames
+
+    def transcode(self, video_path, output_path: str, new_resolution: Optional[Tuple[int, int]] = None,
+                  new_fps: Optional[int] = None, start_frame: int = 0, number_of_frames: Optional[int] = None,
+                  stats: Optional['CutVideoStats'] = None) -> int:
+        av = self._av
+        container, stream = self._open(video_path)
+        with container:
+            fps = stream.average_rate or stream.guessed_rate
+            resolution = (stream.codec_context.width, stream.codec_context.height)
+            new_resolution = tuple(new_resolution) if new_resolution else resolution
+            new_fps = new_fps if new_fps else int(fps)
+            fps_decrease_factor = _fps_decrease_factor(fps, new_fps)
+            end_frame = None if number_of_frames is None else start_frame + number_of_frames
+            if self.stream_copy and fps_decrease_factor == 1 and new_resolution == resolution:
+                if stats is not None:
+                    stats.seeks += 1
+                if self._starts_on_keyframe(container, stream, start_frame, fps):
+                    if stats is not None:
+                        stats.seeks += 1
+                    return self._copy_packets(container, stream, output_path, fps, start_frame, end_frame, stats)
+
+            graph = av.filter.Graph()
+            graph_source = graph.add_buffer(template=stream)
+            filters = [graph_source]
+            if fps_decrease_factor > 1:
+                # n counts the frames pushed into the graph, which start at `start_frame`
+                filters.append(graph.add('select', f"not(mod(n\\,{fps_decrease_factor}))"))
+            # MPEG-4 in AVI has no range flag, so full range (JPEG) frames must be converted to the limited range
+            filters.append(graph.add('scale', f"{new_resolution[0]}:{new_resolution[1]}:flags=area:out_range=tv"))
+            filters.append(graph.add('format', 'yuv420p'))
+            filters.append(graph.add('buffersink'))
+            for source_filter, destination_filter in zip(filters, filters[1:]):
+                source_filter.link_to(destination_filter)
+            graph.configure()
+
+            with av.open(output_path, 'w') as output:
+                output_stream = output.add_stream('mpeg4', rate=new_fps)
+                output_stream.width, output_stream.height = new_resolution
+                output_stream.pix_fmt = 'yuv420p'
+                output_stream.codec_context.codec_tag = 'XVID'
+                output_stream.codec_context.qscale = self.quality
+                output_stream.thread_type = 'AUTO'
+                output_stream.thread_count = self.threads
+                time_base = fractions.Fraction(1, new_fps)
+                new_video_current_frame = 0
+
+                def encode(frame):
+                    if frame is not None:
+                        frame.pts = new_video_current_frame
+                        frame.time_base = time_base
+                    output.mux(output_stream.encode(frame))
+
+                def encode_filtered_frames():
+                    nonlocal new_video_current_frame
+                    while True:
+                        try:
+                            filtered_frame = graph.pull()
+                        except (BlockingIOError, av.error.EOFError):
+                            return
+                        encode(filtered_frame)
+                        new_video_current_frame += 1
+
+                self._seek(container, stream, start_frame, fps)
+                if stats is not None:
+                    stats.seeks += 1
+                for frame in container.decode(stream):
+                    frame_index = self._frame_index(frame.pts, stream, fps)
+                    if frame_index < start_frame:
+                        # Decoded from the keyframe before the start
+                        continue
+                    if end_frame is not None and frame_index >= end_frame:
+                        break
+                    if stats is not None:
+                        stats.frames_decoded += 1
+                    graph.push(frame)
+                    encode_filtered_frames()
+                # The end of the stream, so the filters give out the frames they hold
+                graph.push(None)
+                encode_filtered_frames()
+                encode(None)
+            return new_video_current_frame
+
+
+video_backends = {backend.name: backend for backend in (OpenCVVideoBackend, PyAVVideoBackend)}
+
+
+def get_video_backend(video_backend) -> VideoBackend:
+    """ :param video_backend: A `VideoBackend`, or the name of one ('opencv' or 'pyav') """
+    if isinstance(video_backend, VideoBackend):
+        return video_backend
+    if video_backend not in video_backends:
+        raise ValueError(f"Unknown video backend `{video_backend}`. Options are {list(video_backends)}")
+    return video_backends[video_backend]()
+
+
+@harvest_metrics.timed('change_video_resolution_and_fps')
+def change_video_resolution_and_fps(video_path: str, output_path: str,
+                                    new_resolution: Optional[Tuple[int, int]] = None,
+                                    new_fps: Optional[int] = None,
+                                    acceptable_fps_violation: int = 0, video_backend='opencv') -> bool:
+    """ :param video_backend: 'opencv' (the default), 'pyav', or a `VideoBackend` (see `get_video_backend`) """
+    cap = cv2.VideoCapture(video_path)
+
+    try:
+        original_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        original_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        resolution = (original_width, original_height)
+        fps = int(cap.get(cv2.CAP_PROP_FPS))
+        # Specify the new_resolution and new_fps for the cut video
+        new_resolution = new_resolution if new_resolution else resolution
+        new_fps = fps if ((not new_fps) or (abs(new_fps - fps) <= acceptable_fps_violation)) else new_fps
+        _fps_decrease_factor(fps, new_fps)
+
+        video_backend = get_video_backend(video_backend)
+        if isinstance(video_backend, OpenCVVideoBackend):
+            if fps == new_fps and resolution == new_resolution:
+                # OpenCV can only re-encode, so the video is better copied as it is
+                shutil.copy(video_path, output_path)
+                return True
+            return video_backend.write_frames(cap, output_path, new_resolution, new_fps, 0, None) > 0
+    finally:
+        # Release the video capture and close all windows
+        cap.release()
+    return video_backend.transcode(video_path, output_path, new_resolution, new_fps) > 0
+
+
+# Where tesseract is installed, if it isn't on the PATH
+_tesseract_cmds = {
+    'windows': r"C:\Program Files\Tesseract-OCR\tesseract.exe",
+    'linux': r'/usr/local/bin/pytesseract',
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _get_pytesseract():
+    """ Imports pytesseract on the first OCR (it's slow to import), and points it to tesseract once """
+    import pytesseract
+
+    tesseract_cmd = _tesseract_cmds.get(platform.system().lower())
+    if tesseract_cmd is not None and os.path.exists(tesseract_cmd):
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    return pytesseract
+
+
+def _read_clock_text(frame) -> str:
+    # Crop the bottom quarter of the frame, where the scoreboard is
+    height, width = frame.shape[:2]
+    crop_img = frame[height - height // 4:height, 0:width]
+    gray = cv2.cvtColor(crop_img, cv2.COLOR_BGR2GRAY)
+    bw = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+    blurred = cv2.GaussianBlur(bw, (5, 5), 0)
+    return _get_pytesseract().image_to_string(blurred, lang='eng', config='--psm 11')
+
+
+# The memory tiers of the `ClockOCRCache`s unpickled in this process, by the cache they were pickled from
+_clock_ocr_memory_tiers = {}
+_clock_ocr_memory_tiers_lock = threading.Lock()
+
+
+class ClockOCRCache(_ThreadLocalSQLite):
+    """
+    Memoizes the clock OCR by the binarized scoreboard crop. The scoreboard often looks the same in many frames (a
+    stopped clock, replays, and the graphic shared by the events of a game), and a lookup takes microseconds, instead
+    of a tesseract run.
+
+    A crop's fingerprint is the crop shrunk (by up to `downscale`, keeping it at least 32 pixels high) and binarized,
+    so most of the compression noise goes away, but a changed digit doesn't. A crop with the same fingerprint is found
+    by a hash of it, and an entry is only used if its fingerprint is the same (a hash collision counts as a miss).
+    The noise still flips a few pixels at the edges of the glyphs, so otherwise the entries are looked up by a
+    perceptual hash (a dHash of the fingerprint, 16 rows of 32 bits), which such noise doesn't change: every row of
+    it is a bucket, so the entries whose hash is within `max_hash_distance` bits share at least one row with it. Of
+    those, the one whose fingerprint differs by at most `max_differing_pixels` is used. Rows without an edge in them
+    (like the flat background above the graphic) don't make buckets, or every scoreboard would share them.
+
+    Entries are kept in memory (the `max_entries` most recently used), and in an SQLite database at `path`, if given,
+    which processes share, and which is looked up the same ways. A pickled cache, like in `cut_video_kwargs`, doesn't
+    take its entries along: the copies unpickled in a process share a memory tier of their own.
+    """
+    _hash_rows, _hash_columns = 16, 32
+    # How much brighter a cell of the hash grid must be than its left neighbour for a 1 bit, so a speck of noise in a
+    # flat area doesn't flip it
+    _hash_margin = 16
+    _schema = (
+        'CREATE TABLE IF NOT EXISTS clock_ocr_entries (key BLOB PRIMARY KEY, kind TEXT NOT NULL, phash BLOB NOT NULL, '
+        'fingerprint BLOB NOT NULL, text TEXT NOT NULL)',
+        # The keys of the entries by (kind, row of their hash, its bits)
+        'CREATE TABLE IF NOT EXISTS clock_ocr_buckets (kind TEXT NOT NULL, row INTEGER NOT NULL, '
+        'bits INTEGER NOT NULL, key BLOB NOT NULL, PRIMARY KEY (kind, row, bits, key)) WITHOUT ROWID',
+    )
+
+    def __init__(self, max_entries: int = 4096, path: Optional[str] = None, downscale: int = 2,
+                 max_differing_pixels: int = 4, max_hash_distance: int = 8, near_candidates: int = 64):
+        """
+        :param path: The database of the on-disk tier, like `<videos folder>.ocr.sqlite`. In memory only if not given.
+        :param max_differing_pixels: Should stay well under the pixels a changed digit changes in the fingerprint
+        :param max_hash_distance: Under 16 (the rows of the hash), so a close entry shares a row with the crop
+        :param near_candidates: How many of the closest entries by hash have their fingerprint compared
+        """
+        if max_hash_distance >= self._hash_rows:
+            raise ValueError(f"max_hash_distance must be under {self._hash_rows}")
+        self.max_entries = max_entries
+        self.path = str(path) if path is not None else None
+        self.downscale = downscale
+        self.max_differing_pixels = max_differing_pixels
+        self.max_hash_distance = max_hash_distance
+        self.near_candidates = near_candidates
+        self._token = os.urandom(8).hex()
+        self._entries, self._buckets, self._lock = self._new_memory_tier()
+        self.hits = 0
+        self.near_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.collisions = 0
+
+    @staticmethod
+    def _new_memory_tier():
+        # The entries by key, the keys by (kind, row of the hash, its bits), and their lock
+        return collections.OrderedDict(), collections.defaultdict(set), threading.Lock()
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        # Every process keeps its own memory tier
+        del state['_entries'], state['_buckets'], state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        with _clock_ocr_memory_tiers_lock:
+            self._entries, self._buckets, self._lock = _clock_ocr_memory_tiers.setdefault(
+                self._token, self._new_memory_tier())
+
+    def _binarize(self, crop):
+        height, width = crop.shape[:2]
+        scale = max(1, min(self.downscale, height // 32))
+        if scale > 1:
+            # Shrunk before it is binarized, which is several times faster than binarizing the full crop
+            crop = cv2.resize(crop, (width // scale, height // scale), interpolation=cv2.INTER_AREA)
+        if crop.ndim == 3:
+            crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+        return cv2.threshold(crop, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+
+    @staticmethod
+    def _fingerprint(bw) -> bytes:
+        return np.array(bw.shape, dtype=np.uint32).tobytes() + np.packbits(bw).tobytes()
+
+    def _perceptual_hash(self, bw) -> int:
+        cells = cv2.resize(bw, (self._hash_columns + 1, self._hash_rows), interpolation=cv2.INTER_AREA)
+        cells = cells.astype(np.int16)
+        bits = cells[:, 1:] - cells[:, :-1] > self._hash_margin
+        return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+    def fingerprint(self, crop) -> bytes:
+        """
+        :param crop: A BGR, grayscale or binary image
+        :return: Its binarized shape, then its pixels, 8 to a byte
+        """
+        return self._fingerprint(self._binarize(crop))
+
+    def perceptual_hash(self, crop) -> int:
+        """ :return: The dHash of the crop's fingerprint, its first row in the highest bits """
+        return self._perceptual_hash(self._binarize(crop))
+
+    def _hash_buckets(self, phash: int) -> List[Tuple[int, int]]:
+        """ :return: (row, its bits) of the rows of the hash with an edge """
+        mask = (1 << self._hash_columns) - 1
+        rows = [(row, (phash >> ((self._hash_rows - 1 - row) * self._hash_columns)) & mask)
+                for row in range(self._hash_rows)]
+        return [(row, bits) for row, bits in rows if bits]
+
+    @property
+    def hit_rate(self) -> float:
+        hits = self.hits + self.near_hits + self.disk_hits
+        return hits / (hits + self.misses) if hits + self.misses else 0.0
+
+    def stats(self) -> Dict:
+        return {'hits': self.hits, 'near_hits': self.near_hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                'collisions': self.collisions, 'hit_rate': self.hit_rate, 'entries': len(self._entries)}
+
+    def _remember(self, key: bytes, kind: str, phash: int, fingerprint: bytes, text: str):
+        # Called with the lock held
+        if key not in self._entries:
+            for row, bits in self._hash_buckets(phash):
+                self._buckets[kind, row, bits].add(key)
+        self._entries[key] = (kind, phash, fingerprint, text)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            old_key, (old_kind, old_phash, _, _) = self._entries.popitem(last=False)
+            for row, bits in self._hash_buckets(old_phash):
+                bucket = self._buckets[old_kind, row, bits]
+                bucket.discard(old_key)
+                if not bucket:
+                    del self._buckets[old_kind, row, bits]
+
+    def _closest(self, phash: int, candidates: Iterable[Tuple[bytes, int]]) -> List[bytes]:
+        """
+        :param candidates: (key, perceptual hash) of the entries sharing a bucket with the crop
+        :return: The keys of the `near_candidates` closest entries within `max_hash_distance`, the closest first
+        """
+        distances = ((bin(phash ^ candidate_hash).count('1'), key) for key, candidate_hash in candidates)
+        return [key for distance, key in sorted(distances)[:self.near_candidates] if distance <= self.max_hash_distance]
+
+    def _is_near(self, fingerprint: bytes, candidate_fingerprint: bytes) -> bool:
+        # The same shape (the first 8 bytes), and about the same pixels
+        return len(candidate_fingerprint) == len(fingerprint) and candidate_fingerprint[:8] == fingerprint[:8] and \
+            np.unpackbits(np.frombuffer(candidate_fingerprint, dtype=np.uint8) ^
+                          np.frombuffer(fingerprint, dtype=np.uint8)).sum() <= self.max_differing_pixels
+
+    def _read_memory(self, key: bytes, fingerprint: bytes) -> Optional[str]:
+        # Called with the lock held
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] == fingerprint:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[3]
+        if entry is not None:
+            self.collisions += 1
+        return None
+
+    def _read_memory_near(self, key: bytes, kind: str, phash: int, fingerprint: bytes) -> Optional[str]:
+        # Called with the lock held
+        candidate_keys = set().union(*(self._buckets.get((kind, row, bits), ())
+                                       for row, bits in self._hash_buckets(phash)))
+        candidate_keys.discard(key)
+        for candidate_key in self._closest(phash, ((k, self._entries[k][1]) for k in candidate_keys)):
+            _, _, candidate_fingerprint, text = self._entries[candidate_key]
+            if self._is_near(fingerprint, candidate_fingerprint):
+                # Under its own fingerprint too, so the next read of this crop is an exact hit
+                self._remember(key, kind, phash, fingerprint, text)
+                self.near_hits += 1
+                return text
+        return None
+
+    def _read_disk(self, key: bytes, kind: str, phash: int, fingerprint: bytes) -> Optional[str]:
+        connection = self._connection
+        row = connection.execute('SELECT fingerprint, text FROM clock_ocr_entries WHERE key = ?', (key,)).fetchone()
+        if row is not None and row[0] == fingerprint:
+            return row[1]
+        if row is not None:
+            with self._lock:
+                self.collisions += 1
+        buckets = self._hash_buckets(phash)
+        if not buckets:
+            return None
+        candidates = connection.execute(
+            'SELECT DISTINCT entries.key, entries.phash FROM clock_ocr_buckets AS buckets '
+            'JOIN clock_ocr_entries AS entries ON entries.key = buckets.key WHERE buckets.kind = ? AND ('
+            + ' OR '.join(['(buckets.row = ? AND buckets.bits = ?)'] * len(buckets)) + ')',
+            (kind, *itertools.chain.from_iterable(buckets))).fetchall()
+        for candidate_key in self._closest(phash, ((k, int.from_bytes(h, 'big')) for k, h in candidates if k != key)):
+            row = connection.execute('SELECT fingerprint, text FROM clock_ocr_entries WHERE key = ?',
+                                     (candidate_key,)).fetchone()
+            if row is not None and self._is_near(fingerprint, row[0]):
+                return row[1]
+        return None
+
+    def _write_disk(self, key: bytes, kind: str, phash: int, fingerprint: bytes, text: str):
+        with self._transaction() as connection:
+            connection.execute('INSERT OR REPLACE INTO clock_ocr_entries (key, kind, phash, fingerprint, text) '
+                               'VALUES (?, ?, ?, ?, ?)',
+                               (key, kind, phash.to_bytes(self._hash_rows * self._hash_columns // 8, 'big'),
+                                fingerprint, text))
+            connection.executemany('INSERT OR IGNORE INTO clock_ocr_buckets (kind, row, bits, key) VALUES (?, ?, ?, ?)',
+                                   [(kind, row, bits, key) for row, bits in self._hash_buckets(phash)])
+
+    def read(self, crop, recognize: Callable[[], str], kind: str = '') -> str:
+        """
+        :param crop: What is OCR-ed
+        :param recognize: Runs the OCR, on a miss
+        :param kind: Tells apart OCRs of the same crop (like different tesseract configs)
+        :return: The text of the crop
+        """
+        bw = self._binarize(crop)
+        fingerprint = self._fingerprint(bw)
+        key = hashlib.blake2b(kind.encode() + b'\0' + fingerprint, digest_size=16).digest()
+        with self._lock:
+            text = self._read_memory(key, fingerprint)
+        if text is None:
+            phash = self._perceptual_hash(bw)
+            with self._lock:
+                text = self._read_memory_near(key, kind, phash, fingerprint)
+        if text is not None:
+            harvest_metrics.count('ocr_cache_hits')
+            return text
+
+        if self.path is not None:
+            text = self._read_disk(key, kind, phash, fingerprint)
+            if text is not None:
+                with self._lock:
+                    self._remember(key, kind, phash, fingerprint, text)
+                    self.disk_hits += 1
+                harvest_metrics.count('ocr_cache_hits')
+                return text
+
+        text = recognize()
+        with self._lock:
+            self._remember(key, kind, phash, fingerprint, text)
+            self.misses += 1
+        harvest_metrics.count('ocr_cache_misses')
+        if self.path is not None:
+            self._write_disk(key, kind, phash, fingerprint, text)
+        return text
+
+
+class ClockReader:
+    """ Reads the scoreboard text out of a video frame. `cut_video` calls `reset` before every new video """
+
+    def read_text(self, frame) -> str:
+        raise NotImplementedError
+
+    def reset(self):
+        pass
+
+
+class TesseractClockReader(ClockReader):
+    """ OCR over the whole bottom quarter of the frame. Slow (a tesseract process per frame), but needs no setup """
+
+    def __init__(self, cache: Optional[ClockOCRCache] = None):
+        """
+        :param cache: Skips the OCR of scoreboards it has already read. The bottom quarter of the frame has some of the
+        court in it too, so it mostly hits on still frames (the TemplateClockReader fallback only reads the clock box).
+        """
+        self.cache = cache
+
+    def read_text(self, frame) -> str:
+        if self.cache is None:
+            return _read_clock_text(frame)
+        height = frame.shape[0]
+        return self.cache.read(frame[height - height // 4:], lambda: _read_clock_text(frame), kind='scoreboard')
+
+
+def _binarize_clock_box(box_img):
+    """ :return: The clock box as a binary image, with the glyphs white on a black background """
+    gray = cv2.cvtColor(box_img, cv2.COLOR_BGR2GRAY) if box_img.ndim == 3 else box_img
+    bw = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+    # The background is the majority of the box
+    if np.count_nonzero(bw) > bw.size / 2:
+        bw = cv2.bitwise_not(bw)
+    return bw
+
+
+def _segment_clock_glyphs(bw) -> List[Tuple[str, Optional[np.ndarray]]]:
+    """
+    Splits a binary clock box into its glyphs, from left to right.
+
+    :return: ('digit', glyph image) for every digit, and (':', None) or ('.', None) for punctuation
+    """
+    count, _, component_stats, _ = cv2.connectedComponentsWithStats(bw, connectivity=8)
+    # Drop the background and specks of noise
+    boxes = [tuple(component_stats[i, :4]) for i in range(1, count) if component_stats[i, cv2.CC_STAT_AREA] >= 4]
+    if not boxes:
+        return []
+    # Merge components stacked on top of each other (the two dots of a colon, broken digits)
+    boxes.sort()
+    # Each merged glyph is [x, y, width, height, number of parts, height of its tallest part]
+    merged = [list(boxes[0]) + [1, boxes[0][3]]]
+    for x, y, w, h in boxes[1:]:
+        last = merged[-1]
+        if x < last[0] + last[2] and min(x + w, last[0] + last[2]) - x >= min(w, last[2]) / 2:
+            right, bottom = max(last[0] + last[2], x + w), max(last[1] + last[3], y + h)
+            last[1] = min(last[1], y)
+            last[2], last[3] = right - last[0], bottom - last[1]
+            last[4], last[5] = last[4] + 1, max(last[5], h)
+        else:
+            merged.append([x, y, w, h, 1, h])
+
+    digit_height = max(h for _, _, _, h, _, _ in merged)
+    baseline = max(y + h for _, y, _, h, _, _ in merged)
+    digit_widths = [w for _, _, w, h, _, tallest_part in merged
+                    if tallest_part >= digit_height * 0.6 and w < digit_height * 0.9]
+    digit_width = float(np.median(digit_widths)) if digit_widths else digit_height * 0.6
+    glyphs = []
+    for x, y, w, h, parts, tallest_part in merged:
+        if tallest_part < digit_height * 0.4:
+            if parts >= 2:
+                glyphs.append((':', None))
+            elif baseline - (y + h) <= digit_height * 0.15:
+                glyphs.append(('.', None))
+        elif h >= digit_height * 0.6:
+            glyphs.extend(('digit', glyph) for glyph in _split_touching_digits(bw[y:y + h, x:x + w], digit_width))
+    return glyphs
+
+
+def _split_touching_digits(glyph, digit_width: float) -> List[np.ndarray]:
+    """ Splits a glyph of several digits touching each other, at the emptiest columns around the expected borders """
+    width = glyph.shape[1]
+    count = int(round(width / digit_width))
+    if count <= 1:
+        return [glyph]
+    column_fill = np.count_nonzero(glyph, axis=0)
+    search_radius = max(1, int(digit_width / 4))
+    borders = [0]
+    for i in range(1, count):
+        expected = int(i * width / count)
+        window_start = max(borders[-1] + 1, expected - search_radius)
+        window = column_fill[window_start:expected + search_radius + 1]
+        borders.append(window_start + int(np.argmin(window)))
+    borders.append(width)
+    parts = []
+    for start, end in zip(borders[:-1], borders[1:]):
+        part = glyph[:, start:end]
+        columns = np.flatnonzero(np.count_nonzero(part, axis=0))
+        rows = np.flatnonzero(np.count_nonzero(part, axis=1))
+        if len(columns) and len(rows):
+            parts.append(part[rows[0]:rows[-1] + 1, columns[0]:columns[-1] + 1])
+    return parts
+
+
+def _glyph_vector(glyph, size: Tuple[int, int] = (16, 24)):
+    """ :return: The glyph, padded to a digit's aspect ratio, resized and normalized to zero mean and unit norm """
+    height, width = glyph.shape
+    padded_width = max(width, int(height * 0.6))
+    padded = np.zeros((height, padded_width), dtype=np.uint8)
+    left = (padded_width - width) // 2
+    padded[:, left:left + width] = glyph
+    # A slight blur makes the correlation tolerant to a pixel of misalignment
+    vector = cv2.GaussianBlur(cv2.resize(padded, size, interpolation=cv2.INTER_AREA), (3, 3), 0)
+    vector = vector.astype(np.float32).ravel()
+    vector -= vector.mean()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class TemplateClockReader(ClockReader):
+    """
+    Finds the game-clock box once per video, and reads the digits inside it in-process, by correlating each digit
+    against a bank of digit templates.
+
+    The templates can be rendered from a font (`from_font`), loaded from a previous run (`load`), or learned on the fly:
+    whenever tesseract (the fallback) reads the clock box, the digits it read become templates.
+    """
+
+    def __init__(self, templates: Optional[Dict[str, List[np.ndarray]]] = None,
+                 roi: Optional[Tuple[int, int, int, int]] = None, match_threshold: float = 0.75,
+                 use_tesseract_fallback: bool = True, max_roi_misses: int = 5,
+                 cache: Optional[ClockOCRCache] = None):
+        """
+        :param templates: Digit character to a list of glyph images of it
+        :param roi: A fixed (x, y, width, height) box of the clock. If not given, it is located once per video.
+        :param match_threshold: Minimal correlation for a digit to be considered matched
+        :param use_tesseract_fallback: Whether to use tesseract for locating the box and for unmatched digits
+        :param max_roi_misses: Consecutive unreadable frames before the box is located again (the graphic moved)
+        :param cache: Skips the tesseract fallback for clock boxes it has already read
+        """
+        self.match_threshold = match_threshold
+        self.use_tesseract_fallback = use_tesseract_fallback
+        self.max_roi_misses = max_roi_misses
+        self.cache = cache
+        self._fixed_roi = roi
+        self.roi = roi
+        self._roi_misses = 0
+        self._labels = []
+        self._vectors = np.empty((0, 16 * 24), dtype=np.float32)
+        self.template_reads = 0
+        self.fallback_reads = 0
+        for label, glyphs in (templates or {}).items():
+            for glyph in glyphs:
+                self.add_template(label, glyph)
+
+    @classmethod
+    def from_font(cls, font_face: int = cv2.FONT_HERSHEY_SIMPLEX, font_scale: float = 1.0, thickness: int = 2,
+                  **kwargs) -> 'TemplateClockReader':
+        """ Renders the digit templates with an OpenCV font """
+        templates = {}
+        for digit in '0123456789':
+            (width, height), base = cv2.getTextSize(digit, font_face, font_scale, thickness)
+            canvas = np.zeros((height + base + 4, width + 4), dtype=np.uint8)
+            cv2.putText(canvas, digit, (2, height + 2), font_face, font_scale, 255, thickness)
+            glyphs = [glyph for kind, glyph in _segment_clock_glyphs(_binarize_clock_box(canvas)) if kind == 'digit']
+            templates[digit] = glyphs[:1]
+        return cls(templates=templates, **kwargs)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> 'TemplateClockReader':
+        data = np.load(path)
+        reader = cls(**kwargs)
+        reader._labels = [str(label) for label in data['labels']]
+        reader._vectors = data['vectors'].astype(np.float32)
+        return reader
+
+    def save(self, path: str):
+        np.savez_compressed(path, labels=np.array(self._labels), vectors=self._vectors)
+
+    @property
+    def known_digits(self):
+        return set(self._labels)
+
+    def add_template(self, label: str, glyph):
+        self._labels.append(label)
+        self._vectors = np.vstack([self._vectors, _glyph_vector(glyph)[np.newaxis]])
+
+    def reset(self):
+        self.roi = self._fixed_roi
+        self._roi_misses = 0
+
+    def locate_clock(self, frame) -> Tuple[Optional[Tuple[int, int, int, int]], str]:
+        """
+        Finds the game-clock box with tesseract, over the bottom quarter of the frame.
+
+        :return: The (x, y, width, height) box in frame coordinates (None if not found), and the whole OCR text
+        """
+        height, width = frame.shape[:2]
+        top = height - height // 4
+        crop_img = frame[top:height, 0:width]
+        gray = cv2.cvtColor(crop_img, cv2.COLOR_BGR2GRAY)
+        bw = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+        blurred = cv2.GaussianBlur(bw, (5, 5), 0)
+        pytesseract = _get_pytesseract()
+        data = pytesseract.image_to_data(blurred, lang='eng', config='--psm 11', output_type=pytesseract.Output.DICT)
+        words = [word for word in data['text'] if word.strip()]
+        for i, word in enumerate(data['text']):
+            if word.strip() and _game_clock_pattern.search(word):
+                margin = data['height'][i] // 2
+                x = max(0, data['left'][i] - margin)
+                y = max(0, top + data['top'][i] - margin)
+                box_width = min(width - x, data['width'][i] + 2 * margin)
+                box_height = min(height - y, data['height'][i] + 2 * margin)
+                return (x, y, box_width, box_height), ' '.join(words)
+        return None, ' '.join(words)
+
+    def _match_digits(self, glyphs) -> Optional[str]:
+        if not self._labels:
+            return None
+        text = ''
+        for kind, glyph in glyphs:
+            if kind != 'digit':
+                text += kind
+                continue
+            scores = self._vectors @ _glyph_vector(glyph)
+            best = int(np.argmax(scores))
+            if scores[best] < self.match_threshold:
+                return None
+            text += self._labels[best]
+        return text
+
+    def _learn(self, glyphs, text: str):
+        match = _game_clock_pattern.search(text)
+        if not match:
+            return
+        characters = [c for c in match.group(0) if c.isdigit()]
+        digit_glyphs = [glyph for kind, glyph in glyphs if kind == 'digit']
+        if len(characters) != len(digit_glyphs):
+            # The segmentation doesn't agree with tesseract, so we can't tell which glyph is which digit
+            return
+        for character, glyph in zip(characters, digit_glyphs):
+            if self._labels.count(character) < 5:
+                self.add_template(character, glyph)
+
+    def _ocr_clock_box(self, bw) -> str:
+        def recognize():
+            return _get_pytesseract().image_to_string(cv2.bitwise_not(bw), lang='eng', config='--psm 7')
+
+        return recognize() if self.cache is None else self.cache.read(bw, recognize, kind='clock box')
+
+    def read_text(self, frame) -> str:
+        if self.roi is None:
+            if not self.use_tesseract_fallback:
+                return ''
+            self.fallback_reads += 1
+            self.roi, text = self.locate_clock(frame)
+            if self.roi is not None:
+                x, y, width, height = self.roi
+                self._learn(_segment_clock_glyphs(_binarize_clock_box(frame[y:y + height, x:x + width])), text)
+            return text
+
+        x, y, width, height = self.roi
+        bw = _binarize_clock_box(frame[y:y + height, x:x + width])
+        glyphs = _segment_clock_glyphs(bw)
+        text = self._match_digits(glyphs)
+        if text is not None and parse_game_clock(text) is not None:
+            self.template_reads += 1
+            self._roi_misses = 0
+            return text
+
+        if self.use_tesseract_fallback:
+            self.fallback_reads += 1
+            text = self._ocr_clock_box(bw)
+            if parse_game_clock(text) is not None:
+                self._roi_misses = 0
+                self._learn(glyphs, text)
+                return text
+
+        self._roi_misses += 1
+        if self._roi_misses >= self.max_roi_misses and self._fixed_roi is None:
+            # The clock is not where it used to be, so look for it again on the next read
+            self.roi = None
+            self._roi_misses = 0
+        return text or ''
+
+
+def evaluate_clock_readers(labelled_frames: Iterable[Tuple[np.ndarray, str]],
+                           clock_readers: Dict[str, ClockReader]) -> 'pd.DataFrame':
+    """
+    Checks the accuracy of clock readers on frames with a known game clock.
+
+    :param labelled_frames: (frame, clock text) pairs, like ("3:45" or "56.3"). All from the same broadcast graphic.
+    :param clock_readers: Name of the reader to the reader
+    :return: A row per reader, with its accuracy and its average read time in milliseconds
+    """
+    import pandas as pd
+
+    labelled_frames = list(labelled_frames)
+    rows = []
+    for name, clock_reader in clock_readers.items():
+        clock_reader.reset()
+        correct = 0
+        start_time = time.perf_counter()
+        for frame, label in labelled_frames:
+            correct += parse_game_clock(clock_reader.read_text(frame)) == parse_game_clock(label)
+        elapsed_time = time.perf_counter() - start_time
+        rows.append({'reader': name, 'accuracy': correct / len(labelled_frames),
+                     'ms_per_read': 1000 * elapsed_time / len(labelled_frames)})
+    return pd.DataFrame(rows, columns=['reader', 'accuracy', 'ms_per_read'])
+
+
+def load_labelled_clock_frames(directory: str) -> List[Tuple[np.ndarray, str]]:
+    """ Loads the images listed in the `labels.csv` (with `file` and `clock` columns) of the directory """
+    import pandas as pd
+
+    labels = pd.read_csv(os.path.join(directory, 'labels.csv'), dtype=str)
+    return [(cv2.imread(os.path.join(directory, file_name)), clock)
+            for file_name, clock in zip(labels['file'], labels['clock'])]
+
+
+@dataclass
+class CutVideoStats:
+    """ Counters filled by `cut_video`, so different search modes can be compared """
+    ocr_calls: int = 0
+    shot_frame: Optional[int] = None
+    # Frames read from the video, and seeks (each re-decodes from the previous keyframe)
+    frames_decoded: int = 0
+    seeks: int = 0
+    # Compressed packets written as they are, by the stream copy of the pyav backend
+    packets_copied: int = 0
+    buffer_bytes: int = 0
+    # Bytes fetched over HTTP, for cuts of remote videos
+    bytes_downloaded: int = 0
+
+
+class _ClockProbe:
+    """ Reads the scoreboard text at any frame of an open video. Each frame is read (and OCR-ed) at most once """
+
+    def __init__(self, cap, stats: CutVideoStats, clock_reader: ClockReader):
+        self.cap = cap
+        self.stats = stats
+        self.clock_reader = clock_reader
+        self._texts = {}
+
+    def text_at(self, frame_index: int) -> Optional[str]:
+        """ :return: The OCR text of the frame, or None if the video ended before that frame """
+        if frame_index not in self._texts:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+            self.stats.seeks += 1
+            ret, frame = self.cap.read()
+            if ret:
+                self.stats.frames_decoded += 1
+                self.stats.ocr_calls += 1
+                self._texts[frame_index] = self.clock_reader.read_text(frame)
+            else:
+                self._texts[frame_index] = None
+        return self._texts[frame_index]
+
+
+def _find_shot_frame_linear(probe: _ClockProbe, shot_time: str, fps: int) -> Optional[int]:
+    # Move one second at a time until the clock shows `shot_time`
+    current_frame = 0
+    while True:
+        text_data = probe.text_at(current_frame)
+        if text_data is None:
+            return None
+        if shot_time in text_data:
+            return current_frame
+        current_frame += fps
+
+
+def _find_shot_frame_gallop(probe: _ClockProbe, shot_time: str, fps: int) -> Optional[int]:
+    """
+    Finds the first frame showing `shot_time` by jumping ahead based on the clock readings it already made.
+
+    The game clock runs at most as fast as the video, so a clock reading `x` seconds above the target means the target
+    is at least `x` seconds ahead. While the clock is stopped, the jumps grow exponentially (galloping). Once a frame
+    at or below the target is found, the first frame showing the target is found by bisection.
+    """
+    target = parse_game_clock(shot_time)
+    if target is None:
+        raise ValueError(f"`{shot_time}` is not a game-clock reading")
+    target = int(target)
+    unreadable_step = max(1, fps // 2)
+
+    def reading_at(frame_index):
+        # 1 for a clock above the target, 0 for the target, -1 below it or past the end. None if unreadable.
+        text_data = probe.text_at(frame_index)
+        if text_data is None:
+            return -1
+        clock = parse_game_clock(text_data)
+        if clock is None:
+            return None
+        return (int(clock) > target) - (int(clock) < target)
+
+    # Gallop forward to bracket the target between `low` (above it) and `high` (at it or below it)
+    low, high = None, 0
+    last_clock, gallop_step = None, fps
+    while True:
+        text_data = probe.text_at(high)
+        if text_data is None:
+            break
+        clock = parse_game_clock(text_data)
+        if clock is None:
+            # No readable scoreboard here (replay, close-up...). Nudge forward until there is one.
+            high += unreadable_step
+            continue
+        if int(clock) <= target:
+            break
+        gallop_step = gallop_step * 2 if clock == last_clock else fps
+        low, last_clock = high, clock
+        high += max(gallop_step, int((clock - target) * fps))
+
+    # Bisect the bracket for the first frame showing the target
+    low = -1 if low is None else low
+    best_hit = high if reading_at(high) == 0 else None
+    while high - low > 1:
+        middle = (low + high) // 2
+        position, state = middle, reading_at(middle)
+        while state is None and position + unreadable_step < high:
+            position += unreadable_step
+            state = reading_at(position)
+        if state is None:
+            # Everything between `middle` and `high` is unreadable, so keep looking below it
+            high = middle
+        elif state > 0:
+            low = position
+        else:
+            if state == 0:
+                best_hit = position
+            high = middle
+    return best_hit
+
+
+_shot_frame_search_functions = {
+    'linear': _find_shot_frame_linear,
+    'gallop': _find_shot_frame_gallop,
+}
+
+
+def _cut_video_streaming(cap, clock_reader: ClockReader, shot_time: str, fps: int, fps_decrease_factor: float,
+                         offset_seconds_before: int, frames_to_record: int, output_path: str,
+                         new_resolution: Optional[Tuple[int, int]], new_fps: int, max_buffer_bytes: int,
+                         stats: CutVideoStats) -> int:
+    """
+    Cuts the video reading it forward only. The clock is read once a second like in the linear search, while the last
+    `offset_seconds_before` seconds of (already resized) frames are kept in a preallocated ring buffer. Once the clock
+    matches, the buffer is the beginning of the cut, so there's no need to seek back.
+
+    :return: The number of frames written to the cut video
+    """
+    # Read first frame
+    if not cap.grab():
+        # Video has ended, without us recording anything
+        return 0
+    stats.frames_decoded += 1
+    ret, frame = cap.retrieve()
+    height, width, channels = frame.shape
+    resolution = (width, height)
+    new_resolution = new_resolution if new_resolution else resolution
+
+    capacity = int(offset_seconds_before * new_fps)
+    buffer_bytes = capacity * new_resolution[0] * new_resolution[1] * channels
+    if buffer_bytes > max_buffer_bytes:
+        raise ValueError(f"{offset_seconds_before} seconds of {new_resolution} frames take {buffer_bytes} bytes, "
+                         f"more than the {max_buffer_bytes} bytes limit")
+    stats.buffer_bytes = buffer_bytes
+    ring_buffer = np.empty((capacity, new_resolution[1], new_resolution[0], channels), dtype=np.uint8)
+    buffered_frames = 0
+    current_frame = 0
+
+    def resize_into(source, destination):
+        if resolution != new_resolution:
+            cv2.resize(source, new_resolution, dst=destination, interpolation=cv2.INTER_AREA)
+        else:
+            np.copyto(destination, source)
+
+    with harvest_metrics.stage('cut_video.clock_scan'):
+        while True:
+            is_kept = current_frame % fps_decrease_factor == 0
+            is_clock_sample = current_frame % fps == 0
+            if current_frame > 0 and (is_kept or is_clock_sample):
+                # Only convert the frames we actually look at. The rest are just grabbed (decoded).
+                ret, frame = cap.retrieve()
+            if is_clock_sample:
+                stats.ocr_calls += 1
+                if shot_time in clock_reader.read_text(frame):
+                    stats.shot_frame = current_frame
+                    break
+            if is_kept and capacity:
+                resize_into(frame, ring_buffer[buffered_frames % capacity])
+                buffered_frames += 1
+            current_frame += 1
+            if not cap.grab():
+                # Video has ended, without us recording anything
+                return 0
+            stats.frames_decoded += 1
+
+    with harvest_metrics.stage('cut_video.write'):
+        # Initialize the video writer to save the cut video
+        fourcc = cv2.VideoWriter_fourcc(*'XVID')
+        out = cv2.VideoWriter(output_path, fourcc, new_fps, new_resolution, isColor=True)
+        new_video_current_frame = 0
+
+        # Write the pre-roll from the ring buffer, oldest frame first
+        pre_roll_frames = min(buffered_frames, capacity, frames_to_record)
+        for i in range(buffered_frames - pre_roll_frames, buffered_frames):
+            out.write(ring_buffer[i % capacity])
+            new_video_current_frame += 1
+
+        resized_frame = np.empty((new_resolution[1], new_resolution[0], channels), dtype=np.uint8)
+        while new_video_current_frame < frames_to_record:
+            if current_frame % fps_decrease_factor == 0:
+                resize_into(frame, resized_frame)
+                out.write(resized_frame)
+                new_video_current_frame += 1
+            current_frame += 1
+            # Read next frame
+            ret, frame = cap.read()
+            if not ret:
+                break
+            stats.frames_decoded += 1
+
+        # We're done recording
+        out.release()
+    return new_video_current_frame
+
+
+def _open_video_capture(video_path) -> cv2.VideoCapture:
+    if isinstance(video_path, io.IOBase):
+        # Decoding from a python stream needs the FFmpeg backend (and OpenCV >= 4.11)
+        return cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [])
+    return cv2.VideoCapture(video_path)
+
+
+@harvest_metrics.timed('cut_video')
+def cut_video(video_path, shot_time: str, offset_seconds_before: int, offset_seconds_after: int,
+              output_path: str, new_resolution: Optional[Tuple[int, int]] = None,
+              new_fps: Optional[int] = None, search_mode: str = 'linear',
+              stats: Optional[CutVideoStats] = None, clock_reader: Optional[ClockReader] = None,
+              max_buffer_bytes: int = 256 * 1024 ** 2, video_backend='opencv') -> bool:
+    """
+
+    :param video_path: Path to the video, or a binary file object (like `HTTPRangeReader`)
+    :param shot_time: The shot-clock reading, when the shot was taken
+    :param offset_seconds_before: How many seconds of the video to take before the alleged shot moment.
+    :param offset_seconds_after: How many seconds of the video to take after the alleged shot moment.
+    :param output_path: Cut video path
+    :param new_resolution: New video resolution
+    :param new_fps: New video fps
+    :param search_mode: How to look for the shot moment. 'linear' reads the clock every second, 'gallop' jumps ahead
+    according to the clock readings and refines with bisection, which takes far fewer OCR calls. 'stream' reads the
+    clock every second like 'linear', but decodes the video forward only, without seeking.
+    :param stats: If given, gets filled with the number of OCR calls and the frame of the shot moment
+    :param max_buffer_bytes: Memory limit for the pre-roll frames kept by the 'stream' mode
+    :param clock_reader: How to read the scoreboard. Defaults to tesseract over the bottom quarter of each frame. Pass
+    the same `TemplateClockReader` to many cuts, so it keeps the digit templates it learned.
+    :param video_backend: Writes the cut once the shot moment is found: 'opencv' (the default), 'pyav', or a
+    `VideoBackend`. The clock is always read with OpenCV, and the 'stream' mode always writes with OpenCV (its frames
+    are already decoded by then).
+    :return: Whether the video was cut successfully or not
+    """
+    minimum_cut_duration = 3
+
+    if search_mode not in _shot_frame_search_functions and search_mode != 'stream':
+        raise ValueError(f"Unknown search mode `{search_mode}`. "
+                         f"Options are {list(_shot_frame_search_functions) + ['stream']}")
+    stats = stats if stats is not None else CutVideoStats()
+    ocr_calls_before, frames_decoded_before = stats.ocr_calls, stats.frames_decoded
+    clock_reader = clock_reader if clock_reader is not None else TesseractClockReader()
+    clock_reader.reset()
+    video_backend = get_video_backend(video_backend)
+
+    cap = _open_video_capture(video_path)
+    fps = int(cap.get(cv2.CAP_PROP_FPS))
+    new_fps = new_fps if new_fps else fps
+
+    fps_decrease_factor = fps / new_fps
+    if not fps_decrease_factor.is_integer():
+        raise ValueError(f"New fps ({new_fps}) must be a divisor of the current fps ({fps})")
+    frames_to_record = int((offset_seconds_before + offset_seconds_after) * new_fps)
+    min_frames_to_record = int(minimum_cut_duration * new_fps)
+
+    try:
+        if search_mode == 'stream':
+            new_video_current_frame = _cut_video_streaming(
+                cap, clock_reader, shot_time, fps, fps_decrease_factor, offset_seconds_before, frames_to_record,
+                output_path, new_resolution, new_fps, max_buffer_bytes, stats
+            )
+            return new_video_current_frame > min_frames_to_record
+
+        # Find the frame where the game clock matches the condition, and we should start recording
+        probe = _ClockProbe(cap, stats, clock_reader)
+        with harvest_metrics.stage('cut_video.clock_scan'):
+            shot_frame = _shot_frame_search_functions[search_mode](probe, shot_time, fps)
+        stats.shot_frame = shot_frame
+        if shot_frame is None:
+            # Video has ended, without us recording anything
+            return False
+
+        # Jump the prior_offset_seconds back in the video to start the cut from there
+        current_frame = max(0, shot_frame - int(offset_seconds_before * fps))
+        number_of_frames = int(frames_to_record * fps_decrease_factor)
+        with harvest_metrics.stage('cut_video.write'):
+            if isinstance(video_backend, OpenCVVideoBackend):
+                new_video_current_frame = video_backend.write_frames(cap, output_path, new_resolution, new_fps,
+                                                                     current_frame, number_of_frames, stats)
+                return new_video_current_frame > min_frames_to_record
+            cap.release()
+            new_video_current_frame = video_backend.transcode(video_path, output_path, new_resolution, new_fps,
+                                                              current_frame, number_of_frames, stats)
+            return new_video_current_frame > min_frames_to_record
+
+    finally:
+        # Release the video capture and close all windows
+        cap.release()
+        harvest_metrics.count('ocr_calls', stats.ocr_calls - ocr_calls_before)
+        harvest_metrics.count('frames_decoded', stats.frames_decoded - frames_decoded_before)
+        # cv2.destroyAllWindows()
+
+
+def benchmark_cut_video_search_modes(video_path: str, shot_time: str, offset_seconds_before: int = 4,
+                                     offset_seconds_after: int = 1,
+                                     search_modes: Iterable[str] = ('linear', 'gallop', 'stream'),
+                                     **cut_video_kwargs) -> List[Dict]:
+    """
+    Cuts the same video with each search mode.
+
+    :return: A row per search mode, with the OCR calls, decoded frames, seeks, wall time and the cut result
+    """
+    rows = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for search_mode in search_modes:
+            stats = CutVideoStats()
+            start_time = time.perf_counter()
+            is_recording_successful = cut_video(
+                video_path=video_path, shot_time=shot_time,
+                offset_seconds_before=offset_seconds_before, offset_seconds_after=offset_seconds_after,
+                output_path=os.path.join(temp_dir, f'{search_mode}.avi'), search_mode=search_mode, stats=stats,
+                **cut_video_kwargs
+            )
+            rows.append({'search_mode': search_mode, 'ocr_calls': stats.ocr_calls,
+                         'frames_decoded': stats.frames_decoded, 'seeks': stats.seeks,
+                         'seconds': time.perf_counter() - start_time, 'shot_frame': stats.shot_frame,
+                         'success': is_recording_successful})
+    return rows
+
+
+def compare_cut_video_search_modes(videos_directory: str, offset_seconds_before: int = 4,
+                                   offset_seconds_after: int = 1,
+                                   search_modes: Iterable[str] = ('linear', 'gallop', 'stream'),
+                                   **cut_video_kwargs) -> 'pd.DataFrame':
+    """
+    Cuts every video in the videos bank with each search mode, to compare how many OCR calls, decoded frames and
+    seeks each one takes, and how long.
+
+    :param videos_directory: Folder with event folders, each having an `info.json` and the original `video.mp4`
+    :param offset_seconds_before: Like in `cut_video`
+    :param offset_seconds_after: Like in `cut_video`
+    :param search_modes: The `cut_video` search modes to compare
+    :return: A row per video and search mode
+    """
+    import pandas as pd
+    from tqdm import tqdm
+
+    rows = []
+    for info_path in tqdm(sorted(pathlib.Path(videos_directory).rglob('info.json'))):
+        video_path = info_path.with_name('video.mp4')
+        if not video_path.exists():
+            continue
+        with open(info_path) as f:
+            shot_time = add_seconds_to_time(json.load(f)['time'])
+        for row in benchmark_cut_video_search_modes(video_path.as_posix(), shot_time, offset_seconds_before,
+                                                    offset_seconds_after, search_modes, **cut_video_kwargs):
+            rows.append({'video': video_path.parent.name, **row})
+    return pd.DataFrame(rows, columns=['video', 'search_mode', 'ocr_calls', 'frames_decoded', 'seeks', 'seconds',
+                                       'shot_frame', 'success'])
+
+
+class HTTPRangeReader(io.BufferedIOBase):
+    """
+    A read-only, seekable file over a remote file, that downloads only the blocks that are read, with HTTP range
+    requests. The blocks after the last read are prefetched in the background, so while a block is decoded (and its
+    frames OCR-ed) the next ones are already arriving. Closing it stops the downloads.
+    """
+
+    def __init__(self, url: str, block_size: int = 512 * 1024, prefetch_blocks: int = 2,
+                 max_cached_blocks: int = 32, session: Optional['requests.Session'] = None, timeout: float = 30):
+        """
+        :param url: The remote file. The server has to support range requests.
+        :param block_size: Bytes per range request
+        :param prefetch_blocks: How many blocks to download ahead of the reads
+        :param max_cached_blocks: How many downloaded blocks to keep, for seeks back
+        :raises ValueError: If the server doesn't answer range requests with partial content
+        """
+        import requests
+
+        super().__init__()
+        self.url = url
+        self.block_size = block_size
+        self.prefetch_blocks = prefetch_blocks
+        self.max_cached_blocks = max(max_cached_blocks, prefetch_blocks + 1)
+        self.timeout = timeout
+        self._session = session or requests.Session()
+        self._owns_session = session is None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(prefetch_blocks, 1))
+        self._blocks: Dict[int, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        self._position = 0
+        self.bytes_downloaded = 0
+        self.requests_made = 0
+        self.size = None
+        first_block = concurrent.futures.Future()
+        first_block.set_result(self._fetch_block(0))
+        self._blocks[0] = first_block
+
+    def _fetch_block(self, block_index: int) -> bytes:
+        start = block_index * self.block_size
+        end = start + self.block_size - 1 if self.size is None else min(start + self.block_size, self.size) - 1
+        with self._session.get(self.url, headers={'Range': f"bytes={start}-{end}"}, timeout=self.timeout,
+                               stream=True) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise ValueError(f"{self.url} doesn't support range requests (got status {response.status_code})")
+            content = response.content
+            if self.size is None:
+                # Content-Range: bytes <start>-<end>/<size>
+                self.size = int(response.headers['Content-Range'].rsplit('/', 1)[1])
+        with self._lock:
+            self.bytes_downloaded += len(content)
+            self.requests_made += 1
+        return content
+
+    def _block(self, block_index: int) -> concurrent.futures.Future:
+        """ Must be called with the lock held """
+        if block_index not in self._blocks:
+            self._blocks[block_index] = self._executor.submit(self._fetch_block, block_index)
+            while len(self._blocks) > self.max_cached_blocks:
+                del self._blocks[next(iter(self._blocks))]
+        return self._blocks[block_index]
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence ({whence})")
+        self._position = max(self._position, 0)
+        return self._position
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        remaining = self.size - self._position
+        size = remaining if size is None or size < 0 else min(size, remaining)
+        chunks = []
+        while size > 0:
+            block_index, block_offset = divmod(self._position, self.block_size)
+            with self._lock:
+                future = self._block(block_index)
+                for next_block_index in range(block_index + 1, block_index + 1 + self.prefetch_blocks):
+                    if next_block_index * self.block_size < self.size:
+                        self._block(next_block_index)
+            chunk = future.result()[block_offset:block_offset + size]
+            chunks.append(chunk)
+            self._position += len(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def close(self):
+        if not self.closed:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            if self._owns_session:
+                self._session.close()
+        super().close()
+
+
+@harvest_metrics.timed('cut_video_from_url')
+def cut_video_from_url(video_path: str, shot_time: str, offset_seconds_before: int, offset_seconds_after: int,
+                       output_path: str, search_mode: str = 'stream', stats: Optional[CutVideoStats] = None,
+                       block_size: int = 512 * 1024, prefetch_blocks: int = 2, **cut_video_kwargs) -> bool:
+    """
+    Like `cut_video`, but for a remote video, fetching only the parts of it that are decoded (with `HTTPRangeReader`),
+    instead of downloading all of it first. Downloading stops as soon as the cut is written, so with the default
+    'stream' search mode, nothing after the end of the cut is fetched (apart from the mp4 index, wherever it is).
+    If the server doesn't support range requests, the whole video is downloaded to a temporary file and cut from there.
+
+    :param video_path: The video url (named like in `cut_video`, so the harvester can call both the same way)
+    :return: Whether the video was cut successfully or not
+    """
+    stats = stats if stats is not None else CutVideoStats()
+    cut_arguments = dict(shot_time=shot_time, offset_seconds_before=offset_seconds_before,
+                         offset_seconds_after=offset_seconds_after, output_path=output_path, search_mode=search_mode,
+                         stats=stats, **cut_video_kwargs)
+    try:
+        reader = HTTPRangeReader(video_path, block_size=block_size, prefetch_blocks=prefetch_blocks)
+    except ValueError:
+        import requests
+
+        logger.warning(f"No range requests for {video_path}, downloading all of it")
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(output_path) or None) as temp_directory:
+            temp_video_path = os.path.join(temp_directory, 'video.mp4')
+            with requests.get(video_path, stream=True, timeout=30) as response, open(temp_video_path, 'wb') as f:
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size=block_size):
+                    stats.bytes_downloaded += len(chunk)
+                    f.write(chunk)
+            harvest_metrics.count('bytes_downloaded', os.path.getsize(temp_video_path))
+            return cut_video(temp_video_path, **cut_arguments)
+
+    try:
+        return cut_video(reader, **cut_arguments)
+    finally:
+        reader.close()
+        stats.bytes_downloaded += reader.bytes_downloaded
+        harvest_metrics.count('bytes_downloaded', reader.bytes_downloaded)
+        harvest_metrics.count('range_requests', reader.requests_made)
+
+
+def _cut_and_validate(cut_function, cut_kwargs: Dict, metrics_path: Optional[str] = None,
+                      event: Optional[str] = None) -> bool:
+    """
+    Runs in the cut worker process. A cut is valid if it succeeded and the written clip can be decoded
+
+    :param metrics_path: The harvest's `harvest_metrics.jsonl_path`, if the metrics are enabled
+    :param event: Labels the metrics of the cut
+    """
+    if metrics_path is not None and not harvest_metrics.enabled:
+        # A spawned worker process, that didn't inherit the harvest's metrics
+        harvest_metrics.enable(metrics_path)
+    with harvest_metrics.event(event):
+        if not cut_function(**cut_kwargs):
+            return False
+        return probe_video(cut_kwargs['output_path'])['decodes']
+
+
+def probe_video(video_path, full_decode: bool = False) -> Dict:
+    """
+    Reads a video's container header, and checks that it decodes: its first and last frames (a truncated file loses
+    its last frames), or all of its frames with `full_decode`.
+
+    :return: Its number of 'frames' (per the header), 'fps', 'width', 'height', 'seconds', and whether it 'decodes'
+    """
+    cap = _open_video_capture(str(video_path))
+    try:
+        frames = max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 0)
+        fps = max(cap.get(cv2.CAP_PROP_FPS), 0.0)
+        probe = {'frames': frames, 'fps': fps, 'width': max(int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), 0),
+                 'height': max(int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), 0), 'seconds': frames / fps if fps else 0.0}
+        if not cap.isOpened() or frames == 0:
+            decodes = False
+        elif full_decode:
+            decoded_frames = 0
+            while cap.grab():
+                decoded_frames += 1
+            decodes = decoded_frames >= frames
+        else:
+            decodes = cap.read()[0]
+            if decodes and frames > 1:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frames - 1)
+                decodes = cap.read()[0]
+        return {**probe, 'decodes': bool(decodes)}
+    finally:
+        cap.release()